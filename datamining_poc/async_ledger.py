@@ -0,0 +1,446 @@
+import asyncio
+import logging
+import logging.config
+from ledger_stats import LedgerStats
+from user_index import TOP_TRANSACTIONS
+
+# Define logger
+logging.config.fileConfig('logging.conf')
+logger = logging.getLogger('async_ledger')
+
+
+class AsyncLedger(object):
+    """
+    AsyncLedger - an asyncio client for a Ledger. Blocking storage calls run
+                  in worker threads so they never block the event loop, and
+                  scans fetch many blocks at once. Results are produced by
+                  the wrapped Ledger, so they match the synchronous class.
+
+    """
+    def __init__(self, sync_ledger, concurrency=16):
+        """
+        Initializes an instance of the AsyncLedger class
+
+        Parameters:
+            self : the instance of the class
+            sync_ledger : the ledger.Ledger object to wrap
+            concurrency : the maximum number of blocks fetched at once
+
+        Returns:
+            N/A
+        """
+        self.ledger = sync_ledger
+        # Bounds the number of block downloads in flight, and the number of
+        # blocks a scan holds at once
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+        # Serializes writes, which mutate the buffered block and counters
+        self.write_lock = asyncio.Lock()
+
+    async def run_locked(self, func, *args):
+        """
+        Runs a Ledger method in a worker thread while holding the write lock
+
+        Parameters:
+            self : the instance of the class
+            func : the Ledger method to run
+            args : the arguments for the method
+
+        Returns:
+            The return value of the method
+        """
+        async with self.write_lock:
+            return await asyncio.to_thread(func, *args)
+
+    async def add_block_header(self, block_header):
+        """
+        Adds a header to the open block
+
+        Parameters:
+            self : the instance of the class
+            block_header : the header (dictionary) being added
+
+        Returns:
+            N/A
+        """
+        return await self.run_locked(self.ledger.add_block_header,
+                                     block_header)
+
+    async def add_transaction(self, sender, recipient, amount):
+        """
+        Adds a new transaction
+
+        Parameters:
+            self : the instance of the class
+            sender : the name of the person sending the amount
+            recipient : the name of the person receiving the amount
+            amount : the amount of the transaction
+
+        Returns:
+            The tid assigned to the transaction
+        """
+        return await self.run_locked(self.ledger.add_transaction, sender,
+                                     recipient, amount)
+
+    async def add_transactions(self, records):
+        """
+        Adds a batch of transactions and cancellations, as
+        Ledger.add_transactions
+
+        Parameters:
+            self : the instance of the class
+            records : an iterable of (sender, recipient, amount) tuples and
+                      {'cancelled_tid': tid} dictionaries
+
+        Returns:
+            The list of assigned tids, -1 for a cancellation of a tid that
+            does not exist
+        """
+        # Materialize the records so a generator is not consumed in a thread
+        return await self.run_locked(self.ledger.add_transactions,
+                                     list(records))
+
+    async def cancel_transaction(self, tid):
+        """
+        Cancels a transaction
+
+        Parameters:
+            self : the instance of the class
+            tid : the transaction id to be cancelled
+
+        Returns:
+            The tid of the cancellation record, or -1 if the transaction does
+            not exist
+        """
+        return await self.run_locked(self.ledger.cancel_transaction, tid)
+
+    async def flush(self):
+        """
+        Writes the buffered open block to storage
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            N/A
+        """
+        return await self.run_locked(self.ledger.flush)
+
+    async def checkpoint(self):
+        """
+        Writes the buffered open block and the indexes to storage
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            N/A
+        """
+        return await self.run_locked(self.ledger.checkpoint)
+
+    async def transaction_exists(self, tid):
+        """
+        Checks if a transaction exists. Answered from the in-memory tid
+        index, so it runs directly on the event loop.
+
+        Parameters:
+            self : the instance of the class
+            tid : the transaction id to check
+
+        Returns:
+            True if the transaction exists, False otherwise
+        """
+        return self.ledger.transaction_exists(tid)
+
+    async def is_cancelled(self, tid):
+        """
+        Checks if a transaction has been cancelled. Answered from the
+        in-memory tid index, so it runs directly on the event loop.
+
+        Parameters:
+            self : the instance of the class
+            tid : the transaction id to check
+
+        Returns:
+            True if the transaction has been cancelled, False otherwise
+        """
+        return self.ledger.is_cancelled(tid)
+
+    async def get_transaction(self, tid):
+        """
+        Looks up a single transaction or cancellation record, reading only
+        the block holding it
+
+        Parameters:
+            self : the instance of the class
+            tid : the transaction id to look up
+
+        Returns:
+            The transaction dictionary, or None if the tid does not exist
+        """
+        return await self.run_locked(self.ledger.get_transaction, tid)
+
+    async def fetch_block(self, filename):
+        """
+        Downloads and parses a single block in a worker thread, limited by
+        the concurrency semaphore
+
+        Parameters:
+            self : the instance of the class
+            filename : the name of the block file
+
+        Returns:
+            ledger_data : the parsed block
+        """
+        async with self.semaphore:
+            # The open block is taken from the ledger's buffer
+            return await asyncio.to_thread(self.ledger.read_block, filename)
+
+    async def fetch_blocks(self, filenames=None):
+        """
+        Downloads and parses many blocks concurrently
+
+        Parameters:
+            self : the instance of the class
+            filenames : the block files to fetch, or None for every block of
+                        the ledger
+
+        Returns:
+            A list of (block file, ledger data) tuples in the order of
+            filenames, or in chain order if all blocks are fetched
+        """
+        if filenames is None:
+            # List the blocks while holding the write lock, so the listing
+            # matches the buffered open block
+            filenames = await self.run_locked(
+                lambda: list(self.ledger.yield_block_files(
+                    self.ledger.filedir)))
+        logger.debug('Fetching %d block(s) concurrently', len(filenames))
+        blocks = await asyncio.gather(
+            *[self.fetch_block(f) for f in filenames])
+        return list(zip(filenames, blocks))
+
+    async def iter_blocks(self):
+        """
+        Asynchronous generator that yields every block of the ledger in
+        chain order. Blocks are fetched concurrently in batches of the
+        concurrency limit, so only one batch is held in memory at a time.
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            A (block file, ledger data) tuple for the next block
+        """
+        # List the blocks while holding the write lock, so the listing
+        # matches the buffered open block
+        filenames = await self.run_locked(
+            lambda: list(self.ledger.yield_block_files(self.ledger.filedir)))
+        for start in range(0, len(filenames), self.concurrency):
+            batch = filenames[start:start + self.concurrency]
+            blocks = await asyncio.gather(
+                *[self.fetch_block(f) for f in batch])
+            for f, ledger_data in zip(batch, blocks):
+                yield f, ledger_data
+
+    async def scan(self):
+        """
+        Fetches every block, a batch at a time, and computes the statistics
+        in a single pass, in chain order, excluding cancelled transactions
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            stats : the LedgerStats object holding the computed statistics
+        """
+        stats = LedgerStats(known_cancelled=self.ledger.tid_index.cancelled,
+                            tid_base=self.ledger.tid_base)
+        async for f, ledger_data in self.iter_blocks():
+            for t in ledger_data['transactions']:
+                stats.add(t)
+        return stats
+
+    async def transactions_in_range(self, first_tid, last_tid):
+        """
+        Returns all records with a tid between first_tid and last_tid,
+        inclusive, fetching the overlapping blocks concurrently
+
+        Parameters:
+            self : the instance of the class
+            first_tid : the lowest tid to return
+            last_tid : the highest tid to return
+
+        Returns:
+            A list of transaction dictionaries in tid order
+        """
+        async with self.write_lock:
+            filenums = self.ledger.find_blocks(first_tid, last_tid)
+            # The open block is still buffered in memory
+            open_block = None
+            if self.ledger.filenum in filenums:
+                filenums.remove(self.ledger.filenum)
+                open_block = list(self.ledger.block_data['transactions'])
+
+        filenames = [self.ledger.block_filename(n) for n in filenums]
+        transactions = []
+        for f, ledger_data in await self.fetch_blocks(filenames):
+            transactions.extend(ledger_data['transactions'])
+        if open_block is not None:
+            transactions.extend(open_block)
+        return [t for t in transactions if first_tid <= t['tid'] <= last_tid]
+
+    async def history(self, user, include_cancelled=False):
+        """
+        Returns the transactions a user sent or received
+
+        Parameters:
+            self : the instance of the class
+            user : the name of the user
+            include_cancelled : True to also return transactions that have
+                                been cancelled
+
+        Returns:
+            A list of transaction dictionaries in tid order
+        """
+        return await self.run_locked(self.ledger.history, user,
+                                     include_cancelled)
+
+    async def balance(self, user):
+        """
+        Returns the balance of a user. Answered from the in-memory user
+        index, so it runs directly on the event loop.
+
+        Parameters:
+            self : the instance of the class
+            user : the name of the user
+
+        Returns:
+            The amount the user received minus the amount they sent
+        """
+        return self.ledger.balance(user)
+
+    async def top_users(self, n=10, by=TOP_TRANSACTIONS):
+        """
+        Returns the n users with the most transactions, the highest balance
+        or the highest volume
+
+        Parameters:
+            self : the instance of the class
+            n : the number of users to return
+            by : user_index.TOP_TRANSACTIONS, TOP_BALANCE or TOP_VOLUME
+
+        Returns:
+            A list of (user, value) tuples, highest value first
+        """
+        return await self.run_locked(self.ledger.top_users, n, by)
+
+    async def statistics(self):
+        """
+        Returns the statistics of the whole ledger. The columnar engine
+        reads every block, so the call runs in a worker thread.
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            stats : the LedgerStats object for the ledger
+        """
+        return await self.run_locked(self.ledger.statistics)
+
+    async def transaction_count(self):
+        """
+        Returns the number of transactions in the ledger
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            The total number of transactions
+        """
+        return await self.run_locked(self.ledger.transaction_count)
+
+    async def cancelled_transaction_count(self):
+        """
+        Returns the number of cancellations in the ledger
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            The total number of cancellation records
+        """
+        return await self.run_locked(self.ledger.cancelled_transaction_count)
+
+    async def net_value(self):
+        """
+        Returns the net value of all transactions that were not cancelled
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            The sum of the transaction amounts
+        """
+        return await self.run_locked(self.ledger.net_value)
+
+    async def average_value(self):
+        """
+        Returns the average value of all transactions that were not
+        cancelled
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            The average transaction amount
+        """
+        return await self.run_locked(self.ledger.average_value)
+
+    async def get_transaction_count_by_user(self):
+        """
+        Returns the number of transactions of each user
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            A dictionary mapping each user to their number of transactions
+        """
+        return await self.run_locked(self.ledger.get_transaction_count_by_user)
+
+    async def get_debits(self):
+        """
+        Returns the sum of the debits of each user
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            A dictionary mapping each user to the amount they sent
+        """
+        return await self.run_locked(self.ledger.get_debits)
+
+    async def get_credits(self):
+        """
+        Returns the sum of the credits of each user
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            A dictionary mapping each user to the amount they received
+        """
+        return await self.run_locked(self.ledger.get_credits)
+
+    async def generate_report(self):
+        """
+        Generates the report of the ledger and writes it to storage
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            N/A
+        """
+        return await self.run_locked(self.ledger.generate_report)
@@ -0,0 +1,103 @@
+import argparse
+import time
+import logging
+import logging.config
+import ledger
+import storage
+import trangen
+import block_codec
+from block_format import (FORMAT_JSON, FORMAT_COLUMNAR, encode_block,
+                          decode_block)
+
+logging.config.fileConfig('logging.conf')
+logger = logging.getLogger('bench_codecs')
+
+
+def generate_blocks(count):
+    """
+    Generates a ledger with TranGEN in memory and returns its blocks
+
+    Parameters:
+        count : the number of transactions to generate
+
+    Returns:
+        A list of the ledger data of every block
+    """
+    bench_ledger = ledger.Ledger('/bench', storage.MemoryStorage())
+    trangen.TranGEN().generate_transactions(bench_ledger, count)
+    return [ledger_data for f, ledger_data in bench_ledger.iter_blocks()]
+
+
+def run_benchmark(blocks, repeat=3):
+    """
+    Measures the stored size and the compression and decompression time of
+    the blocks for every block format and codec
+
+    Parameters:
+        blocks : the list of block ledger data to encode
+        repeat : the number of timing runs; the fastest run is reported
+
+    Returns:
+        A list of result dictionaries, one per format and codec
+    """
+    results = []
+    for block_format in (FORMAT_JSON, FORMAT_COLUMNAR):
+        encoded = [encode_block(b, block_format) for b in blocks]
+        raw_size = sum(len(e) for e in encoded)
+        for codec in block_codec.CODECS:
+            compress_time = float('inf')
+            decompress_time = float('inf')
+            for i in range(repeat):
+                start = time.perf_counter()
+                stored = [block_codec.compress(e, codec) for e in encoded]
+                compress_time = min(compress_time,
+                                    time.perf_counter() - start)
+
+                start = time.perf_counter()
+                for data, metadata in stored:
+                    decode_block(block_codec.decompress(data, metadata))
+                decompress_time = min(decompress_time,
+                                      time.perf_counter() - start)
+
+            size = sum(len(data) for data, metadata in stored)
+            results.append({'format': block_format,
+                            'codec': codec,
+                            'bytes': size,
+                            'ratio': raw_size / size if size else 0,
+                            'compress_ms': compress_time * 1000,
+                            'read_ms': decompress_time * 1000})
+    return results
+
+
+def main():
+    """
+    Runs the codec benchmark and prints a table of the results
+
+    Parameters:
+        N/A
+
+    Returns:
+        N/A
+    """
+    parser = argparse.ArgumentParser(
+        description='Compare block size and CPU cost of the block formats '
+                    'and compression codecs on a TranGEN ledger')
+    parser.add_argument('--transactions', type=int, default=2048,
+                        help='number of transactions to generate')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of timing runs per codec')
+    args = parser.parse_args()
+
+    logger.info('Generating %d transactions...', args.transactions)
+    blocks = generate_blocks(args.transactions)
+
+    print('{:<10} {:<6} {:>12} {:>7} {:>13} {:>13}'.format(
+        'format', 'codec', 'bytes', 'ratio', 'compress ms', 'read ms'))
+    for r in run_benchmark(blocks, args.repeat):
+        print('{:<10} {:<6} {:>12,} {:>7.2f} {:>13.2f} {:>13.2f}'.format(
+            r['format'], r['codec'], r['bytes'], r['ratio'],
+            r['compress_ms'], r['read_ms']))
+
+
+if __name__ == '__main__':
+    main()
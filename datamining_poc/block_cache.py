@@ -0,0 +1,133 @@
+import threading
+from collections import OrderedDict
+
+
+class BlockCache(object):
+    """
+    BlockCache - a size-bounded, least recently used cache of parsed blocks
+                 keyed by object key. Each entry remembers the ETag of the
+                 object it was parsed from. Sealed blocks never change, so
+                 they are served without validation until evicted; the open
+                 block must be validated against storage before reuse.
+
+    """
+    def __init__(self, max_blocks=64):
+        """
+        Initializes an instance of the BlockCache class
+
+        Parameters:
+            self : the instance of the class
+            max_blocks : the maximum number of parsed blocks kept in the
+                         cache. 0 disables caching.
+
+        Returns:
+            N/A
+        """
+        self.max_blocks = max_blocks
+        # Maps object key to a (ledger data, etag, sealed) tuple, least
+        # recently used first
+        self.entries = OrderedDict()
+        # Blocks are read from several prefetch threads at once
+        self.lock = threading.Lock()
+
+        # Counters for tuning the cache size
+        self.hits = 0
+        self.misses = 0
+        self.validations = 0
+        self.evictions = 0
+
+    def lookup(self, key):
+        """
+        Returns the cached entry for a key and marks it as recently used
+
+        Parameters:
+            self : the instance of the class
+            key : the object key of the block
+
+        Returns:
+            A (ledger data, etag, sealed) tuple, or None if the key is not
+            cached
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def store(self, key, ledger_data, etag):
+        """
+        Adds or replaces the parsed block for a key, evicting the least
+        recently used blocks when the cache is full
+
+        Parameters:
+            self : the instance of the class
+            key : the object key of the block
+            ledger_data : the parsed block
+            etag : the ETag of the object the block was parsed from
+
+        Returns:
+            N/A
+        """
+        if self.max_blocks <= 0:
+            return
+        # A block with a next block entry has been sealed
+        sealed = 'next_block' in ledger_data
+        with self.lock:
+            self.entries[key] = (ledger_data, etag, sealed)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_blocks:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """
+        Removes the entry for a key, for example after the block was written
+
+        Parameters:
+            self : the instance of the class
+            key : the object key of the block
+
+        Returns:
+            N/A
+        """
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def record(self, hit, validated=False):
+        """
+        Updates the hit/miss counters
+
+        Parameters:
+            self : the instance of the class
+            hit : True for a cache hit, False for a miss
+            validated : True if the lookup required an ETag validation
+
+        Returns:
+            N/A
+        """
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            if validated:
+                self.validations += 1
+
+    def info(self):
+        """
+        Returns the cache counters
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            A dictionary with the hits, misses, validations, evictions,
+            current size and maximum size of the cache
+        """
+        with self.lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'validations': self.validations,
+                    'evictions': self.evictions,
+                    'size': len(self.entries),
+                    'max_blocks': self.max_blocks}
@@ -0,0 +1,57 @@
+import bz2
+import gzip
+import lzma
+import zlib
+
+# Compression codecs available for block objects. The codec a block was
+# written with is stored in the object's metadata, so blocks written with
+# different codecs can be mixed in one ledger.
+CODEC_NONE = 'none'
+CODECS = {
+    CODEC_NONE: (lambda data: data, lambda data: data),
+    'zlib': (zlib.compress, zlib.decompress),
+    # A fixed mtime keeps gzip output identical for identical blocks
+    'gzip': (lambda data: gzip.compress(data, mtime=0), gzip.decompress),
+    'bz2': (bz2.compress, bz2.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+}
+
+# Metadata entry naming the codec of an object
+METADATA_KEY = 'codec'
+
+
+def compress(data, codec):
+    """
+    Compresses block data with the specified codec
+
+    Parameters:
+        data : the encoded block as bytes
+        codec : the name of the codec, one of CODECS
+
+    Returns:
+        A (data, metadata) tuple with the compressed data and the metadata
+        to store with the object
+    """
+    if codec not in CODECS:
+        raise ValueError('Unknown codec: ' + str(codec))
+    if codec == CODEC_NONE:
+        return data, None
+    return CODECS[codec][0](data), {METADATA_KEY: codec}
+
+
+def decompress(data, metadata):
+    """
+    Decompresses block data using the codec named in the object's metadata.
+    Objects without a codec entry are uncompressed.
+
+    Parameters:
+        data : the stored object as bytes
+        metadata : the metadata stored with the object, or None
+
+    Returns:
+        The decompressed data
+    """
+    codec = (metadata or {}).get(METADATA_KEY, CODEC_NONE)
+    if codec not in CODECS:
+        raise ValueError('Unknown codec: ' + str(codec))
+    return CODECS[codec][1](data)
@@ -0,0 +1,192 @@
+import sys
+import json
+import struct
+from array import array
+
+# Block encodings. Blocks are always readable in either format; the format
+# only selects how new blocks are written.
+FORMAT_JSON = 'json'
+FORMAT_COLUMNAR = 'columnar'
+
+# Leading bytes of a columnar block. A JSON block always starts with '{'.
+MAGIC = b'LBLK'
+VERSION = 1
+
+# Magic, version and the length of the metadata section
+PREFIX = struct.Struct('<4sBI')
+
+# Range of values that fit in the packed 64-bit integer columns
+INT64_MIN = -2**63
+INT64_MAX = 2**63 - 1
+
+
+def encode_block(ledger_data, block_format=FORMAT_JSON):
+    """
+    Encodes a block in the requested format
+
+    Parameters:
+        ledger_data : the block dictionary with 'hdr', 'transactions' and
+                      optional 'next_block' and 'footer' entries
+        block_format : FORMAT_JSON or FORMAT_COLUMNAR
+
+    Returns:
+        The encoded block as bytes
+    """
+    if block_format == FORMAT_COLUMNAR:
+        data = encode_columnar(ledger_data)
+        if data is not None:
+            return data
+    elif block_format != FORMAT_JSON:
+        raise ValueError('Unknown block format: ' + str(block_format))
+    return json.dumps(ledger_data, indent=4).encode('utf-8')
+
+
+def decode_block(data):
+    """
+    Decodes a block written in either format
+
+    Parameters:
+        data : the encoded block as bytes
+
+    Returns:
+        ledger_data : the block dictionary
+    """
+    if data[:len(MAGIC)] == MAGIC:
+        return decode_columnar(data)
+    return json.loads(data.decode('utf-8'))
+
+
+def encode_columnar(ledger_data):
+    """
+    Encodes a block in the columnar format. User names are stored once in a
+    dictionary and referenced by code; tids, user codes, amounts and
+    cancelled tids are stored as packed arrays.
+
+    Parameters:
+        ledger_data : the block dictionary
+
+    Returns:
+        The encoded block as bytes, or None if a transaction does not fit
+        the columnar layout and the block must be written as JSON
+    """
+    transactions = ledger_data['transactions']
+    users = {}
+    tids = array('q')
+    senders = array('i')
+    receivers = array('i')
+    amounts = []
+    cancelled_tids = array('q')
+
+    for t in transactions:
+        if set(t) == {'tid', 'sender', 'receiver', 'amount'}:
+            sender = users.setdefault(t['sender'], len(users))
+            receiver = users.setdefault(t['receiver'], len(users))
+            senders.append(sender)
+            receivers.append(receiver)
+            amounts.append(t['amount'])
+            cancelled_tids.append(-1)
+        elif set(t) == {'tid', 'cancelled_tid'}:
+            if not fits_int64(t['cancelled_tid']) or t['cancelled_tid'] < 0:
+                return None
+            senders.append(-1)
+            receivers.append(-1)
+            amounts.append(0)
+            cancelled_tids.append(t['cancelled_tid'])
+        else:
+            return None
+        if not fits_int64(t['tid']):
+            return None
+        tids.append(t['tid'])
+
+    # Amounts are packed as integers, or as doubles if every amount is a
+    # float. Anything else is written as JSON.
+    if all(type(a) is int and fits_int64(a) for a in amounts):
+        amount_type = 'q'
+    elif all(type(a) is float for a, t in zip(amounts, transactions)
+             if 'cancelled_tid' not in t):
+        amount_type = 'd'
+        amounts = [float(a) for a in amounts]
+    else:
+        return None
+    if not all(type(name) is str for name in users):
+        return None
+
+    meta = {k: v for k, v in ledger_data.items() if k != 'transactions'}
+    meta['users'] = list(users)
+    meta['count'] = len(transactions)
+    meta['amount_type'] = amount_type
+    meta_bytes = json.dumps(meta, separators=(',', ':')).encode('utf-8')
+
+    columns = [tids, senders, receivers, array(amount_type, amounts),
+               cancelled_tids]
+    parts = [PREFIX.pack(MAGIC, VERSION, len(meta_bytes)), meta_bytes]
+    for column in columns:
+        # Columns are always stored little-endian
+        if sys.byteorder == 'big':
+            column.byteswap()
+        parts.append(column.tobytes())
+    return b''.join(parts)
+
+
+def decode_columnar(data):
+    """
+    Decodes a block written in the columnar format
+
+    Parameters:
+        data : the encoded block as bytes
+
+    Returns:
+        ledger_data : the block dictionary, identical to the one that was
+                      encoded
+    """
+    magic, version, meta_len = PREFIX.unpack_from(data)
+    if version != VERSION:
+        raise ValueError('Unsupported columnar block version: ' +
+                         str(version))
+    offset = PREFIX.size
+    meta = json.loads(data[offset:offset + meta_len].decode('utf-8'))
+    offset += meta_len
+
+    count = meta.pop('count')
+    users = meta.pop('users')
+    amount_type = meta.pop('amount_type')
+
+    columns = []
+    for typecode in ('q', 'i', 'i', amount_type, 'q'):
+        column = array(typecode)
+        size = column.itemsize * count
+        column.frombytes(data[offset:offset + size])
+        if sys.byteorder == 'big':
+            column.byteswap()
+        columns.append(column)
+        offset += size
+    tids, senders, receivers, amounts, cancelled_tids = columns
+
+    transactions = []
+    for i in range(count):
+        if cancelled_tids[i] >= 0:
+            transactions.append({'tid': tids[i],
+                                 'cancelled_tid': cancelled_tids[i]})
+        else:
+            transactions.append({'tid': tids[i],
+                                 'sender': users[senders[i]],
+                                 'receiver': users[receivers[i]],
+                                 'amount': amounts[i]})
+
+    # Restore the original key order: header, transactions, then the rest
+    ledger_data = {'hdr': meta.pop('hdr', {}), 'transactions': transactions}
+    ledger_data.update(meta)
+    return ledger_data
+
+
+def fits_int64(value):
+    """
+    Checks if a value can be stored in a packed 64-bit integer column
+
+    Parameters:
+        value : the value to check
+
+    Returns:
+        True if the value is an int within the 64-bit range, False otherwise
+    """
+    return type(value) is int and INT64_MIN <= value <= INT64_MAX
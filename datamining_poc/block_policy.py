@@ -0,0 +1,117 @@
+import json
+import time
+
+# Default maximum number of records in a block
+DEFAULT_MAX_TRANSACTIONS = 256
+
+
+class BlockPolicy(object):
+    """
+    BlockPolicy - decides when the ledger seals its open block and starts a
+                  new one. A block is sealed as soon as any of the limits is
+                  reached: its number of records (transactions and
+                  cancellations), its approximate serialized size, or the
+                  time since its first record was added.
+
+    """
+    def __init__(self, max_transactions=DEFAULT_MAX_TRANSACTIONS,
+                 max_bytes=None, max_age=None):
+        """
+        Initializes an instance of the BlockPolicy class
+
+        Parameters:
+            self : the instance of the class
+            max_transactions : the maximum number of records in a block, or
+                               None for no limit
+            max_bytes : the maximum size in bytes of the records of a block,
+                        serialized as compact JSON, or None for no limit
+            max_age : the maximum number of seconds between the first record
+                      of a block and its sealing, or None for no limit. The
+                      age is checked whenever a record is added and when
+                      Ledger.seal_if_due is called.
+
+        Returns:
+            N/A
+        """
+        if max_transactions is None and max_bytes is None and max_age is None:
+            raise ValueError('A block policy needs at least one limit')
+        for name, limit in (('max_transactions', max_transactions),
+                            ('max_bytes', max_bytes), ('max_age', max_age)):
+            if limit is not None and limit <= 0:
+                raise ValueError(name + ' must be positive')
+        self.max_transactions = max_transactions
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def record_size(self, transaction):
+        """
+        Returns the size a record adds to a block, if sizes are tracked
+
+        Parameters:
+            self : the instance of the class
+            transaction : the transaction dictionary
+
+        Returns:
+            The size of the record serialized as compact JSON, or 0 if the
+            policy has no size limit
+        """
+        if self.max_bytes is None:
+            return 0
+        return len(json.dumps(transaction, separators=(',', ':'))) + 1
+
+    def is_full(self, transaction_count, block_bytes, opened_at, now=None):
+        """
+        Checks whether a block has reached any of the limits
+
+        Parameters:
+            self : the instance of the class
+            transaction_count : the number of records in the block
+            block_bytes : the total record size of the block
+            opened_at : the time the first record was added, or None for an
+                        empty block
+            now : the current time, or None to read the clock
+
+        Returns:
+            True if the block must be sealed, False otherwise
+        """
+        if transaction_count == 0:
+            return False
+        if (self.max_transactions is not None
+                and transaction_count >= self.max_transactions):
+            return True
+        if self.max_bytes is not None and block_bytes >= self.max_bytes:
+            return True
+        if self.max_age is not None and opened_at is not None:
+            if now is None:
+                now = time.time()
+            return now - opened_at >= self.max_age
+        return False
+
+    def to_dict(self):
+        """
+        Converts the policy into a dictionary that can be stored as JSON
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            A dictionary holding the limits
+        """
+        return {'max_transactions': self.max_transactions,
+                'max_bytes': self.max_bytes,
+                'max_age': self.max_age}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Creates a BlockPolicy object from a dictionary produced by to_dict
+
+        Parameters:
+            cls : the BlockPolicy class
+            data : the dictionary holding the limits
+
+        Returns:
+            The restored BlockPolicy object
+        """
+        return cls(data['max_transactions'], data['max_bytes'],
+                   data['max_age'])
@@ -0,0 +1,356 @@
+import json
+import math
+import time
+import functools
+import threading
+from storage import Storage
+
+# Percentiles reported for every operation
+PERCENTILES = [50, 95, 99]
+
+
+class LatencyHistogram(object):
+    """
+    LatencyHistogram - counts latencies in logarithmic buckets, four per
+                       doubling from one microsecond, so percentiles can be
+                       estimated to within about 19% in constant memory
+
+    """
+    # Lower bound of the first bucket, in seconds
+    MIN_SECONDS = 1e-6
+    # Number of buckets per doubling of the latency
+    BUCKETS_PER_DOUBLING = 4
+
+    def __init__(self):
+        """
+        Initializes an empty instance of the LatencyHistogram class
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            N/A
+        """
+        # Maps each bucket number to the number of latencies in it
+        self.buckets = {}
+        self.count = 0
+        self.max_seconds = 0.0
+
+    def add(self, seconds):
+        """
+        Counts a single latency
+
+        Parameters:
+            self : the instance of the class
+            seconds : the latency in seconds
+
+        Returns:
+            N/A
+        """
+        bucket = 0
+        if seconds > LatencyHistogram.MIN_SECONDS:
+            bucket = int(math.log2(seconds / LatencyHistogram.MIN_SECONDS)
+                         * LatencyHistogram.BUCKETS_PER_DOUBLING)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def percentile(self, p):
+        """
+        Estimates a latency percentile as the upper bound of the bucket
+        holding it
+
+        Parameters:
+            self : the instance of the class
+            p : the percentile, from 0 to 100
+
+        Returns:
+            The estimated latency in seconds, or 0 if nothing was counted
+        """
+        if self.count == 0:
+            return 0.0
+        rank = math.ceil(p / 100.0 * self.count)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                upper = LatencyHistogram.MIN_SECONDS * 2 ** (
+                    (bucket + 1) / LatencyHistogram.BUCKETS_PER_DOUBLING)
+                return min(upper, self.max_seconds)
+        return self.max_seconds
+
+
+class Metrics(object):
+    """
+    Metrics - records the call count, bytes moved and latency histogram of
+              each instrumented operation. Pass an instance to the Ledger to
+              enable instrumentation. Safe to use from several threads.
+
+    """
+    enabled = True
+
+    def __init__(self):
+        """
+        Initializes an instance of the Metrics class with no operations
+        recorded
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            N/A
+        """
+        # Maps each operation name to its [count, bytes, total seconds,
+        # histogram] entry
+        self.operations = {}
+        self.lock = threading.Lock()
+
+    def timer(self, name):
+        """
+        Returns a context manager timing one call of an operation. The bytes
+        moved by the call can be set on its nbytes attribute.
+
+        Parameters:
+            self : the instance of the class
+            name : the name of the operation
+
+        Returns:
+            A Timer object
+        """
+        return Timer(self, name)
+
+    def record(self, name, seconds, nbytes=0):
+        """
+        Records one call of an operation
+
+        Parameters:
+            self : the instance of the class
+            name : the name of the operation
+            seconds : the latency of the call
+            nbytes : the number of bytes the call moved
+
+        Returns:
+            N/A
+        """
+        with self.lock:
+            entry = self.operations.get(name)
+            if entry is None:
+                entry = [0, 0, 0.0, LatencyHistogram()]
+                self.operations[name] = entry
+            entry[0] += 1
+            entry[1] += nbytes
+            entry[2] += seconds
+            entry[3].add(seconds)
+
+    def to_dict(self):
+        """
+        Exports the recorded metrics
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            A dictionary mapping each operation name to its count, bytes,
+            total seconds, and p50, p95, p99 and max latencies in seconds
+        """
+        result = {}
+        with self.lock:
+            for name in sorted(self.operations):
+                count, nbytes, total, histogram = self.operations[name]
+                result[name] = {'count': count, 'bytes': nbytes,
+                                'total_seconds': total,
+                                'max_seconds': histogram.max_seconds}
+                for p in PERCENTILES:
+                    result[name]['p%d_seconds' % p] = histogram.percentile(p)
+        return result
+
+    def to_json(self):
+        """
+        Exports the recorded metrics as JSON
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            The dictionary of to_dict as a JSON string
+        """
+        return json.dumps(self.to_dict(), indent=4)
+
+    def format_report(self):
+        """
+        Formats the recorded metrics as a section of the ledger report
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            The text of the report section
+        """
+        report = "\n\nI/O and Latency Statistics\n"
+        report += "--------------------------------------------------------------\n"
+        report += "  {:<24} {:>7} {:>12} {:>9} {:>9} {:>9}\n".format(
+            'Operation', 'Calls', 'Bytes', 'p50 ms', 'p95 ms', 'p99 ms')
+        for name, values in self.to_dict().items():
+            report += "  {:<24} {:>7} {:>12} {:>9.3f} {:>9.3f} {:>9.3f}\n".format(
+                name, values['count'], values['bytes'],
+                values['p50_seconds'] * 1000, values['p95_seconds'] * 1000,
+                values['p99_seconds'] * 1000)
+        return report
+
+    def reset(self):
+        """
+        Discards all recorded metrics
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            N/A
+        """
+        with self.lock:
+            self.operations = {}
+
+
+class Timer(object):
+    """
+    Timer - a context manager recording one call of an operation in a
+            Metrics object
+
+    """
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.nbytes = 0
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.record(self.name, time.perf_counter() - self.start,
+                            self.nbytes)
+        return False
+
+
+class NullTimer(object):
+    """
+    NullTimer - a context manager that records nothing, shared by every
+                call while instrumentation is disabled
+
+    """
+    nbytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def __setattr__(self, name, value):
+        # Ignore the bytes set by the caller, so the shared instance never
+        # changes
+        pass
+
+
+# The single NullTimer instance
+NULL_TIMER = NullTimer()
+
+
+class NullMetrics(object):
+    """
+    NullMetrics - the Metrics interface with every method doing nothing,
+                  used when instrumentation is disabled
+
+    """
+    enabled = False
+
+    def timer(self, name):
+        return NULL_TIMER
+
+    def record(self, name, seconds, nbytes=0):
+        pass
+
+    def to_dict(self):
+        return {}
+
+    def to_json(self):
+        return json.dumps({})
+
+    def format_report(self):
+        return ''
+
+    def reset(self):
+        pass
+
+
+def timed(name):
+    """
+    Decorator recording every call of a method of an object with a metrics
+    attribute, such as the Ledger's aggregate methods
+
+    Parameters:
+        name : the name of the operation
+
+    Returns:
+        The decorator
+    """
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.timer(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class InstrumentedStorage(Storage):
+    """
+    InstrumentedStorage - wraps another storage backend and records the
+                          calls, bytes and latency of every get, put and
+                          list in a Metrics object
+
+    """
+    def __init__(self, backend, metrics):
+        """
+        Initializes an instance of the InstrumentedStorage class
+
+        Parameters:
+            self : the instance of the class
+            backend : the storage.Storage object to wrap
+            metrics : the Metrics object to record into
+
+        Returns:
+            N/A
+        """
+        self.backend = backend
+        self.metrics = metrics
+
+    def __getattr__(self, name):
+        # Expose the attributes of the wrapped backend, such as its client
+        return getattr(self.backend, name)
+
+    def get(self, key):
+        with self.metrics.timer('storage.get') as timer:
+            data = self.backend.get(key)
+            timer.nbytes = len(data)
+        return data
+
+    def get_if_changed(self, key, etag=None):
+        with self.metrics.timer('storage.get') as timer:
+            data, etag, metadata = self.backend.get_if_changed(key, etag)
+            if data is not None:
+                timer.nbytes = len(data)
+        return data, etag, metadata
+
+    def put(self, key, data, metadata=None):
+        with self.metrics.timer('storage.put') as timer:
+            timer.nbytes = len(data)
+            self.backend.put(key, data, metadata)
+
+    def list_keys(self, prefix):
+        # Time the listing itself, not the caller's work between keys
+        with self.metrics.timer('storage.list') as timer:
+            keys = list(self.backend.list_keys(prefix))
+            timer.nbytes = sum(len(k) for k in keys)
+        return iter(keys)
@@ -16,12 +16,17 @@ def lambda_handler(event, context):
     ledger1 = ledger.Ledger(FILE_DIR)
 
     # Create and run TranGEN to generate transactions and add them to the
-    # ledger
+    # ledger. Lambda has no shared memory for miner processes, so the
+    # miners mine one after another.
     logger.info(
         'Creating tranGEN and attempting to generate transactions...')
-    tg = trangen.TranGEN()
+    tg = trangen.TranGEN(concurrent=False)
     tg.generate_transactions(ledger1, NUM_TRANSACTIONS)
 
+    # Write any transactions still buffered in the open block, and the
+    # indexes
+    ledger1.checkpoint()
+
     # Display the transaction count
     logger.info('Total transaction count: %d',
                 ledger1.transaction_count())
@@ -1,17 +1,156 @@
 import json
-import os.path
+import time
+from collections import deque
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import datetime
 import logging
 import logging.config
-import boto3
+import storage
+import merkle
+import miner
+import block_codec
+from block_format import (FORMAT_JSON, FORMAT_COLUMNAR, encode_block,
+                          decode_block)
+from block_cache import BlockCache
+from ledger_stats import LedgerStats
+from tid_index import TidIndex
+from user_index import UserIndex, TOP_TRANSACTIONS
+from instrumentation import NullMetrics, InstrumentedStorage, timed
+from block_policy import BlockPolicy
 
 # Define logger
 logging.config.fileConfig('logging.conf')
 logger = logging.getLogger('ledger')
 
-s3_client = boto3.client('s3')
-s3 = boto3.resource('s3')
-bucket = "cory-walker-blockchain"
+# Durability modes for the write-behind block buffer. In DURABILITY_BLOCK
+# mode a block is only written when it is sealed or flushed explicitly. In
+# DURABILITY_N mode the open block is also written every flush_every
+# transactions.
+DURABILITY_BLOCK = 'block'
+DURABILITY_N = 'n'
+
+# Engines computing the report statistics. STATS_INCREMENTAL keeps them up to
+# date on every write. STATS_COLUMNAR computes them with NumPy from a
+# columnar copy of the ledger, rebuilt after each write.
+STATS_INCREMENTAL = 'incremental'
+STATS_COLUMNAR = 'columnar'
+
+
+def build_footer(transactions):
+    """
+    Builds the summary footer stored in a block when it is sealed. The footer
+    lets scans answer range, tid and aggregate questions about the block, or
+    skip it, without reading its transactions.
+
+    Parameters:
+        transactions : the list of transactions in the block
+
+    Returns:
+        footer : a dictionary with the min/max tid, transaction and
+                 cancellation counts, amount sum, the senders and receivers,
+                 and the Merkle root of the block's transactions
+    """
+    tids = [t['tid'] for t in transactions]
+    senders = set()
+    receivers = set()
+    cancellation_count = 0
+    amount_sum = 0
+    for t in transactions:
+        if 'cancelled_tid' in t:
+            cancellation_count += 1
+            continue
+        amount_sum += t.get('amount', 0)
+        if 'sender' in t:
+            senders.add(t['sender'])
+        if 'receiver' in t:
+            receivers.add(t['receiver'])
+
+    return {'min_tid': min(tids) if tids else None,
+            'max_tid': max(tids) if tids else None,
+            'transaction_count': len(transactions) - cancellation_count,
+            'cancellation_count': cancellation_count,
+            'amount_sum': amount_sum,
+            'senders': sorted(senders),
+            'receivers': sorted(receivers),
+            'merkle_root': merkle.merkle_root(transactions)}
+
+
+def verify_block(ledger_data):
+    """
+    Performs the hashing work of verifying one block. Runs in a worker
+    process of Ledger.verify.
+
+    Parameters:
+        ledger_data : the block dictionary
+
+    Returns:
+        A dictionary with the block's header hash (None if the header has
+        no nonce), whether the hash meets the proof of work target, the
+        Merkle root of the transactions of a sealed block (None for the open
+        block), whether its Merkle tree has equal siblings, and whether the
+        Merkle root in the footer matches it (None for a block without a
+        footer)
+    """
+    result = {'hash': None, 'pow_ok': False, 'merkle_root': None,
+              'merkle_mutated': False, 'merkle_ok': None}
+    hdr = ledger_data.get('hdr', {})
+    if 'nonce' in hdr:
+        result['hash'] = miner.header_hash(hdr)
+        try:
+            result['pow_ok'] = miner.meets_target(result['hash'],
+                                                  miner.header_bits(hdr))
+        except (TypeError, ValueError):
+            # A header with an invalid difficulty never meets the target
+            pass
+
+    footer = ledger_data.get('footer')
+    if 'next_block' in ledger_data or footer is not None:
+        result['merkle_root'], result['merkle_mutated'] = (
+            merkle.checked_merkle_root(ledger_data['transactions']))
+    if footer is not None and 'merkle_root' in footer:
+        result['merkle_ok'] = result['merkle_root'] == footer['merkle_root']
+    return result
+
+
+def format_report(stats, filedir, now):
+    """
+    Formats the text of a ledger report
+
+    Parameters:
+        stats : the LedgerStats object to report
+        filedir : the blockchain file directory named in the report
+        now : the datetime the report is dated with
+
+    Returns:
+        report : the text of the report
+    """
+    report = "Blockchain Report - Generated: " + now.strftime("%b %d %Y %H:%M:%S %Z") + "\n\n"
+    report += "Blockchain File Directory: " + filedir + "\n"
+    report += "-------------------------------------------"
+    report += "-------------------\n\n\n"
+    report += "General Statistics\n"
+    report += "--------------------------------------------------------------\n"
+    report += "Total Transactions:  " + str(stats.transaction_count) + "\n"
+    report += "Total Cancellations:  " + str(stats.cancelled_count) + "\n\n"
+    report += "Net Value of All Transactions: " + "${:0,.2f}".format(float(stats.amount_total)) + "\n"
+    report += "Average Value of Transactions: " + "${:0,.2f}".format(float(stats.average_value())) + "\n\n\n"
+    report += "User Statistics\n"
+    report += "--------------------------------------------------------------\n"
+    report += "Total Transactions By User:\n"
+    user_transactions = stats.user_counts
+    for user in user_transactions:
+        report += "  {:<8} {:<10}\n".format(user, user_transactions[user])
+    report += "\nTotal Debits By User:\n"
+    user_debits = stats.debits
+    for user in user_debits:
+        report += "  {:<8} ${:0.2f}\n".format(user, user_debits[user])
+    report += "\nTotal Credits By User:\n"
+    user_credits = stats.credits
+    for user in user_credits:
+        report += "  {:<8} ${:0.2f}\n".format(user, user_credits[user])
+    return report
+
 
 class Ledger(object):
     """
@@ -19,7 +158,26 @@ class Ledger(object):
     transactions
 
     """
-    def __init__(self, filedir):
+    # Name of the object holding the running statistics
+    STATS_FILE = 'stats.json'
+    # Name of the object holding the transaction id index
+    TID_INDEX_FILE = 'tid_index.json'
+    # Name of the object holding the per-user index
+    USER_INDEX_FILE = 'user_index.json'
+    # Name of the object holding the footers of all sealed blocks
+    FOOTERS_FILE = 'footers.json'
+    # Name of the object holding the counters needed to reopen the ledger
+    MANIFEST_FILE = 'manifest.json'
+    # Number of blocks sealed between checkpoints of the indexes. Reopening
+    # replays at most this many blocks, whatever the size of the ledger.
+    CHECKPOINT_BLOCKS = 16
+
+    def __init__(self, filedir, storage_backend=None,
+                 durability=DURABILITY_BLOCK, flush_every=32,
+                 flush_interval=None, prefetch=8, cache_blocks=64,
+                 block_format=FORMAT_JSON, codec=block_codec.CODEC_NONE,
+                 stats_engine=STATS_INCREMENTAL, tid_base=0, metrics=None,
+                 block_policy=None):
         """
         Initializes the blockchain object with the specified file directory
         Creates a unique blockchain file directory
@@ -27,29 +185,290 @@ class Ledger(object):
         Sets current transaction count to 0
         Sets current file number to 0
         Sets the name of the initial blockchain file
-        Creates the blockchain directory if it does not exist
+        Creates the in-memory buffer for the open block
 
         Parameters:
             self : the instance of the class
             filedir : the path to the directory where the blockchain data will
                       be stored
+            storage_backend : the storage.Storage object holding the block
+                              files. Defaults to S3 storage in the
+                              blockchain bucket.
+            durability : DURABILITY_BLOCK to write each block once when it
+                         is sealed, or DURABILITY_N to also write the open
+                         block every flush_every transactions
+            flush_every : the number of buffered transactions that triggers
+                          a write in DURABILITY_N mode
+            flush_interval : if set, the number of seconds after which
+                             buffered transactions are written. It is
+                             checked when a transaction or header is added
+                             and when flush_if_due is called.
+            prefetch : the number of blocks downloaded and parsed ahead of
+                       the block being processed during scans
+            cache_blocks : the maximum number of parsed blocks kept in the
+                           block cache. 0 disables the cache.
+            block_format : the format new blocks are written in,
+                           FORMAT_JSON or FORMAT_COLUMNAR. Blocks in
+                           either format can always be read.
+            codec : the compression codec new blocks are written with, one
+                    of block_codec.CODECS. The codec is recorded in each
+                    object's metadata, so blocks with any codec can be read.
+            stats_engine : STATS_INCREMENTAL to report the running
+                           statistics, or STATS_COLUMNAR to compute them
+                           from the NumPy columns of to_arrays. The
+                           columnar engine needs numpy.
+            tid_base : the first tid the ledger assigns. Ledgers sharing
+                       an aggregate, such as the shards of a
+                       sharded_ledger.ShardedLedger, use disjoint tid ranges.
+            metrics : an instrumentation.Metrics object to record the calls,
+                      bytes and latency of storage operations, block and
+                      object encoding and aggregates in. Instrumentation is
+                      disabled if None.
+            block_policy : the block_policy.BlockPolicy deciding when a
+                           block is sealed. Defaults to sealing blocks of
+                           256 transactions.
 
         Returns:
             N/A
         """
+        if durability not in (DURABILITY_BLOCK, DURABILITY_N):
+            raise ValueError('Unknown durability mode: ' + str(durability))
+        if block_format not in (FORMAT_JSON, FORMAT_COLUMNAR):
+            raise ValueError('Unknown block format: ' + str(block_format))
+        if codec not in block_codec.CODECS:
+            raise ValueError('Unknown codec: ' + str(codec))
+        if stats_engine not in (STATS_INCREMENTAL, STATS_COLUMNAR):
+            raise ValueError('Unknown statistics engine: ' + str(stats_engine))
+
+        # Storage backend holding the block files
+        if storage_backend is None:
+            storage_backend = storage.S3Storage()
+        self.storage = storage_backend
+
+        # Instrumentation, which wraps the storage backend when enabled
+        if metrics is None:
+            metrics = NullMetrics()
+        self.metrics = metrics
+        if metrics.enabled:
+            self.storage = InstrumentedStorage(storage_backend, metrics)
+
         self.now = datetime.now()
         self.dt_str = self.now.strftime("%Y%m%d_%H%M%S")
-        self.filedir = filedir + '_' + self.dt_str
 
-        self.current_tid = 0
+        self.tid_base = tid_base
+        self.current_tid = tid_base
         self.trans_count = 0
+        # Total record size and opening time of the open block, checked by
+        # the block policy
+        self.block_bytes = 0
+        self.block_opened_at = None
         self.filenum = 0
 
+        # Write-behind buffer settings
+        self.durability = durability
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+
+        # Policy deciding when a block is sealed, and the functions called
+        # when a new block is started
+        if block_policy is None:
+            block_policy = BlockPolicy()
+        self.block_policy = block_policy
+        self.new_block_callbacks = []
+
+        # Buffer holding the open block until it is flushed
+        self.block_data = {'hdr': {}, 'transactions': []}
+        self.pending = 0
+        self.dirty = False
+        self.last_flush = time.time()
+
+        # Number of blocks fetched ahead during scans
+        self.prefetch = prefetch
+
+        # Cache of parsed blocks read by from_file
+        self.cache = BlockCache(cache_blocks)
+
+        # Format and compression codec in which blocks are written
+        self.block_format = block_format
+        self.codec = codec
+
+        # Running statistics, updated on every write and stored next to the
+        # blocks
+        self.stats = LedgerStats(tid_base=tid_base)
+
+        # Index locating every tid, updated on every write and stored next
+        # to the blocks
+        self.tid_index = TidIndex(tid_base)
+
+        # Index of every user's transactions, balance and volume, updated on
+        # every write and stored next to the blocks at each checkpoint
+        self.user_index = UserIndex()
+
+        # Engine computing the report statistics, and the columnar copy of
+        # the ledger with the write generation it was built at
+        self.stats_engine = stats_engine
+        self.generation = 0
+        self.arrays = None
+        self.arrays_generation = -1
+        self.columnar_stats = None
+
+        # Footers of all sealed blocks, indexed by block number
+        self.footers = []
+
+        # Position of the last stored checkpoint of the indexes and footers:
+        # the next tid and the open block number when it was taken
+        self.last_checkpoint = None
+
+        # Hash of the most recent block header, which the next block header
+        # must contain
+        self.last_hash = None
+        # Number of sealed blocks whose Merkle roots are committed to by a
+        # block header; the next block header must commit to the others
+        self.committed_roots = 0
+
+        self.set_filedir(filedir + '_' + self.dt_str)
+
+    @classmethod
+    def open(cls, filedir, storage_backend=None, **kwargs):
+        """
+        Reopens an existing ledger so more transactions can be appended to
+        it. The counters, the open tail block, the hash of the last block
+        header and the statistics are restored from the manifest and the
+        objects stored next to the blocks. The tid index, the user index
+        and the footers are loaded from their last checkpoint, and only the
+        blocks written after it, at most Ledger.CHECKPOINT_BLOCKS of them,
+        are read by number to bring them up to date, without listing the
+        ledger's directory. Ledgers written without a manifest are resumed
+        by following the next block entries instead.
+
+        Parameters:
+            cls : the Ledger class
+            filedir : the directory of the existing ledger, including its
+                      timestamp suffix
+            storage_backend : the storage.Storage object holding the ledger
+            kwargs : other Ledger constructor arguments. The block format,
+                     codec, tid base and block policy default to the ones
+                     recorded in the manifest.
+
+        Returns:
+            The reopened Ledger object
+        """
+        manifest = None
+        if storage_backend is None:
+            storage_backend = storage.S3Storage()
+        try:
+            manifest = json.loads(storage_backend.get(
+                filedir + '/' + cls.MANIFEST_FILE).decode('utf-8'))
+            kwargs.setdefault('block_format', manifest['block_format'])
+            kwargs.setdefault('codec', manifest['codec'])
+            kwargs.setdefault('tid_base', manifest.get('tid_base', 0))
+            if 'block_policy' in manifest:
+                kwargs.setdefault('block_policy', BlockPolicy.from_dict(
+                    manifest['block_policy']))
+        except FileNotFoundError:
+            logger.info('No manifest found in %s', filedir)
+
+        ledger = cls(filedir, storage_backend, **kwargs)
+        ledger.set_filedir(filedir)
+        ledger.restore(manifest)
+        return ledger
+
+    def restore(self, manifest):
+        """
+        Restores the state of an existing ledger, used by Ledger.open
+
+        Parameters:
+            self : the instance of the class
+            manifest : the stored manifest dictionary, or None to find the
+                       tail block through the next block entries
+
+        Returns:
+            N/A
+        """
+        if manifest is not None:
+            self.filenum = manifest['filenum']
+            self.current_tid = manifest['current_tid']
+            self.last_hash = manifest['last_hash']
+            self.committed_roots = manifest.get('committed_roots', 0)
+        else:
+            # Follow the next block entries from the first block to the tail
+            self.filenum = 0
+            ledger_data = self.from_file(self.block_filename(0))
+            while 'next_block' in ledger_data:
+                self.filenum = self.block_number(ledger_data['next_block'])
+                transactions = ledger_data['transactions']
+                if transactions:
+                    self.current_tid = transactions[-1]['tid'] + 1
+                if 'nonce' in ledger_data['hdr']:
+                    self.last_hash = miner.header_hash(ledger_data['hdr'])
+                self.committed_roots += len(
+                    ledger_data['hdr'].get('merkle_roots', []))
+                ledger_data = self.from_file(
+                    self.block_filename(self.filenum))
+        self.set_current_filename()
+
+        # Load the open tail block into the buffer. It does not exist yet if
+        # nothing was written after the previous block was sealed.
+        self.block_data = {'hdr': {}, 'transactions': []}
+        try:
+            # Decode a private copy, since the buffer is modified in place
+            data, etag, metadata = self.storage.get_if_changed(self.filename)
+            self.block_data = decode_block(
+                block_codec.decompress(data, metadata))
+        except FileNotFoundError:
+            pass
+        transactions = self.block_data['transactions']
+        self.trans_count = len(transactions)
+        self.block_bytes = sum(self.block_policy.record_size(t)
+                               for t in transactions)
+        # The age of a reopened block counts from the time it is reopened
+        self.block_opened_at = time.time() if transactions else None
+        if transactions:
+            self.current_tid = max(self.current_tid,
+                                   transactions[-1]['tid'] + 1)
+        if 'nonce' in self.block_data['hdr']:
+            self.last_hash = miner.header_hash(self.block_data['hdr'])
+        if manifest is None:
+            self.committed_roots += len(
+                self.block_data['hdr'].get('merkle_roots', []))
+
+        # The tid index is loaded first, since rebuilding the statistics
+        # needs its set of cancelled tids
+        self.load_indexes(manifest.get('checkpoint') if manifest else None)
+        self.load_statistics()
+        logger.info('Reopened %s at block %d, next tid %d', self.filedir,
+                    self.filenum, self.current_tid)
+
+    def set_filedir(self, filedir):
+        """
+        Sets the blockchain file directory and the names of all objects
+        stored in it
+
+        Parameters:
+            self : the instance of the class
+            filedir : the path to the directory where the blockchain data is
+                      stored
+
+        Returns:
+            N/A
+        """
+        self.filedir = filedir
+        self.stats_filename = self.filedir + '/' + Ledger.STATS_FILE
+        self.tid_index_filename = self.filedir + '/' + Ledger.TID_INDEX_FILE
+        self.user_index_filename = (self.filedir + '/'
+                                    + Ledger.USER_INDEX_FILE)
+        self.footers_filename = self.filedir + '/' + Ledger.FOOTERS_FILE
+        self.manifest_filename = self.filedir + '/' + Ledger.MANIFEST_FILE
         self.set_current_filename()
 
     def from_file(self, filename):
         """
-        Pulls a Json files and converts it into a ledger object
+        Pulls a block file and converts it into a ledger object. Both JSON
+        and columnar blocks are accepted. Parsed
+        blocks are kept in the block cache; sealed blocks are served from it
+        directly and the open block only after its ETag has been validated.
+        The returned data may be shared with the cache and must not be
+        modified.
 
         Parameters:
             self : the instance of the class
@@ -61,19 +480,30 @@ class Ledger(object):
         # Define ledger data dictionary
         ledger_data = {'hdr': {}, 'transactions': []}
         try:
-            # Open file and use JSON load function to read into ledger data
-            # dictionary
-            s3_object = s3_client.get_object(
-                Bucket=bucket,
-                Key=filename
-            )
-            obj = s3.Object(bucket, filename)
-            data = obj.get()['Body'].read().decode('utf-8')
-            ledger_data = json.loads(data)
-
-            #if os.path.exists(filename):
-            #    with open(filename, encoding='utf-8') as infile:
-            #        ledger_data = json.load(infile)       
+            etag = None
+            entry = self.cache.lookup(filename)
+            if entry is not None:
+                cached_data, etag, sealed = entry
+                # Sealed blocks never change
+                if sealed:
+                    self.cache.record(hit=True)
+                    return cached_data
+
+            # Read the object from storage unless the cached copy is still
+            # current
+            data, etag, metadata = self.storage.get_if_changed(filename, etag)
+            if data is None:
+                self.cache.record(hit=True, validated=True)
+                return cached_data
+            self.cache.record(hit=False, validated=entry is not None)
+
+            # Decompress with the codec named in the object's metadata, then
+            # decode the JSON or columnar block into ledger data dictionary
+            with self.metrics.timer('block.decode') as timer:
+                timer.nbytes = len(data)
+                ledger_data = decode_block(
+                    block_codec.decompress(data, metadata))
+            self.cache.store(filename, ledger_data, etag)
         except FileNotFoundError:
             logger.exception("The file could not be found: %s", filename)
         except TypeError as e:
@@ -86,35 +516,79 @@ class Ledger(object):
 
     def to_file(self, ledger_data, filename):
         """
-        Writes ledger data entry(ies) to Json file
+        Writes ledger data entry(ies) to a block file in the ledger's block
+        format
 
         Parameters:
             self : the instance of the class
-            ledger_data: The Json ledger data
-            filename: The name of the Json file
+            ledger_data: The ledger data of the block
+            filename: The name of the block file
 
         Returns:
-            N/A
+            N/A. Raises the error of the failed write, so the caller keeps
+            the block buffered.
         """
         try:
-            # Use JSON dumps function to read into JSON object, then write
-            # JSON object to file
-            json_obj = json.dumps(ledger_data, indent=4)
-            s3_client.put_object(
-                Bucket=bucket,
-                Body=json_obj,
-                Key=filename
-            )
-            
-            #with open(filename, "w", encoding='utf-8') as outfile:
-            #    outfile.write(json_obj)
+            # Encode the block in the ledger's format and compress it with
+            # the ledger's codec, then write it to file
+            with self.metrics.timer('block.encode') as timer:
+                data, metadata = block_codec.compress(
+                    encode_block(ledger_data, self.block_format), self.codec)
+                timer.nbytes = len(data)
+            self.storage.put(filename, data, metadata)
         except TypeError as e:
             logger.exception(
                 "TypeError occurred while trying to write to file. Msg: %s", e)
-        except FileNotFoundError:
-            logger.exception("The file" + str(filename) + " was not found.")
+            raise
         except Exception as e:
-            logger.debug("An unknown exception has occurred in to file: %s", e)
+            logger.error("Could not write block file %s. Msg: %s", filename,
+                         e)
+            raise
+        finally:
+            # The cached copy of a rewritten block is out of date, and may
+            # be stale even if the write failed part way
+            self.cache.invalidate(filename)
+
+    def read_object(self, filename):
+        """
+        Reads a JSON object stored next to the blocks, such as the
+        statistics or the tid index
+
+        Parameters:
+            self : the instance of the class
+            filename: The name of the object
+
+        Returns:
+            The decoded JSON value. Raises FileNotFoundError if the object
+            does not exist.
+        """
+        data = self.storage.get(filename)
+        with self.metrics.timer('object.decode') as timer:
+            timer.nbytes = len(data)
+            return json.loads(data.decode('utf-8'))
+
+    def write_object(self, value, filename):
+        """
+        Writes a JSON object stored next to the blocks, such as the
+        statistics or the tid index
+
+        Parameters:
+            self : the instance of the class
+            value: The value to store
+            filename: The name of the object
+
+        Returns:
+            N/A
+        """
+        try:
+            with self.metrics.timer('object.encode') as timer:
+                data = json.dumps(value,
+                                  separators=(',', ':')).encode('utf-8')
+                timer.nbytes = len(data)
+            self.storage.put(filename, data)
+        except TypeError as e:
+            logger.exception(
+                "TypeError occurred while trying to write to file. Msg: %s", e)
 
     def add_block_header(self, block_header):
         """
@@ -127,17 +601,47 @@ class Ledger(object):
         Returns:
             N/A
         """
-        # Get data from current file
-        ledger_data = self.from_file(self.filename)
-
-        # Add the block header to the file
+        # Add the block header to the buffered block
         try:
-            ledger_data['hdr'] = block_header
+            self.block_data['hdr'] = block_header
+            self.dirty = True
+            # Remember the header's hash for the next block header
+            if 'nonce' in block_header:
+                self.last_hash = miner.header_hash(block_header)
+            self.committed_roots += len(block_header.get('merkle_roots', []))
         except Exception as e:
             logger.debug("An unknown exception has occurred: " + str(e))
 
-        # Write file
-        self.to_file(ledger_data, self.filename)
+        # Write the block if a flush threshold has been reached
+        self.flush_if_due()
+
+    def uncommitted_merkle_roots(self):
+        """
+        Returns the Merkle roots of the sealed blocks that no block header
+        commits to yet. A new block header must include them as its
+        'merkle_roots' entry, so the hash chain covers every block's
+        transactions.
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            A list of Merkle roots in block order
+        """
+        return [footer['merkle_root']
+                for footer in self.footers[self.committed_roots:]]
+
+    def has_block_header(self):
+        """
+        Checks if the open block already has a header
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            True if a header was added to the open block, False otherwise
+        """
+        return bool(self.block_data['hdr'])
 
     def add_transaction(self, sender, recipient, amount):
         """
@@ -202,11 +706,52 @@ class Ledger(object):
 
         return -1
 
+    def add_transactions(self, records):
+        """
+        Adds a batch of transactions and cancellations. Tids are assigned in
+        order, the batch is split at block boundaries, and each affected
+        block is written once.
+
+        Parameters:
+            self : the instance of the class
+            records: An iterable or generator of (sender, recipient, amount)
+                     tuples for transactions and {'cancelled_tid': tid}
+                     dictionaries for cancellations
+
+        Returns:
+            tids: The list of assigned tids, one per record. -1 is returned
+                  for a cancellation of a tid that does not exist.
+        """
+        tids = []
+        for record in records:
+            new_tid = self.current_tid
+            if isinstance(record, dict):
+                # Validate the cancelled tid, which may belong to this batch
+                if not self.transaction_exists(record['cancelled_tid']):
+                    tids.append(-1)
+                    continue
+                transaction = {'tid': new_tid,
+                               'cancelled_tid': record['cancelled_tid']}
+            else:
+                sender, recipient, amount = record
+                transaction = {'tid': new_tid, 'sender': sender,
+                               'receiver': recipient, 'amount': amount}
+
+            # Seal each block as soon as it is full; the open block is
+            # written once at the end of the batch
+            if self.append_transaction(transaction):
+                self.seal_block()
+            tids.append(new_tid)
+
+        self.flush()
+        logger.debug('Added batch of %d record(s)', len(tids))
+        return tids
+
     def do_add(self, transaction):
         """
         Common function to use between add_transaction and cancel_transaction
-        to write data to json file based on current blockchain location or
-        create new blockchain file
+        to append a transaction to the buffered block. The block is written
+        once when it is sealed, or earlier when a flush threshold is reached.
 
         Parameters:
             self : the instance of the class
@@ -215,34 +760,245 @@ class Ledger(object):
         Returns:
             N/A
         """
-        # Get data from current file
-        ledger_data = self.from_file(self.filename)
+        # If the block is now full, seal it
+        if self.append_transaction(transaction):
+            self.seal_block()
+        else:
+            self.flush_if_due()
 
-        # Append transaction to ledger data
-        ledger_data['transactions'].append(transaction)
+    def append_transaction(self, transaction):
+        """
+        Appends a transaction to the buffered block and updates the counters,
+        statistics and tid index, without writing anything
 
-        # Writer/rewrite to file
-        self.to_file(ledger_data, self.filename)
+        Parameters:
+            self : the instance of the class
+            transaction: The transaction to be added or cancelled
+
+        Returns:
+            True if the block is now full and must be sealed, False otherwise
+        """
+        # Let the new block callbacks add the header of a new block before
+        # its first record, so no header is mined for a block that stays
+        # empty
+        if self.trans_count == 0 and not self.block_data['hdr']:
+            for callback in list(self.new_block_callbacks):
+                callback(self)
+
+        # Append transaction to the buffered block
+        self.block_data['transactions'].append(transaction)
+        self.pending += 1
+        self.dirty = True
+
+        # Update the indexes and the running statistics. The amount of a
+        # cancelled transaction is backed out of the statistics and the
+        # user balances, only the first time it is cancelled.
+        original = None
+        if ('cancelled_tid' in transaction and not
+                self.tid_index.is_cancelled(transaction['cancelled_tid'])):
+            original = self.get_transaction(transaction['cancelled_tid'])
+        self.tid_index.add(transaction, self.filenum)
+        self.stats.add(transaction, original)
+        self.user_index.add(transaction, self.filenum, original)
+        self.generation += 1
 
         # Increment current ID
         self.current_tid += 1
 
-        # Increment transaction count
+        # Increment transaction count and the size of the block
+        if self.trans_count == 0:
+            self.block_opened_at = time.time()
         self.trans_count += 1
+        self.block_bytes += self.block_policy.record_size(transaction)
 
-        # If transaction count is now 256, append next block to the end of
-        # the current block file, set name for the new block file, and reset
-        # the transaction count to 0
-        if self.trans_count == 256:
-            self.filenum += 1
-            self.add_next_block()
-            self.set_current_filename()
-            self.trans_count = 0
-            logger.debug('Transitioning to next block: %s', self.filename)
+        return self.block_policy.is_full(self.trans_count, self.block_bytes,
+                                         self.block_opened_at)
 
-    def add_next_block(self):
+    def seal_block(self):
+        """
+        Seals the open block: adds its footer and the next block entry,
+        writes it, sets the name for the new block file, and resets the
+        buffer and transaction count. The new block's header is added by
+        the new block callbacks when its first record arrives.
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            N/A
+        """
+        # Summarize the block in its footer and in the footer catalog
+        footer = build_footer(self.block_data['transactions'])
+        self.block_data['footer'] = footer
+        self.footers.append(footer)
+
+        self.filenum += 1
+        self.add_next_block()
+        try:
+            self.flush()
+        except Exception:
+            # Keep the block open and buffered, so the seal is retried by
+            # the next write
+            self.footers.pop()
+            self.filenum -= 1
+            del self.block_data['footer']
+            del self.block_data['next_block']
+            self.dirty = True
+            raise
+
+        self.set_current_filename()
+        self.block_data = {'hdr': {}, 'transactions': []}
+        self.trans_count = 0
+        self.block_bytes = 0
+        self.block_opened_at = None
+        logger.debug('Transitioning to next block: %s', self.filename)
+
+        # Rewrite the indexes every CHECKPOINT_BLOCKS blocks
+        checkpoint_filenum = 0
+        if self.last_checkpoint is not None:
+            checkpoint_filenum = self.last_checkpoint['filenum']
+        if self.filenum - checkpoint_filenum >= Ledger.CHECKPOINT_BLOCKS:
+            try:
+                self.checkpoint()
+            except Exception as e:
+                # The block is sealed; the checkpoint is retried at the
+                # next seal
+                logger.error('Could not checkpoint the indexes of %s. '
+                             'Msg: %s', self.filedir, e)
+
+    def seal_if_due(self):
+        """
+        Seals the open block if it has reached a limit of the block policy.
+        Useful with a maximum block age, to seal an idle block without
+        waiting for the next transaction.
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            True if the block was sealed, False otherwise
+        """
+        if self.block_policy.is_full(self.trans_count, self.block_bytes,
+                                     self.block_opened_at):
+            self.seal_block()
+            return True
+        return False
+
+    def add_new_block_callback(self, callback):
+        """
+        Registers a function called every time a new block is started, when
+        its first record arrives and before it is added, for example to mine
+        and add the new block's header. It is not called for a block that
+        already has a header, and a block that stays empty is never started.
+
+        Parameters:
+            self : the instance of the class
+            callback : the function, called with the ledger as its argument
+
+        Returns:
+            N/A
+        """
+        self.new_block_callbacks.append(callback)
+
+    def remove_new_block_callback(self, callback):
+        """
+        Unregisters a function registered with add_new_block_callback
+
+        Parameters:
+            self : the instance of the class
+            callback : the function to unregister
+
+        Returns:
+            N/A
+        """
+        self.new_block_callbacks.remove(callback)
+
+    def manifest(self):
+        """
+        Returns the manifest stored with the ledger, which holds what
+        Ledger.open needs to resume the ledger
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            A dictionary with the block number of the open block, the next
+            tid, the first tid of the ledger, the hash of the last block
+            header, the number of sealed blocks whose Merkle roots are
+            committed to by a header, the block format and codec, the block
+            policy and the position of the last checkpoint of the indexes
+        """
+        return {'filenum': self.filenum,
+                'current_tid': self.current_tid,
+                'tid_base': self.tid_base,
+                'last_hash': self.last_hash,
+                'committed_roots': self.committed_roots,
+                'block_format': self.block_format,
+                'codec': self.codec,
+                'block_policy': self.block_policy.to_dict(),
+                'checkpoint': self.last_checkpoint}
+
+    def checkpoint(self):
+        """
+        Writes the buffered block, then the tid index, the user index and
+        the footer catalog. Between checkpoints the indexes are not
+        written, since every sealed block already stores its records and
+        its footer; Ledger.open replays the blocks written after the last
+        checkpoint. A checkpoint is taken automatically every
+        Ledger.CHECKPOINT_BLOCKS sealed blocks. Call it
+        when done adding transactions, so the ledger reopens without
+        replaying any block.
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            N/A
+        """
+        self.flush()
+        checkpoint = {'next_tid': self.current_tid, 'filenum': self.filenum}
+        for value, filename in (
+                (self.tid_index.to_dict(), self.tid_index_filename),
+                (self.user_index.to_dict(), self.user_index_filename),
+                (self.footers, self.footers_filename)):
+            # Each object records the checkpoint it belongs to, so objects
+            # from an interrupted checkpoint are detected when reopening
+            self.write_object({'checkpoint': checkpoint, 'value': value},
+                              filename)
+        self.last_checkpoint = checkpoint
+        self.write_object(self.manifest(), self.manifest_filename)
+        logger.debug('Checkpointed the indexes of %s at tid %d',
+                     self.filedir, self.current_tid)
+
+    def flush_if_due(self):
         """
-        Adds the next block entry to the current block chain file
+        Writes the buffered block if the durability mode's transaction count
+        threshold or the flush interval has been reached. It is checked
+        whenever a transaction or header is added; call it periodically,
+        for example from a timer, so the flush interval is also honoured
+        while the ledger is idle.
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            True if the block was written, False otherwise
+        """
+        if not self.dirty:
+            return False
+        if ((self.durability == DURABILITY_N
+                and self.pending >= self.flush_every)
+                or (self.flush_interval is not None and time.time()
+                    - self.last_flush >= self.flush_interval)):
+            self.flush()
+            return True
+        return False
+
+    def flush(self):
+        """
+        Writes the buffered open block to storage if it has unwritten
+        changes. If a write fails, the error is raised and the block stays
+        buffered and marked unwritten, so the next flush retries it.
 
         Parameters:
             self : the instance of the class
@@ -250,41 +1006,453 @@ class Ledger(object):
         Returns:
             N/A
         """
-        # Get data from current block file
-        ledger_data = self.from_file(self.filename)
+        if not self.dirty:
+            return
+        logger.debug('Flushing %d buffered transaction(s) to %s',
+                     self.pending, self.filename)
+        self.to_file(self.block_data, self.filename)
+        self.write_object(self.stats.to_dict(), self.stats_filename)
+        self.write_object(self.manifest(), self.manifest_filename)
+        self.pending = 0
+        self.dirty = False
+        self.last_flush = time.time()
+
+    def add_next_block(self):
+        """
+        Adds the next block entry to the buffered current block
+
+        Parameters:
+            self : the instance of the class
 
-        # Append next block to ledger data
+        Returns:
+            N/A
+        """
+        # Append next block to the buffered block
         try:
-            ledger_data['next_block'] = 'block_' + str(self.filenum) + '.json'
+            self.block_data['next_block'] = 'block_' + str(self.filenum) + '.json'
+            self.dirty = True
         except Exception as e:
             logger.debug("An unknown exception has occurred in add_next_block: " + str(e))
 
-        # Writer/rewrite file
-        self.to_file(ledger_data, self.filename)
+    @timed('aggregate.statistics')
+    def statistics(self):
+        """
+        Returns the statistics for the whole blockchain. The incremental
+        statistics are maintained on every write, so no blocks are read. The
+        columnar statistics are computed from the arrays of to_arrays.
 
-    def transaction_count(self):
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            stats: The LedgerStats object for the blockchain
         """
-        Calculates total number of valid transactions found in the blockchain
+        if self.stats_engine == STATS_COLUMNAR:
+            import ledger_arrays
+            arrays = self.to_arrays()
+            if self.columnar_stats is None:
+                self.columnar_stats = ledger_arrays.stats_from_arrays(
+                    arrays, self.tid_base)
+            return self.columnar_stats
+        return self.stats
+
+    @timed('aggregate.to_arrays')
+    def to_arrays(self):
+        """
+        Converts the whole ledger into NumPy columns for vectorized
+        analytics. The columns are cached until the next write.
 
         Parameters:
             self : the instance of the class
 
         Returns:
-            The total number of valid transactions in the blockchain file
+            arrays : a dictionary of NumPy arrays as described in
+                     ledger_arrays.build_arrays
+        """
+        # numpy is only needed by the columnar export
+        import ledger_arrays
+        if self.arrays_generation != self.generation:
+            generation = self.generation
+            self.arrays = ledger_arrays.build_arrays(
+                ledger_data for f, ledger_data in self.iter_blocks())
+            self.arrays_generation = generation
+            self.columnar_stats = None
+        return self.arrays
+
+    def export_arrays(self, path):
+        """
+        Writes the NumPy columns of the ledger to a local directory, one .npy
+        file per column, so they can be loaded memory-mapped with
+        ledger_arrays.load_arrays
+
+        Parameters:
+            self : the instance of the class
+            path : the local directory to write the columns to
+
+        Returns:
+            N/A
+        """
+        import ledger_arrays
+        ledger_arrays.save_arrays(self.to_arrays(), path)
+
+    def load_statistics(self):
+        """
+        Loads the stored statistics object of the blockchain. The stored
+        object only holds the totals, and its set of cancelled tids is
+        copied from the tid index, so load_indexes must run first. If it
+        does not exist, the statistics are rebuilt with a full scan of the
+        blocks.
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            N/A
+        """
+        try:
+            self.stats = LedgerStats.from_dict(
+                self.read_object(self.stats_filename),
+                cancelled=self.tid_index.cancelled.copy())
+        except FileNotFoundError:
+            logger.info('No stored statistics found in %s. Rebuilding...',
+                        self.filedir)
+            self.stats = self.scan()
+            # Later cancellations back out amounts as they are added
+            self.stats.known_cancelled = None
+
+    def load_indexes(self, checkpoint):
+        """
+        Loads the tid index, the user index and the footer catalog stored at
+        the last checkpoint, then replays the blocks written after it. If
+        they are missing, or were written by an interrupted checkpoint,
+        they are rebuilt by replaying every block.
+
+        Parameters:
+            self : the instance of the class
+            checkpoint : the checkpoint position recorded in the manifest,
+                         or None if it is unknown
+
+        Returns:
+            N/A
+        """
+        try:
+            if checkpoint is None:
+                raise FileNotFoundError(self.manifest_filename)
+            stored = [self.read_object(filename) for filename in
+                      (self.tid_index_filename, self.user_index_filename,
+                       self.footers_filename)]
+            if any(data.get('checkpoint') != checkpoint for data in stored):
+                raise FileNotFoundError(self.tid_index_filename)
+            self.tid_index = TidIndex.from_dict(stored[0]['value'])
+            self.user_index = UserIndex.from_dict(stored[1]['value'])
+            self.footers = stored[2]['value']
+            self.last_checkpoint = checkpoint
+        except FileNotFoundError:
+            logger.info('No index checkpoint found in %s. Rebuilding...',
+                        self.filedir)
+            self.tid_index = TidIndex(self.tid_base)
+            self.user_index = UserIndex()
+            self.footers = []
+            checkpoint = {'next_tid': self.tid_base, 'filenum': 0}
+        self.replay_blocks(checkpoint)
+
+    def replay_blocks(self, checkpoint):
+        """
+        Adds the records and footers written after a checkpoint to the
+        indexes, exactly as they were added when the records were written.
+        The blocks are read by number up to the open block, without listing
+        the ledger's directory.
+
+        Parameters:
+            self : the instance of the class
+            checkpoint : the checkpoint position the indexes were loaded at
+
+        Returns:
+            N/A
+        """
+        replayed = 0
+        for f, ledger_data in self.iter_blocks(checkpoint['filenum'],
+                                               self.filenum):
+            filenum = self.block_number(f)
+            for t in ledger_data['transactions']:
+                # Records before the checkpoint are already indexed
+                if t['tid'] < checkpoint['next_tid']:
+                    continue
+                # As in append_transaction, a cancelled amount is backed out
+                # of the user balances the first time it is cancelled
+                original = None
+                if ('cancelled_tid' in t and not
+                        self.tid_index.is_cancelled(t['cancelled_tid'])):
+                    original = self.get_transaction(t['cancelled_tid'])
+                self.tid_index.add(t, filenum)
+                self.user_index.add(t, filenum, original)
+                replayed += 1
+            # Only sealed blocks have a footer
+            if 'next_block' in ledger_data and filenum >= len(self.footers):
+                footer = ledger_data.get('footer')
+                if footer is None:
+                    footer = build_footer(ledger_data['transactions'])
+                self.footers.append(footer)
+        logger.debug('Replayed %d record(s) written after the checkpoint',
+                     replayed)
+
+    def block_footers(self):
+        """
+        Returns the footers of all blocks, including a footer computed for
+        the open block
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            A list of footer dictionaries, indexed by block number
+        """
+        return self.footers + [build_footer(self.block_data['transactions'])]
+
+    def find_blocks(self, first_tid=None, last_tid=None, user=None):
+        """
+        Uses the block footers to find the blocks that may contain matching
+        transactions, so all other blocks can be skipped without reading them
+
+        Parameters:
+            self : the instance of the class
+            first_tid : if set, the lowest tid of interest
+            last_tid : if set, the highest tid of interest
+            user : if set, only blocks in which this user sent or received
+                   a transaction are returned
+
+        Returns:
+            A list of the matching block numbers
+        """
+        matches = []
+        for filenum, footer in enumerate(self.block_footers()):
+            # Skip empty blocks and blocks outside the tid range
+            if footer['min_tid'] is None:
+                continue
+            if first_tid is not None and footer['max_tid'] < first_tid:
+                continue
+            if last_tid is not None and footer['min_tid'] > last_tid:
+                continue
+            if (user is not None and user not in footer['senders']
+                    and user not in footer['receivers']):
+                continue
+            matches.append(filenum)
+        return matches
+
+    @timed('aggregate.transactions_in_range')
+    def transactions_in_range(self, first_tid, last_tid):
+        """
+        Returns all transactions and cancellation records with a tid between
+        first_tid and last_tid, inclusive. Only blocks whose footer overlaps
+        the range are read.
+
+        Parameters:
+            self : the instance of the class
+            first_tid : the lowest tid to return
+            last_tid : the highest tid to return
+
+        Returns:
+            A list of transaction dictionaries in tid order
+        """
+        transactions = []
+        for filenum in self.find_blocks(first_tid, last_tid):
+            if filenum == self.filenum:
+                ledger_data = self.block_data
+            else:
+                ledger_data = self.from_file(self.block_filename(filenum))
+            for t in ledger_data['transactions']:
+                if first_tid <= t['tid'] <= last_tid:
+                    transactions.append(t)
+        return transactions
+
+    def get_merkle_proof(self, tid):
         """
+        Builds the proof that a transaction in a sealed block is part of
+        that block. The proof can be checked with merkle.verify_proof against
+        the Merkle root in the block's footer, without the rest of the block.
+
+        Parameters:
+            self : the instance of the class
+            tid : transaction id to prove
+
+        Returns:
+            A dictionary with the transaction, its block number, the block's
+            Merkle root and the proof, or None if the tid does not exist or
+            its block has not been sealed yet
+        """
+        location = self.tid_index.locate(tid)
+        if location is None or location[0] >= len(self.footers):
+            return None
+        filenum, position = location
+
+        ledger_data = self.from_file(self.block_filename(filenum))
+        transactions = ledger_data['transactions']
+        return {'transaction': transactions[position],
+                'block': filenum,
+                'merkle_root': self.footers[filenum]['merkle_root'],
+                'proof': merkle.merkle_proof(transactions, position)}
+
+    @timed('aggregate.verify')
+    def verify(self, workers=None, min_bits=miner.DEFAULT_BITS):
+        """
+        Verifies the whole blockchain: every block header must be mined at
+        no less than the minimum difficulty, meet the proof of work target
+        of its own difficulty and contain the hash of the previous block's
+        header, every sealed block must point to the next block, and the
+        Merkle root in every footer must match the block's transactions. The
+        Merkle root of every sealed block must also be listed, in block
+        order, in the 'merkle_roots' of a later block header, so the hash
+        chain covers the transactions. A header mined ahead in the background
+        commits to the blocks sealed before the previous block, so the roots
+        of the last two blocks may not be committed to yet; those blocks are
+        only protected by their footers until the following headers are
+        added. A block whose Merkle tree has equal siblings is rejected,
+        since repeating trailing transactions can keep the Merkle root. The
+        hashing is spread over a pool of worker processes, started with
+        miner.MP_CONTEXT since the blocks are prefetched by threads.
+
+        Parameters:
+            self : the instance of the class
+            workers : the number of worker processes, or None for one per
+                      CPU core
+            min_bits : the lowest difficulty in bits accepted for a block
+                       header. The difficulty is stored in the header
+                       itself, so without this bound a header claiming a
+                       difficulty of 0 bits would pass. Lower it to the
+                       RetargetPolicy's min_bits for a ledger mined with
+                       retargeting.
+
+        Returns:
+            A dictionary with 'valid' (True if no problems were found),
+            'blocks' (the number of blocks checked) and 'errors' (a list of
+            problem descriptions)
+        """
+        if workers is None:
+            workers = os.cpu_count() or 1
+        errors = []
+        prev_hash = None
         count = 0
-        # Iterate through files using generator method
-        for f in self.yield_block_files(self.filedir):
-            print(f)
-            # Get ledger data from file
-            ledger_data = self.from_file(f)
+        # Merkle roots of the sealed blocks, and the number of them
+        # committed to by the block headers checked so far
+        roots = []
+        committed = 0
+
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=miner.MP_CONTEXT) as executor:
+            blocks = self.iter_blocks()
+            done = False
+            while not done:
+                # Hash the blocks in batches so only a bounded number of
+                # blocks is held in memory
+                batch = []
+                for item in blocks:
+                    batch.append(item)
+                    if len(batch) >= workers * 8:
+                        break
+                else:
+                    done = True
+
+                results = executor.map(verify_block,
+                                       [data for f, data in batch])
+                for (f, ledger_data), result in zip(batch, results):
+                    filenum = self.block_number(f)
+                    hdr = ledger_data.get('hdr', {})
+
+                    if result['hash'] is None:
+                        errors.append('Block %d: header has no nonce' %
+                                      filenum)
+                    elif not result['pow_ok']:
+                        errors.append('Block %d: header hash does not meet '
+                                      'the proof of work target' % filenum)
+                    elif miner.header_bits(hdr) < min_bits:
+                        errors.append('Block %d: header difficulty of %s '
+                                      'bits is below the minimum of %d' %
+                                      (filenum, miner.header_bits(hdr),
+                                       min_bits))
+
+                    # Each header must contain the previous header's hash
+                    if (count > 0 and prev_hash is not None
+                            and hdr.get('previous_hash') != prev_hash):
+                        errors.append('Block %d: previous hash does not '
+                                      'match block %d' % (filenum,
+                                                          filenum - 1))
+
+                    if result['merkle_ok'] is False:
+                        errors.append('Block %d: Merkle root does not match '
+                                      'its transactions' % filenum)
+                    if result['merkle_mutated']:
+                        errors.append('Block %d: Merkle tree has repeated '
+                                      'transactions' % filenum)
+
+                    # The header must commit to the Merkle roots of the
+                    # blocks sealed before the previous block
+                    for root in hdr.get('merkle_roots', []):
+                        if committed >= len(roots):
+                            errors.append('Block %d: header commits to a '
+                                          'block not sealed before it' %
+                                          filenum)
+                            break
+                        if root != roots[committed]:
+                            errors.append('Block %d: header commits to a '
+                                          'wrong Merkle root for block %d' %
+                                          (filenum, committed))
+                        committed += 1
+                    if committed < filenum - 1:
+                        errors.append('Block %d: header does not commit to '
+                                      'the Merkle root of block %d' %
+                                      (filenum, committed))
+                        committed = filenum - 1
+                    if result['merkle_root'] is not None:
+                        roots.append(result['merkle_root'])
+
+                    next_block = ledger_data.get('next_block')
+                    if (next_block is not None and next_block !=
+                            'block_' + str(filenum + 1) + '.json'):
+                        errors.append('Block %d: unexpected next block %s' %
+                                      (filenum, next_block))
+
+                    prev_hash = result['hash']
+                    count += 1
+
+        for error in errors:
+            logger.error('Verification failed. %s', error)
+        logger.info('Verified %d block(s) in %s: %d problem(s) found', count,
+                    self.filedir, len(errors))
+        return {'valid': not errors, 'blocks': count, 'errors': errors}
+
+    @timed('aggregate.scan')
+    def scan(self):
+        """
+        Reads every block once and feeds its transactions to a new
+        LedgerStats object. The cancelled tids are taken from the tid index,
+        so cancelled transactions are excluded in the same pass.
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            stats: The LedgerStats object holding the computed statistics
+        """
+        stats = LedgerStats(known_cancelled=self.tid_index.cancelled,
+                            tid_base=self.tid_base)
+        # Iterate through blocks using generator method
+        for f, ledger_data in self.iter_blocks():
             # Iterate through transactions in file
             for t in ledger_data['transactions']:
-                # If transaction does not contain 'cancelled_tid', increment
-                # count variable
-                if not(t.__contains__('cancelled_tid')):
-                    count += 1
-        return count
+                stats.add(t)
+        return stats
+
+    def transaction_count(self):
+        """
+        Calculates total number of valid transactions found in the blockchain
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            The total number of valid transactions in the blockchain file
+        """
+        return self.statistics().transaction_count
 
     def cancelled_transaction_count(self):
         """
@@ -297,18 +1465,7 @@ class Ledger(object):
         Returns:
             Total numbers of cancelled transactions
         """
-        count = 0
-        # Iterate through files using generator method
-        for f in self.yield_block_files(self.filedir):
-            # Get ledger data from file
-            ledger_data = self.from_file(f)
-            # Iterate through transactions in file
-            for t in ledger_data['transactions']:
-                # If transaction contains 'cancelled_tid', increment
-                # count variable
-                if(t.__contains__('cancelled_tid')):
-                    count += 1
-        return count
+        return self.statistics().cancelled_count
 
     def net_value(self):
         """
@@ -321,20 +1478,7 @@ class Ledger(object):
         Returns:
             The net value of all transactions in the blockchain file
         """
-        net = 0
-        # Iterate through files using generator method
-        for f in self.yield_block_files(self.filedir):
-            # Get ledger data from file
-            ledger_data = self.from_file(f)
-            # Iterate through transactions in file
-            for t in ledger_data['transactions']:
-                try:
-                    # Add transaction amount to net value
-                    net += t['amount']
-                except:
-                    # If entry doesn't contain 'amount' key, skip and continue
-                    continue
-        return net
+        return self.statistics().amount_total
 
     def average_value(self):
         """
@@ -347,27 +1491,7 @@ class Ledger(object):
         Returns:
             The average value of all transactions in the blockchain file
         """
-        total = 0
-        count = 0
-        average = 0
-        # Iterate through files using generator method
-        for f in self.yield_block_files(self.filedir):
-            # Get ledger data from file
-            ledger_data = self.from_file(f)
-            # Iterate through transactions in file
-            for t in ledger_data['transactions']:
-                try:
-                    # Add transaction amount to total and increment count
-                    total += t['amount']
-                    count += 1
-                except:
-                    # If entry doesn't contain 'amount' key, skip and continue
-                    continue
-
-        # If there are no transactions, prevent division by zero
-        if count > 0:
-            average = total/count
-        return average
+        return self.statistics().average_value()
 
     def print_ledger(self):
         """
@@ -380,14 +1504,38 @@ class Ledger(object):
             N/A
         """
         print('Transactions:')
-        # Iterate through files using generator method
-        for f in self.yield_block_files(self.filedir):
-            # Get ledger data from file
-            ledger_data = self.from_file(f)
+        # Iterate through blocks using generator method
+        for f, ledger_data in self.iter_blocks():
             # Iterate through transactions in file and print each transaction
             for t in ledger_data['transactions']:
                 print(' ', t)
 
+    def metrics_info(self):
+        """
+        Returns the recorded instrumentation metrics
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            A dictionary as returned by instrumentation.Metrics.to_dict,
+            empty if instrumentation is disabled
+        """
+        return self.metrics.to_dict()
+
+    def cache_info(self):
+        """
+        Returns the block cache counters, for tuning the cache size
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            A dictionary with the cache hits, misses, validations, evictions,
+            current size and maximum size
+        """
+        return self.cache.info()
+
     def set_current_filename(self):
         """
         Sets the current blockchain filename to the next filename in the
@@ -399,13 +1547,40 @@ class Ledger(object):
         Returns:
             N/A
         """
-        self.filename = self.filedir + '/block_' + str(self.filenum) + '.json'
+        self.filename = self.block_filename(self.filenum)
+
+    def block_filename(self, filenum):
+        """
+        Returns the name of the blockchain file with the specified number
+
+        Parameters:
+            self : the instance of the class
+            filenum : the block number
+
+        Returns:
+            The name of the block file
+        """
+        return self.filedir + '/block_' + str(filenum) + '.json'
+
+    def block_number(self, filename):
+        """
+        Returns the block number encoded in a block file name
+
+        Parameters:
+            self : the instance of the class
+            filename : the name of the block file
+
+        Returns:
+            The block number
+        """
+        basename = filename.rsplit('/', 1)[-1]
+        return int(basename[len('block_'):].split('.', 1)[0])
 
     def yield_block_files(self, dir):
         """
-        Generator method that yields single block files as a part of a loop
-        operation performed by the caller. During each loop iteration by the
-        caller, the next block file is returned.
+        Generator method that yields single block files in chain order as a
+        part of a loop operation performed by the caller. During each loop
+        iteration by the caller, the next block file is returned.
 
         Parameters:
             self : the instance of the class
@@ -414,20 +1589,78 @@ class Ledger(object):
         Returns:
             The next block file
         """
-        # Iterate through elements in specified directory and if element is a
-        # file, yield the file back to the caller
-        response = s3_client.list_objects(
-            Bucket=bucket, 
-            Prefix=dir
-        )
-        
-        for f in response['Contents']:
-            yield f['Key']
-        
-        #for f in os.listdir(dir):
-        #    if os.path.isfile(os.path.join(dir, f)):
-        #        yield f
-        
+        # Collect the block files in the specified directory and yield them
+        # back to the caller in chain order
+        block_files = [f for f in self.storage.list_keys(dir + '/')
+                       if f.rsplit('/', 1)[-1].startswith('block_')]
+        # The open block is read from the buffer, so it is listed even if
+        # it has not been written yet
+        if (dir == self.filedir and self.filename not in block_files
+                and (self.block_data['hdr']
+                     or self.block_data['transactions'])):
+            block_files.append(self.filename)
+        for f in sorted(block_files, key=self.block_number):
+            yield f
+
+    def read_block(self, filename):
+        """
+        Returns a block of the ledger, taking the open block from the
+        buffer instead of storage, so reading never writes the buffer. The
+        returned data must not be modified.
+
+        Parameters:
+            self : the instance of the class
+            filename : the name of the block file
+
+        Returns:
+            ledger_data : the block's ledger data
+        """
+        if filename == self.filename:
+            return self.block_data
+        return self.from_file(filename)
+
+    def iter_blocks(self, first_block=0, last_block=None):
+        """
+        Generator method that yields every block of the blockchain in chain
+        order, including the buffered open block. While the caller works on
+        one block, the next blocks are downloaded and parsed by a bounded
+        pool of threads.
+
+        Parameters:
+            self : the instance of the class
+            first_block : the number of the first block to yield
+            last_block : the number of the last block to yield, which must
+                         exist or be the open block, or None to list the
+                         blocks in storage
+
+        Returns:
+            A (block file, ledger data) tuple for the next block
+        """
+        if last_block is None:
+            block_files = (f for f in self.yield_block_files(self.filedir)
+                           if self.block_number(f) >= first_block)
+        else:
+            block_files = (self.block_filename(filenum)
+                           for filenum in range(first_block, last_block + 1))
+
+        # Without prefetching, read the blocks one at a time
+        if self.prefetch <= 1:
+            for f in block_files:
+                yield f, self.read_block(f)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.prefetch) as executor:
+            # Keep up to prefetch downloads in flight, in chain order
+            in_flight = deque()
+            for f in block_files:
+                in_flight.append((f, executor.submit(self.read_block, f)))
+                if len(in_flight) >= self.prefetch:
+                    f, future = in_flight.popleft()
+                    yield f, future.result()
+            while in_flight:
+                f, future = in_flight.popleft()
+                yield f, future.result()
+
     def transaction_exists(self, tid):
         """
         Checks if a transaction with the specified tid exists in the blockchain
@@ -440,15 +1673,112 @@ class Ledger(object):
             True if the transaction with the specified tid exits,
             False otherwise
         """
-        for f in self.yield_block_files(self.filedir):
-            # Get ledger data from file
-            ledger_data = self.from_file(f)
-            # Iterate through transactions in file
-            for t in ledger_data['transactions']:
-                # If tid is found and is not a cancellation, return true/found
-                if t['tid'] == tid and not(t.__contains__('cancelled_tid')):
-                    return True
-        return False
+        # The tid index answers without reading any block
+        return self.tid_index.exists(tid)
+
+    def is_cancelled(self, tid):
+        """
+        Checks if the transaction with the specified tid has been cancelled
+
+        Parameters:
+            self : the instance of the class
+            tid : transaction id to check
+
+        Returns:
+            True if the transaction has been cancelled, False otherwise
+        """
+        return self.tid_index.is_cancelled(tid)
+
+    def get_transaction(self, tid):
+        """
+        Looks up a single transaction or cancellation record by its tid.
+        Only the block holding the tid is read.
+
+        Parameters:
+            self : the instance of the class
+            tid : transaction id to look up
+
+        Returns:
+            The transaction dictionary, or None if the tid does not exist
+        """
+        location = self.tid_index.locate(tid)
+        if location is None:
+            return None
+        filenum, position = location
+
+        # The open block is read from the buffer, sealed blocks from storage
+        if filenum == self.filenum:
+            ledger_data = self.block_data
+        else:
+            ledger_data = self.from_file(self.block_filename(filenum))
+
+        try:
+            return ledger_data['transactions'][position]
+        except IndexError:
+            logger.error('Transaction %d missing from block %d', tid, filenum)
+            return None
+
+    @timed('aggregate.history')
+    def history(self, user, include_cancelled=False):
+        """
+        Returns the transactions a user sent or received, using the per-user
+        index. Only the blocks holding the user's transactions are read, and
+        each of them only once.
+
+        Parameters:
+            self : the instance of the class
+            user : the name of the user
+            include_cancelled : True to also return transactions that have
+                                been cancelled
+
+        Returns:
+            A list of transaction dictionaries in tid order
+        """
+        transactions = []
+        ledger_data = None
+        block = None
+        for tid, filenum in self.user_index.history(user):
+            if not include_cancelled and self.tid_index.is_cancelled(tid):
+                continue
+            # Postings are in tid order, so each block is fetched once
+            if filenum != block:
+                block = filenum
+                if filenum == self.filenum:
+                    ledger_data = self.block_data
+                else:
+                    ledger_data = self.from_file(self.block_filename(filenum))
+            position = tid - self.tid_index.block_starts[filenum]
+            transactions.append(ledger_data['transactions'][position])
+        return transactions
+
+    def balance(self, user):
+        """
+        Returns the amount a user received minus the amount they sent,
+        excluding cancelled transactions
+
+        Parameters:
+            self : the instance of the class
+            user : the name of the user
+
+        Returns:
+            The balance of the user, 0 for an unknown user
+        """
+        return self.user_index.balance(user)
+
+    def top_users(self, n=10, by=TOP_TRANSACTIONS):
+        """
+        Returns the n users with the most transactions, the highest balance
+        or the highest volume
+
+        Parameters:
+            self : the instance of the class
+            n : the number of users to return
+            by : user_index.TOP_TRANSACTIONS, TOP_BALANCE or TOP_VOLUME
+
+        Returns:
+            A list of (user, value) tuples, highest value first
+        """
+        return self.user_index.top_users(n, by)
 
     def get_transaction_count_by_user(self):
         """
@@ -461,30 +1791,7 @@ class Ledger(object):
             transaction_count: This is a dictionary containing how many
             transactions a user has sent or received across the blockchain
         """
-        # Define dictionary to maintain transaction counts for users
-        transaction_count = {'Alice': 0, 'Bob': 0, 'Jon': 0, 'Howard': 0,
-                             'Rocky': 0}
-
-        # Iterate through files using generator method
-        for f in self.yield_block_files(self.filedir):
-            # Get ledger data from file
-            ledger_data = self.from_file(f)
-            # Iterate through transactions in file
-            for t in ledger_data['transactions']:
-                # Increment count sender and receiver
-                try:
-                    sender = t['sender']
-                    receiver = t['receiver']
-                    transaction_count[sender] += 1
-                    transaction_count[receiver] += 1
-                except KeyError:
-                    # Skip cancellations
-                    continue
-                except Exception as e:
-                    logger.error(
-                        "Unknown exception has occurred: %s", e)
-
-        return(transaction_count)
+        return dict(self.statistics().user_counts)
 
     def get_debits(self):
         """
@@ -497,31 +1804,7 @@ class Ledger(object):
             debit_count: This is a dictionary containing the sum of all debits
             for each user
         """
-        # Define dictionary to maintain total amount of debits for users
-        debit_amounts = {}
-
-        # Iterate through files using generator method
-        for f in self.yield_block_files(self.filedir):
-            # Get ledger data from file
-            ledger_data = self.from_file(f)
-            # Iterate through transactions in file
-            for t in ledger_data['transactions']:
-                # Add transaction amount to total debit amount for receiver
-                try:
-                    sender = t['sender']
-                    amount = t['amount']
-                    if sender in debit_amounts:
-                        debit_amounts[sender] += amount
-                    else:
-                        debit_amounts[sender] = amount
-                except KeyError:
-                    # Skip cancellations
-                    continue
-                except Exception as e:
-                    logger.error(
-                        "Unknown exception has occurred: %s", e)
-
-        return(debit_amounts)
+        return dict(self.statistics().debits)
 
     def get_credits(self):
         """
@@ -534,32 +1817,8 @@ class Ledger(object):
             credit_count: This is a dictionary containing the sum of all
             credits for each user
         """
-        # Define dictionary to maintain total amount of credits for users
-        credit_amounts = {}
-
-        # Iterate through files using generator method
-        for f in self.yield_block_files(self.filedir):
-            # Get ledger data from file
-            ledger_data = self.from_file(f)
-            # Iterate through transactions in file
-            for t in ledger_data['transactions']:
-                # Add transaction amount to total credit amount for sender
-                try:
-                    receiver = t['receiver'] 
-                    amount = t['amount']
-                    if receiver in credit_amounts:
-                        credit_amounts[receiver] += amount
-                    else:
-                        credit_amounts[receiver] = amount
-                except KeyError:
-                    # Skip cancellations
-                    continue
-                except Exception as e:
-                    logger.error(
-                        "Unknown exception has occurred: %s", e)
+        return dict(self.statistics().credits)
 
-        return(credit_amounts)
-    
     def generate_report(self):
         """
        Generates report of transaction data
@@ -570,33 +1829,11 @@ class Ledger(object):
         Returns:
             N/A
         """
-        report = "Blockchain Report - Generated: " + self.now.strftime("%b %d %Y %H:%M:%S %Z") + "\n\n"
-        report += "Blockchain File Directory: " + self.filedir + "\n"
-        report += "-------------------------------------------"
-        report += "-------------------\n\n\n"
-        report += "General Statistics\n"
-        report += "--------------------------------------------------------------\n"
-        report += "Total Transactions:  " + str(self.transaction_count()) + "\n"
-        report += "Total Cancellations:  " + str(self.cancelled_transaction_count()) + "\n\n"
-        report += "Net Value of All Transactions: " + "${:0,.2f}".format(float(self.net_value())) + "\n"
-        report += "Average Value of Transactions: " + "${:0,.2f}".format(float(self.average_value())) + "\n\n\n"
-        report += "User Statistics\n"
-        report += "--------------------------------------------------------------\n"
-        report += "Total Transactions By User:\n"
-        user_transactions = self.get_transaction_count_by_user()
-        for user in user_transactions:
-            report += "  {:<8} {:<10}\n".format(user, user_transactions[user])
-        report += "\nTotal Debits By User:\n"
-        user_debits = self.get_debits()
-        for user in user_debits:
-            report += "  {:<8} ${:0.2f}\n".format(user, user_debits[user])
-        report += "\nTotal Credits By User:\n"
-        user_credits = self.get_credits()
-        for user in user_credits:
-            report += "  {:<8} ${:0.2f}\n".format(user, user_credits[user])
-            
-        s3_client.put_object(
-            Bucket = bucket,
-            Key='report_' + self.dt_str + '.txt',
-            Body = report)
+        # Format the running statistics into the report
+        report = format_report(self.statistics(), self.filedir, self.now)
+        # Append the instrumentation metrics, if enabled
+        report += self.metrics.format_report()
+
+        self.storage.put('report_' + self.dt_str + '.txt',
+                         report.encode('utf-8'))
 
@@ -0,0 +1,179 @@
+import os
+import numpy as np
+from ledger_stats import LedgerStats
+
+# Names of the columns produced by build_arrays
+COLUMNS = ['tid', 'sender', 'receiver', 'amount', 'cancelled',
+           'cancelled_tid']
+
+
+def build_arrays(blocks):
+    """
+    Converts the transactions of a ledger into NumPy columns. Every record
+    becomes one row; cancellation records have sender and receiver code -1
+    and the tid they cancel in cancelled_tid.
+
+    Parameters:
+        blocks : an iterable of block ledger data dictionaries in chain order
+
+    Returns:
+        arrays : a dictionary holding the 'users' array of user names and
+                 the columns 'tid' (int64), 'sender' and 'receiver' (int32
+                 codes into users), 'amount' (int64, or float64 if any
+                 amount is a float), 'cancelled' (bool, True for
+                 transactions that were later cancelled) and 'cancelled_tid'
+                 (int64, -1 for transactions)
+    """
+    users = {}
+    tids = []
+    senders = []
+    receivers = []
+    amounts = []
+    cancelled_tids = []
+
+    for ledger_data in blocks:
+        for t in ledger_data['transactions']:
+            tids.append(t['tid'])
+            if 'cancelled_tid' in t:
+                senders.append(-1)
+                receivers.append(-1)
+                amounts.append(0)
+                cancelled_tids.append(t['cancelled_tid'])
+            else:
+                senders.append(users.setdefault(t['sender'], len(users)))
+                receivers.append(users.setdefault(t['receiver'], len(users)))
+                amounts.append(t['amount'])
+                cancelled_tids.append(-1)
+
+    amount_dtype = np.int64
+    if any(isinstance(a, float) for a in amounts):
+        amount_dtype = np.float64
+
+    arrays = {'users': np.array(list(users), dtype=str),
+              'tid': np.array(tids, dtype=np.int64),
+              'sender': np.array(senders, dtype=np.int32),
+              'receiver': np.array(receivers, dtype=np.int32),
+              'amount': np.array(amounts, dtype=amount_dtype),
+              'cancelled_tid': np.array(cancelled_tids, dtype=np.int64)}
+    arrays['cancelled'] = np.isin(
+        arrays['tid'], arrays['cancelled_tid'][arrays['cancelled_tid'] >= 0])
+    return arrays
+
+
+def save_arrays(arrays, path):
+    """
+    Saves the columns as one .npy file each in a directory, so they can be
+    loaded memory-mapped
+
+    Parameters:
+        arrays : the dictionary returned by build_arrays
+        path : the directory to write the files to
+
+    Returns:
+        N/A
+    """
+    os.makedirs(path, exist_ok=True)
+    for name, column in arrays.items():
+        np.save(os.path.join(path, name + '.npy'), column)
+
+
+def load_arrays(path, mmap=True):
+    """
+    Loads columns saved by save_arrays
+
+    Parameters:
+        path : the directory holding the .npy files
+        mmap : True to memory-map the columns instead of reading them
+
+    Returns:
+        arrays : a dictionary with the same entries as build_arrays
+    """
+    mmap_mode = 'r' if mmap else None
+    return {name: np.load(os.path.join(path, name + '.npy'),
+                          mmap_mode=mmap_mode)
+            for name in ['users'] + COLUMNS}
+
+
+def per_user_sum(codes, weights, user_count):
+    """
+    Sums weights per user code with np.bincount
+
+    Parameters:
+        codes : the user code of every row
+        weights : the value of every row
+        user_count : the number of users
+
+    Returns:
+        An array holding the sum for every user code
+    """
+    if weights.dtype.kind == 'f':
+        return np.bincount(codes, weights=weights, minlength=user_count)
+    # Sum integer amounts exactly instead of through float weights
+    sums = np.zeros(user_count, dtype=np.int64)
+    np.add.at(sums, codes, weights)
+    return sums
+
+
+def first_seen(codes):
+    """
+    Returns the distinct codes in the order they first appear
+
+    Parameters:
+        codes : an array of user codes
+
+    Returns:
+        An array of the distinct codes, ordered by first appearance
+    """
+    unique, index = np.unique(codes, return_index=True)
+    return unique[np.argsort(index)]
+
+
+def stats_from_arrays(arrays, tid_base=0):
+    """
+    Computes the report statistics from the columns with vectorized NumPy
+    operations. The result matches the LedgerStats object built by a scan.
+
+    Parameters:
+        arrays : the dictionary returned by build_arrays or load_arrays
+        tid_base : the lowest tid the ledger can assign
+
+    Returns:
+        stats : a LedgerStats object holding the statistics
+    """
+    users = [str(u) for u in arrays['users']]
+    is_transaction = arrays['cancelled_tid'] < 0
+    live = is_transaction & ~arrays['cancelled']
+
+    senders = arrays['sender'][is_transaction]
+    receivers = arrays['receiver'][is_transaction]
+    amounts = arrays['amount']
+
+    def to_python(value):
+        return value.item() if hasattr(value, 'item') else value
+
+    stats = LedgerStats(tid_base=tid_base)
+    stats.transaction_count = int(is_transaction.sum())
+    stats.cancelled_count = int((~is_transaction).sum())
+    stats.amount_total = to_python(amounts[live].sum())
+    stats.amount_count = int(live.sum())
+    # Record the cancelled tids, once each
+    for tid in np.unique(arrays['cancelled_tid'][~is_transaction]):
+        stats.cancelled.add(int(tid))
+
+    # Transaction counts by user. Codes are assigned in the order users
+    # first appear, as the counts are listed.
+    counts = (np.bincount(senders, minlength=len(users))
+              + np.bincount(receivers, minlength=len(users)))
+    for code, user in enumerate(users):
+        stats.user_counts[user] = int(counts[code])
+
+    # Debits and credits of live transactions, listing users in the order
+    # they first appear
+    live_amounts = np.where(live, amounts, 0)[is_transaction]
+    debits = per_user_sum(senders, live_amounts, len(users))
+    credits = per_user_sum(receivers, live_amounts, len(users))
+    for code in first_seen(senders):
+        stats.debits[users[code]] = to_python(debits[code])
+    for code in first_seen(receivers):
+        stats.credits[users[code]] = to_python(credits[code])
+    return stats
@@ -0,0 +1,201 @@
+from tid_bitmap import TidBitmap
+
+
+class LedgerStats(object):
+    """
+    LedgerStats - accumulates every ledger statistic used by the reports
+                  while transactions are fed to it one at a time. The ledger
+                  updates it on every write and stores it next to the
+                  blocks, and a full scan can rebuild it. Amounts of
+                  cancelled transactions are excluded from the net value,
+                  average, debits and credits.
+
+    """
+    def __init__(self, known_cancelled=None, tid_base=0):
+        """
+        Initializes an instance of the LedgerStats class with all totals set
+        to zero
+
+        Parameters:
+            self : the instance of the class
+            known_cancelled : a TidBitmap of all cancelled tids, if known
+                              before the transactions are added. Cancelled
+                              transactions are then skipped as they are
+                              added. Otherwise their amounts are backed out
+                              when their cancellation is added.
+            tid_base : the lowest tid the ledger can assign
+
+        Returns:
+            N/A
+        """
+        # Number of transactions and cancellations
+        self.transaction_count = 0
+        self.cancelled_count = 0
+        # Sum and number of transaction amounts
+        self.amount_total = 0
+        self.amount_count = 0
+        # Per-user transaction counts, debits and credits
+        self.user_counts = {}
+        self.debits = {}
+        self.credits = {}
+        # Tids cancelled so far
+        self.cancelled = TidBitmap(tid_base)
+        self.known_cancelled = known_cancelled
+
+    def add(self, transaction, original=None):
+        """
+        Adds a single transaction or cancellation record to the totals
+
+        Parameters:
+            self : the instance of the class
+            transaction : the transaction dictionary read from a block
+            original : for a cancellation record, the transaction it
+                       cancels, whose amount is backed out of the totals
+
+        Returns:
+            N/A
+        """
+        if 'cancelled_tid' in transaction:
+            self.cancelled_count += 1
+            cancelled_tid = transaction['cancelled_tid']
+            # A transaction cancelled more than once is only backed out once
+            if cancelled_tid in self.cancelled:
+                return
+            self.cancelled.add(cancelled_tid)
+            if self.known_cancelled is None and original is not None:
+                self.apply_amount(original, -1)
+            return
+
+        self.transaction_count += 1
+
+        sender = transaction.get('sender')
+        receiver = transaction.get('receiver')
+
+        if sender is not None and receiver is not None:
+            self.user_counts[sender] = self.user_counts.get(sender, 0) + 1
+            self.user_counts[receiver] = self.user_counts.get(receiver, 0) + 1
+
+        # Skip the amount of a transaction already known to be cancelled,
+        # but still list its users in the debits and credits, as backing the
+        # amount out later would
+        if (self.known_cancelled is not None
+                and transaction.get('tid') in self.known_cancelled):
+            self.apply_amount(transaction, 0)
+            return
+        self.apply_amount(transaction, 1)
+
+    def apply_amount(self, transaction, sign):
+        """
+        Adds a transaction's amount to, or removes it from, the net value,
+        average, debits and credits
+
+        Parameters:
+            self : the instance of the class
+            transaction : the transaction dictionary
+            sign : 1 to add the amount, -1 to remove it, 0 to only list the
+                   users
+
+        Returns:
+            N/A
+        """
+        amount = transaction.get('amount')
+        if amount is None:
+            return
+        sender = transaction.get('sender')
+        receiver = transaction.get('receiver')
+
+        self.amount_total += sign * amount
+        self.amount_count += sign
+        if sender is not None:
+            self.debits[sender] = self.debits.get(sender, 0) + sign * amount
+        if receiver is not None:
+            self.credits[receiver] = (self.credits.get(receiver, 0)
+                                      + sign * amount)
+
+    def merge(self, other):
+        """
+        Adds the totals of another LedgerStats object, such as those of
+        another shard, to these totals. The cancelled tid sets are not
+        merged, since each shard assigns tids from its own range.
+
+        Parameters:
+            self : the instance of the class
+            other : the LedgerStats object to add
+
+        Returns:
+            N/A
+        """
+        self.transaction_count += other.transaction_count
+        self.cancelled_count += other.cancelled_count
+        self.amount_total += other.amount_total
+        self.amount_count += other.amount_count
+        for totals, other_totals in ((self.user_counts, other.user_counts),
+                                     (self.debits, other.debits),
+                                     (self.credits, other.credits)):
+            for user, value in other_totals.items():
+                totals[user] = totals.get(user, 0) + value
+
+    def to_dict(self):
+        """
+        Converts the totals into a dictionary that can be stored as JSON.
+        The set of cancelled tids is left out, since the ledger stores the
+        totals on every flush and its tid index already holds the set.
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            A dictionary containing all totals
+        """
+        return {'transaction_count': self.transaction_count,
+                'cancelled_count': self.cancelled_count,
+                'amount_total': self.amount_total,
+                'amount_count': self.amount_count,
+                'user_counts': self.user_counts,
+                'debits': self.debits,
+                'credits': self.credits}
+
+    @classmethod
+    def from_dict(cls, data, cancelled=None):
+        """
+        Creates a LedgerStats object from a dictionary produced by to_dict
+
+        Parameters:
+            cls : the LedgerStats class
+            data : the dictionary of totals
+            cancelled : the TidBitmap of the tids cancelled so far, which
+                        the restored object takes over, or None for an
+                        empty set
+
+        Returns:
+            stats : the restored LedgerStats object
+        """
+        stats = cls()
+        stats.transaction_count = data['transaction_count']
+        stats.cancelled_count = data['cancelled_count']
+        stats.amount_total = data['amount_total']
+        stats.amount_count = data['amount_count']
+        stats.user_counts = dict(data['user_counts'])
+        stats.debits = dict(data['debits'])
+        stats.credits = dict(data['credits'])
+        if cancelled is not None:
+            stats.cancelled = cancelled
+        elif 'cancelled' in data:
+            # Statistics stored before the set was left out
+            stats.cancelled = TidBitmap.from_dict(data['cancelled'])
+        return stats
+
+    def average_value(self):
+        """
+        Calculates the average value of all transactions added so far
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            The average transaction amount, or 0 if there are no transactions
+        """
+        # If there are no transactions, prevent division by zero
+        if self.amount_count > 0:
+            return self.amount_total / self.amount_count
+        return 0
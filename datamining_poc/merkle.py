@@ -0,0 +1,142 @@
+import json
+import hashlib
+
+# Domain separation prefixes, so a leaf can never be mistaken for a node
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+
+
+def leaf_hash(transaction):
+    """
+    Hashes a single transaction into a Merkle tree leaf
+
+    Parameters:
+        transaction : the transaction dictionary
+
+    Returns:
+        The leaf hash as bytes
+    """
+    data = json.dumps(transaction, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(LEAF_PREFIX + data.encode('utf-8')).digest()
+
+
+def node_hash(left, right):
+    """
+    Hashes two child hashes into their parent node
+
+    Parameters:
+        left : the left child hash as bytes
+        right : the right child hash as bytes
+
+    Returns:
+        The node hash as bytes
+    """
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+
+def next_level(level):
+    """
+    Computes the next level of the tree. When a level has an odd number of
+    hashes, the last hash is paired with itself.
+
+    Parameters:
+        level : the list of hashes of the current level
+
+    Returns:
+        The list of hashes of the parent level
+    """
+    if len(level) % 2 == 1:
+        level = level + [level[-1]]
+    return [node_hash(level[i], level[i + 1])
+            for i in range(0, len(level), 2)]
+
+
+def merkle_root(transactions):
+    """
+    Computes the Merkle root of a block's transactions
+
+    Parameters:
+        transactions : the list of transactions in the block
+
+    Returns:
+        The root hash as a hex string. The root of an empty block is the
+        hash of an empty string.
+    """
+    return checked_merkle_root(transactions)[0]
+
+
+def checked_merkle_root(transactions):
+    """
+    Computes the Merkle root of a block's transactions, and whether two
+    sibling hashes of the tree are equal. Since the last hash of an odd
+    level is paired with itself, a block that repeats its trailing
+    transactions can have the same root as the block without them
+    (CVE-2012-2459). Every transaction has its own tid, so the tree of a
+    genuine block never has equal siblings.
+
+    Parameters:
+        transactions : the list of transactions in the block
+
+    Returns:
+        A (root hash hex, mutated) tuple, where mutated is True if two
+        sibling hashes are equal
+    """
+    if not transactions:
+        return hashlib.sha256(b'').hexdigest(), False
+    level = [leaf_hash(t) for t in transactions]
+    mutated = False
+    while len(level) > 1:
+        if any(level[i] == level[i + 1]
+               for i in range(0, len(level) - 1, 2)):
+            mutated = True
+        level = next_level(level)
+    return level[0].hex(), mutated
+
+
+def merkle_proof(transactions, index):
+    """
+    Builds the proof that one transaction is part of a block: the sibling
+    hashes on the path from its leaf to the root
+
+    Parameters:
+        transactions : the list of transactions in the block
+        index : the position of the transaction in the block
+
+    Returns:
+        A list of [sibling hash hex, side] pairs from the leaf upwards,
+        where side is 'L' if the sibling is the left child
+    """
+    proof = []
+    level = [leaf_hash(t) for t in transactions]
+    while len(level) > 1:
+        if len(level) % 2 == 1:
+            level = level + [level[-1]]
+        if index % 2 == 0:
+            proof.append([level[index + 1].hex(), 'R'])
+        else:
+            proof.append([level[index - 1].hex(), 'L'])
+        level = next_level(level)
+        index //= 2
+    return proof
+
+
+def verify_proof(transaction, proof, root):
+    """
+    Checks a Merkle proof without needing the rest of the block
+
+    Parameters:
+        transaction : the transaction dictionary being proven
+        proof : the proof returned by merkle_proof
+        root : the Merkle root of the block as a hex string
+
+    Returns:
+        True if the transaction is part of the block with this root,
+        False otherwise
+    """
+    current = leaf_hash(transaction)
+    for sibling, side in proof:
+        if side == 'L':
+            current = node_hash(bytes.fromhex(sibling), current)
+        else:
+            current = node_hash(current, bytes.fromhex(sibling))
+    return current.hex() == root
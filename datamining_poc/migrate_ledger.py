@@ -0,0 +1,107 @@
+import argparse
+import json
+import logging
+import logging.config
+import storage
+import ledger
+import block_codec
+from block_format import (FORMAT_JSON, FORMAT_COLUMNAR, encode_block,
+                          decode_block)
+
+logging.config.fileConfig('logging.conf')
+logger = logging.getLogger('migrate_ledger')
+
+
+def migrate(dest_storage, filedir, block_format,
+            codec=block_codec.CODEC_NONE):
+    """
+    Rewrites every block of an existing ledger in the specified format and
+    compression codec. Blocks already stored that way are left untouched.
+    The ledger's manifest is updated too, so a ledger reopened with
+    Ledger.open keeps writing new blocks in the new format and codec.
+
+    Parameters:
+        dest_storage : the storage.Storage object holding the ledger
+        filedir : the directory of the ledger, e.g.
+                  '/blockchain_files/_20240101_120000'
+        block_format : FORMAT_JSON or FORMAT_COLUMNAR
+        codec : the compression codec, one of block_codec.CODECS
+
+    Returns:
+        A (converted, total) tuple with the number of blocks rewritten and
+        the number of blocks found
+    """
+    converted = 0
+    total = 0
+    for key in dest_storage.list_keys(filedir.rstrip('/') + '/'):
+        # Only block files are converted
+        if not key.rsplit('/', 1)[-1].startswith('block_'):
+            continue
+        total += 1
+
+        data, etag, metadata = dest_storage.get_if_changed(key)
+        ledger_data = decode_block(block_codec.decompress(data, metadata))
+        new_data, new_metadata = block_codec.compress(
+            encode_block(ledger_data, block_format), codec)
+        if new_data == data and (new_metadata or {}) == (metadata or {}):
+            continue
+
+        logger.info('Converting %s (%d -> %d bytes)', key, len(data),
+                    len(new_data))
+        dest_storage.put(key, new_data, new_metadata)
+        converted += 1
+
+    # Record the new format and codec for the blocks written after reopening
+    manifest_key = filedir.rstrip('/') + '/' + ledger.Ledger.MANIFEST_FILE
+    try:
+        manifest = json.loads(dest_storage.get(manifest_key).decode('utf-8'))
+        if (manifest.get('block_format'), manifest.get('codec')) != (
+                block_format, codec):
+            manifest['block_format'] = block_format
+            manifest['codec'] = codec
+            dest_storage.put(manifest_key,
+                             json.dumps(manifest,
+                                        separators=(',', ':')).encode('utf-8'))
+    except FileNotFoundError:
+        logger.info('No manifest found in %s', filedir)
+
+    logger.info('Converted %d of %d block(s) in %s to %s/%s', converted,
+                total, filedir, block_format, codec)
+    return converted, total
+
+
+def main():
+    """
+    Parses the command line and migrates the specified ledger
+
+    Parameters:
+        N/A
+
+    Returns:
+        N/A
+    """
+    parser = argparse.ArgumentParser(
+        description='Convert the blocks of a ledger to another format or '
+                    'compression codec')
+    parser.add_argument('filedir', help='directory of the ledger')
+    parser.add_argument('format', choices=[FORMAT_JSON, FORMAT_COLUMNAR],
+                        help='block format to convert to')
+    parser.add_argument('--codec', default=block_codec.CODEC_NONE,
+                        choices=sorted(block_codec.CODECS),
+                        help='compression codec to convert to')
+    parser.add_argument('--local', metavar='ROOT',
+                        help='read the ledger from this local directory '
+                             'instead of S3')
+    parser.add_argument('--bucket', default=storage.DEFAULT_BUCKET,
+                        help='S3 bucket holding the ledger')
+    args = parser.parse_args()
+
+    if args.local:
+        dest_storage = storage.LocalStorage(args.local)
+    else:
+        dest_storage = storage.S3Storage(args.bucket)
+    migrate(dest_storage, args.filedir, args.format, args.codec)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,195 @@
+import os
+import math
 import struct
 import json
 import hashlib
 import random
+import multiprocessing
+from concurrent.futures import (ProcessPoolExecutor, FIRST_COMPLETED,
+                                wait)
 import logging
 import logging.config
+import pow_backend
 
 # Define logger
 logging.config.fileConfig('logging.conf')
 logger = logging.getLogger('miner')
 
 
+def header_hash(block_hdr):
+    """
+    Recomputes the proof of work hash of a mined block header. The hash
+    covers the JSON encoded header without its nonce, followed by the
+    binary encoded nonce, exactly as computed by Miner.do_work.
+
+    Parameters:
+        block_hdr : the mined block header, including its 'nonce' entry
+
+    Returns:
+        The hash as a hex string
+    """
+    hdr = {k: v for k, v in block_hdr.items() if k != 'nonce'}
+    block_hash = hashlib.sha256(json.dumps(hdr).encode())
+    block_hash.update(struct.pack("<I", block_hdr['nonce']))
+    return block_hash.hexdigest()
+
+
+# Default proof of work difficulty, in leading zero bits of the hash. Headers
+# without a 'bits' entry were mined at this difficulty.
+DEFAULT_BITS = 16
+
+
+def target_for_bits(bits):
+    """
+    Converts a difficulty in bits into the proof of work target
+
+    Parameters:
+        bits : the number of leading zero bits a hash must have, 0 to 256
+
+    Returns:
+        The integer target; a hash meets it if its value is below it
+    """
+    if not 0 <= bits <= 256:
+        raise ValueError('Difficulty must be between 0 and 256 bits: '
+                         + str(bits))
+    return 2 ** (256 - bits)
+
+
+def header_bits(block_hdr):
+    """
+    Returns the difficulty a block header was mined at
+
+    Parameters:
+        block_hdr : the block header
+
+    Returns:
+        The difficulty in bits
+    """
+    return block_hdr.get('bits', DEFAULT_BITS)
+
+
+def meets_target(hash_hex, bits=DEFAULT_BITS):
+    """
+    Checks if a hash satisfies the proof of work difficulty
+
+    Parameters:
+        hash_hex : the hash as a hex string
+        bits : the difficulty in bits
+
+    Returns:
+        True if the leading bits of the hash are zero, False otherwise
+    """
+    return int(hash_hex, 16) < target_for_bits(bits)
+
+
+class RetargetPolicy(object):
+    """
+    RetargetPolicy - adjusts the mining difficulty from measured block times
+                     so blocks take about target_interval seconds to mine.
+                     Each extra bit of difficulty doubles the expected work,
+                     so the difficulty moves by log2 of the ratio between
+                     the target interval and the recent average block time.
+
+    """
+    def __init__(self, target_interval, window=4, max_step=2, min_bits=1,
+                 max_bits=32):
+        """
+        Initializes an instance of the RetargetPolicy class
+
+        Parameters:
+            self : the instance of the class
+            target_interval : the desired mining time per block, in seconds
+            window : the number of recent block times averaged
+            max_step : the largest change in bits made at once
+            min_bits : the lowest difficulty allowed
+            max_bits : the highest difficulty allowed
+
+        Returns:
+            N/A
+        """
+        if target_interval <= 0:
+            raise ValueError('The target interval must be positive')
+        self.target_interval = target_interval
+        self.window = window
+        self.max_step = max_step
+        self.min_bits = min_bits
+        self.max_bits = max_bits
+        # Recent block times, in seconds
+        self.block_times = []
+
+    def adjust(self, bits, block_time):
+        """
+        Records the time taken to mine a block and returns the difficulty
+        for the next one
+
+        Parameters:
+            self : the instance of the class
+            bits : the difficulty the block was mined at
+            block_time : the time taken to mine the block, in seconds
+
+        Returns:
+            The difficulty in bits for the next block
+        """
+        self.block_times = (self.block_times + [block_time])[-self.window:]
+        average = max(sum(self.block_times) / len(self.block_times), 1e-6)
+        step = round(math.log2(self.target_interval / average))
+        step = max(-self.max_step, min(self.max_step, step))
+        new_bits = max(self.min_bits, min(self.max_bits, bits + step))
+        if new_bits != bits:
+            # Times measured at the old difficulty no longer apply
+            self.block_times = []
+        return new_bits
+
+
+# Start method of mining worker processes. Mining pools are also created
+# from background threads, and a process forked while other threads run can
+# deadlock on a lock held by one of them, so workers are started from a
+# clean forkserver process, or spawned where there is none.
+MP_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods()
+    else 'spawn')
+
+# Event set by the parent process to stop the workers of a parallel search.
+# Each worker process receives it through init_worker.
+worker_stop_event = None
+
+
+def init_worker(stop_event):
+    """
+    Initializes a mining worker process of a parallel search
+
+    Parameters:
+        stop_event : the MP_CONTEXT event that stops the search
+
+    Returns:
+        N/A
+    """
+    global worker_stop_event
+    worker_stop_event = stop_event
+
+
+def search_nonces(backend_name, header_json, start, stop, target):
+    """
+    Searches a range of nonces for one whose hash meets the target. Run by
+    the worker processes of a parallel search, which stop early once the
+    stop event is set.
+
+    Parameters:
+        backend_name : the name of the pow_backend backend to search with
+        header_json : the JSON encoded block header without its nonce
+        start : the first nonce to try
+        stop : one past the last nonce to try
+        target : the integer proof of work target
+
+    Returns:
+        A (nonce, hash hex) tuple, or None if no nonce in the range meets
+        the target or the search was stopped
+    """
+    return pow_backend.get_backend(backend_name).search(
+        hashlib.sha256(header_json.encode()), start, stop, target,
+        worker_stop_event)
+
+
 class Miner(object):
     """
     Miner - A class used to represent a miner who performs crypto-currency
@@ -19,81 +199,234 @@ class Miner(object):
     # Set the maximum value for random numbers and nonces to a large value
     # to help ensure that mining will succeed
     MAX_VAL = 2**32-1
+    # Number of nonces in each task of a parallel search
+    CHUNK_SIZE = 2**14
 
-    def __init__(self, name):
+    def __init__(self, name, workers=1,
+                 backend=pow_backend.DEFAULT_BACKEND, bits=DEFAULT_BITS,
+                 merkle_roots=None):
         """
         Initializes an instance of the Miner class.
 
         Parameters:
             self : the instance of the class
             name : the name of the miner
+            workers : the number of processes searching the nonce space in
+                      parallel, 1 to mine in the calling process, or None
+                      for one process per CPU. The processes are started
+                      by the first search and kept until close() is
+                      called, or the with block using the miner ends.
+            backend : the name of the pow_backend backend running the
+                      search. All backends find the same hashes.
+            bits : the difficulty in bits, stored in the block header
+            merkle_roots : the Merkle roots of the sealed blocks the header
+                           commits to, stored in the block header
 
         Returns:
             N/A
         """
+        self.target = target_for_bits(bits)
+        self.backend = pow_backend.get_backend(backend)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.workers = workers
+
         logger.info('%s: Creating Miner %s...', __name__, name)
 
         # Define attribute to maintain miner's name
         self.name = name
-        # Define block header attribute for this miner
+        # Define block header attribute for this miner. The difficulty and
+        # the Merkle roots are part of the header, so they are covered by
+        # the hash.
         self.block_hdr = {'miner': self.name,
                           'previous_hash': '',
+                          'bits': bits,
+                          'merkle_roots': list(merkle_roots or []),
                           'rand': ''}
         # Define the resulting hash attribute
         self.hash_hex = None
 
-    def do_work(self, prev_hash):
+        # Worker processes of parallel searches, and the event that stops
+        # them, kept for every search of this miner
+        self.executor = None
+        self.workers_stop = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Shuts down the worker processes of parallel searches, if any
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            N/A
+        """
+        if self.executor is not None:
+            self.workers_stop.set()
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+            self.workers_stop = None
+
+    def do_work(self, prev_hash, stop_event=None):
         """
         Performs crypto-currency mining by the miner
 
         Parameters:
             self : the instance of the class
-            dest_ledger : the ledger object being mined and to which the new
-                          block will be added
+            prev_hash : the hash of the previous block header
+            stop_event : if set, an event that abandons the mining when it
+                         is set, such as when another miner has won
 
         Returns:
             hash_hex : the resulting hash when mining is successfully
-                       completed
+                       completed, or None if mining was stopped
         """
-        # Define SHA256 hash object
-        block_hash = hashlib.sha256()
-        # Define flag to indicate when proof of work is complete
-        proof_of_work_complete = False
+        if self.workers > 1:
+            return self.do_work_parallel(prev_hash, stop_event)
+
         # Set the previous hash in the block header
         self.block_hdr['previous_hash'] = prev_hash
+        # Remove the nonce of a previous run, which is not part of the hash
+        self.block_hdr.pop('nonce', None)
 
-        # Loop until the proof of work is complete
-        while not proof_of_work_complete:
-            # Before updating the original hash object with the block header,
-            # make a copy of the original for continued use with subsequent
-            # block headers containing different random numbers
-            block_hash_copy1 = block_hash.copy()
+        # Hash the part of the header before the random number once, so
+        # each new random number only hashes the rest of the header
+        prefix, prefix_hash = self.header_prefix()
 
+        # Loop until the proof of work is complete
+        result = None
+        while result is None:
             # Set a new random number in block header attribute
             self.block_hdr['rand'] = random.randint(0, Miner.MAX_VAL)
 
             # Compute initial hash using the header
-            block_hash_copy1.update(json.dumps(self.block_hdr).encode())
-
-            # Iterate through nonce values
-            for nonce in range(Miner.MAX_VAL):
-                # Convert the current nonce value to binary encoding
-                nonce_bin = struct.pack("<I", nonce)
+            if prefix is None:
+                block_hash = hashlib.sha256(
+                    json.dumps(self.block_hdr).encode())
+            else:
+                block_hash = prefix_hash.copy()
+                block_hash.update(
+                    (str(self.block_hdr['rand']) + '}').encode())
 
-                # Make a copy of the copied hash object for continued use
-                # with subsequent nonce values
-                block_hash_copy2 = block_hash_copy1.copy()
+            # Search the nonce values for a hash meeting the target
+            result = self.backend.search(block_hash, 0, Miner.MAX_VAL,
+                                         self.target, stop_event)
+            if (result is None and stop_event is not None
+                    and stop_event.is_set()):
+                logger.debug('%s: Mining stopped', self.name)
+                return None
 
-                # Update hash object with nonce
-                block_hash_copy2.update(nonce_bin)
-                # Compute cryptohash and store in the hash attribute
-                self.hash_hex = block_hash_copy2.hexdigest()
+        nonce, self.hash_hex = result
 
-                # If the leading 2 bytes of the resulting hash are zero,
-                # set flag to true and break out of inner loop
-                if self.hash_hex[:4] == '0000':
-                    proof_of_work_complete = True
-                    break
+        # Store the winning nonce in the block header so the hash can be
+        # verified later
+        self.block_hdr['nonce'] = nonce
 
         # Return the resulting hash
         return self.hash_hex
+
+    def header_prefix(self):
+        """
+        Splits the JSON encoded block header before the value of its random
+        number, which is its last entry
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            A (prefix, prefix hash) tuple holding the JSON text before the
+            random number and a SHA-256 object fed with it, or (None, None)
+            if the header does not end with the random number
+        """
+        hdr = dict(self.block_hdr, rand=0)
+        header_json = json.dumps(hdr)
+        if list(hdr)[-1] != 'rand' or not header_json.endswith(' 0}'):
+            return None, None
+        prefix = header_json[:-2]
+        return prefix, hashlib.sha256(prefix.encode())
+
+    def do_work_parallel(self, prev_hash, stop_event=None):
+        """
+        Performs crypto-currency mining with a pool of worker processes. The
+        nonce space of each random number is split into chunks that the
+        workers search at the same time, and all workers stop as soon as
+        one of them finds a valid hash, or as soon as the caller's stop
+        event is set.
+
+        Parameters:
+            self : the instance of the class
+            prev_hash : the hash of the previous block header
+            stop_event : if set, an event that abandons the mining when it
+                         is set, checked each time a chunk finishes
+
+        Returns:
+            hash_hex : the resulting hash when mining is successfully
+                       completed, or None if mining was stopped
+        """
+        self.block_hdr['previous_hash'] = prev_hash
+        self.block_hdr.pop('nonce', None)
+
+        # The workers have their own event, since the caller's event may not
+        # be shareable with the pool's processes. Starting the processes
+        # costs far more than a search at low difficulty, so they are
+        # started once and reused.
+        if self.executor is None:
+            self.workers_stop = MP_CONTEXT.Event()
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=MP_CONTEXT,
+                initializer=init_worker, initargs=(self.workers_stop,))
+        executor = self.executor
+        result = None
+        stopped = False
+        pending = set()
+        try:
+            while result is None and not stopped:
+                # Set a new random number and search its nonce space
+                self.block_hdr['rand'] = random.randint(0, Miner.MAX_VAL)
+                header_json = json.dumps(self.block_hdr)
+                starts = iter(range(0, Miner.MAX_VAL, Miner.CHUNK_SIZE))
+                pending = set()
+                # Keep two chunks per worker queued so no worker sits idle
+                while result is None:
+                    if stop_event is not None and stop_event.is_set():
+                        stopped = True
+                        break
+                    for start in starts:
+                        pending.add(executor.submit(
+                            search_nonces, self.backend.name, header_json,
+                            start,
+                            min(start + Miner.CHUNK_SIZE, Miner.MAX_VAL),
+                            self.target))
+                        if len(pending) >= 2 * self.workers:
+                            break
+                    if not pending:
+                        break
+                    done, pending = wait(pending,
+                                         return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if future.result() is not None and result is None:
+                            result = future.result()
+        finally:
+            # Stop the workers still searching and drop queued chunks, then
+            # wait for the running chunks so the next search starts with
+            # idle workers
+            self.workers_stop.set()
+            for future in pending:
+                future.cancel()
+            wait(pending)
+            self.workers_stop.clear()
+
+        if result is None:
+            logger.debug('%s: Mining stopped', self.name)
+            return None
+        nonce, self.hash_hex = result
+        self.block_hdr['nonce'] = nonce
+        logger.debug('%s: Found nonce %d with %d worker(s)', self.name,
+                     nonce, self.workers)
+        return self.hash_hex
@@ -0,0 +1,248 @@
+import argparse
+import json
+import time
+import struct
+import hashlib
+import random
+import logging
+import logging.config
+
+logging.config.fileConfig('logging.conf')
+logger = logging.getLogger('pow_backend')
+
+# Number of nonces tried between checks of the stop event
+CHECK_EVERY = 4096
+
+
+def target_bytes(target):
+    """
+    Encodes an integer proof of work target as 32 big-endian bytes. A raw
+    SHA-256 digest compared with these bytes orders exactly as the digest's
+    integer value compared with the target.
+
+    Parameters:
+        target : the target; a hash meets it if its value is below it
+
+    Returns:
+        The encoded target as bytes
+    """
+    return min(target, 2 ** 256 - 1).to_bytes(32, 'big')
+
+
+class MiningBackend(object):
+    """
+    MiningBackend - the interface of the proof of work search kernels. A
+                    backend tries the nonces of a range in order, each
+                    appended as 4 little-endian bytes to the header hash,
+                    and returns the first one whose hash is below the
+                    target. All backends return identical results.
+
+    """
+    # Name used to select the backend, for example in worker processes
+    name = None
+
+    def search(self, prefix_hash, start, stop, target, stop_event=None):
+        """
+        Searches a range of nonces for the first one meeting the target
+
+        Parameters:
+            self : the instance of the class
+            prefix_hash : a hashlib SHA-256 object already fed with the JSON
+                          encoded block header. It is not modified.
+            start : the first nonce to try
+            stop : one past the last nonce to try
+            target : the integer target
+            stop_event : if set, an event checked every CHECK_EVERY nonces
+                         that ends the search early
+
+        Returns:
+            A (nonce, hash hex) tuple, or None if no nonce in the range meets
+            the target or the search was stopped
+        """
+        raise NotImplementedError
+
+
+class ReferenceBackend(MiningBackend):
+    """
+    ReferenceBackend - the original pure-Python loop: packs each nonce,
+                       converts the digest to hex and compares the hash's
+                       value with the target
+
+    """
+    name = 'reference'
+
+    def search(self, prefix_hash, start, stop, target, stop_event=None):
+        for nonce in range(start, stop):
+            if (stop_event is not None and (nonce - start) % CHECK_EVERY == 0
+                    and stop_event.is_set()):
+                return None
+            block_hash = prefix_hash.copy()
+            block_hash.update(struct.pack("<I", nonce))
+            hash_hex = block_hash.hexdigest()
+            if int(hash_hex, 16) < target:
+                return nonce, hash_hex
+        return None
+
+
+class OptimizedBackend(MiningBackend):
+    """
+    OptimizedBackend - compares the raw digest bytes with the encoded target
+                       and only converts the winning digest to hex. The
+                       methods used in the loop are bound once.
+
+    """
+    name = 'optimized'
+
+    def search(self, prefix_hash, start, stop, target, stop_event=None):
+        limit = target_bytes(target)
+        pack = struct.Struct("<I").pack
+        copy = prefix_hash.copy
+        position = start
+        while position < stop:
+            if stop_event is not None and stop_event.is_set():
+                return None
+            # Search up to the next stop event check
+            for nonce in range(position, min(position + CHECK_EVERY, stop)):
+                block_hash = copy()
+                block_hash.update(pack(nonce))
+                digest = block_hash.digest()
+                if digest < limit:
+                    return nonce, digest.hex()
+            position += CHECK_EVERY
+        return None
+
+
+class BatchedBackend(MiningBackend):
+    """
+    BatchedBackend - packs a whole batch of nonces ahead of hashing them,
+                     then hashes the packed nonces in a tight loop, comparing
+                     raw digest bytes with the encoded target
+
+    """
+    name = 'batched'
+    # Number of nonces packed at once, also the stop event check interval
+    BATCH_SIZE = CHECK_EVERY
+
+    def search(self, prefix_hash, start, stop, target, stop_event=None):
+        limit = target_bytes(target)
+        pack = struct.Struct("<I").pack
+        copy = prefix_hash.copy
+        position = start
+        while position < stop:
+            if stop_event is not None and stop_event.is_set():
+                return None
+            count = min(BatchedBackend.BATCH_SIZE, stop - position)
+            packed = list(map(pack, range(position, position + count)))
+            for nonce_bin in packed:
+                block_hash = copy()
+                block_hash.update(nonce_bin)
+                digest = block_hash.digest()
+                if digest < limit:
+                    return struct.unpack("<I", nonce_bin)[0], digest.hex()
+            position += count
+        return None
+
+
+# Available backends, by name
+BACKENDS = {backend.name: backend for backend in (
+    ReferenceBackend(), OptimizedBackend(), BatchedBackend())}
+
+# Backend used by miners unless another one is selected
+DEFAULT_BACKEND = 'optimized'
+
+
+def get_backend(name):
+    """
+    Looks up a backend by name
+
+    Parameters:
+        name : the name of the backend, one of BACKENDS
+
+    Returns:
+        The MiningBackend object
+    """
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise ValueError('Unknown mining backend: ' + str(name))
+
+
+def self_test(seed=0, target=2 ** 240, headers=4):
+    """
+    Mines the same headers with every backend and checks that they all find
+    the same nonces and hashes
+
+    Parameters:
+        seed : the seed of the random numbers placed in the headers
+        target : the integer target
+        headers : the number of headers to mine
+
+    Returns:
+        A dictionary mapping each backend name to its list of (nonce, hash
+        hex) results. Raises AssertionError if any backend disagrees with
+        the reference backend.
+    """
+    rng = random.Random(seed)
+    results = {name: [] for name in BACKENDS}
+    for n in range(headers):
+        header = {'miner': 'self_test', 'previous_hash': str(n),
+                  'rand': rng.randint(0, 2 ** 32 - 1)}
+        prefix_hash = hashlib.sha256(json.dumps(header).encode())
+        for name, backend in BACKENDS.items():
+            results[name].append(
+                backend.search(prefix_hash, 0, 2 ** 32 - 1, target))
+    for name, found in results.items():
+        assert found == results[ReferenceBackend.name], (
+            'Backend %s disagrees with the reference backend' % name)
+    return results
+
+
+def measure_hash_rate(backend, nonces=200000):
+    """
+    Measures the hashes per second of a backend with an unreachable target
+
+    Parameters:
+        backend : the MiningBackend object
+        nonces : the number of nonces to try
+
+    Returns:
+        The number of hashes per second
+    """
+    prefix_hash = hashlib.sha256(b'{"miner": "benchmark"}')
+    start = time.perf_counter()
+    backend.search(prefix_hash, 0, nonces, 0)
+    return nonces / (time.perf_counter() - start)
+
+
+def main():
+    """
+    Runs the self-test and prints the hash rate of every backend
+
+    Parameters:
+        N/A
+
+    Returns:
+        N/A
+    """
+    parser = argparse.ArgumentParser(
+        description='Check that all proof of work backends agree and '
+                    'compare their hash rates')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the self-test headers')
+    parser.add_argument('--nonces', type=int, default=200000,
+                        help='number of nonces hashed per backend')
+    args = parser.parse_args()
+
+    results = self_test(args.seed)
+    logger.info('Self-test passed: all backends found %s',
+                [nonce for nonce, hash_hex in results[DEFAULT_BACKEND]])
+
+    print('{:<10} {:>14}'.format('backend', 'hashes/s'))
+    for name, backend in BACKENDS.items():
+        print('{:<10} {:>14,.0f}'.format(name,
+                                         measure_hash_rate(backend,
+                                                           args.nonces)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,497 @@
+import json
+import zlib
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import logging
+import logging.config
+import storage
+import ledger
+import miner
+from ledger_stats import LedgerStats
+from user_index import TOP_TRANSACTIONS
+
+# Define logger
+logging.config.fileConfig('logging.conf')
+logger = logging.getLogger('sharded_ledger')
+
+
+def shard_for(sender, shard_count):
+    """
+    Picks the shard a transaction is written to from its sender, so all
+    transactions of a sender share one chain
+
+    Parameters:
+        sender : the name of the sender
+        shard_count : the number of shards
+
+    Returns:
+        The shard number
+    """
+    return zlib.crc32(sender.encode('utf-8')) % shard_count
+
+
+class ShardedLedger(object):
+    """
+    ShardedLedger - a ledger partitioned into several independent chains
+                    (shards) by sender. Each shard is a Ledger with its own
+                    tail block and its own reserved range of tids, so the
+                    shards can be appended to at the same time, by threads
+                    of one process or by separate processes that each open
+                    one shard with Ledger.open. Each shard has its own
+                    chain of block headers. Aggregates merge the shards
+                    and match those of a single chain holding the same
+                    transactions.
+
+    """
+    # Name of the object describing the shards
+    SHARDS_FILE = 'shards.json'
+    # Number of tids reserved for each shard
+    TID_RANGE = 2 ** 40
+
+    def __init__(self, filedir, shards=4, storage_backend=None, **kwargs):
+        """
+        Initializes a new sharded ledger in a unique directory
+
+        Parameters:
+            self : the instance of the class
+            filedir : the path to the directory where the shards will be
+                      stored, each in its own sub-directory
+            shards : the number of shards
+            storage_backend : the storage.Storage object holding the shards
+            kwargs : other Ledger constructor arguments used by every shard
+
+        Returns:
+            N/A
+        """
+        if shards < 1:
+            raise ValueError('A sharded ledger needs at least one shard')
+        if storage_backend is None:
+            storage_backend = storage.S3Storage()
+        self.storage = storage_backend
+
+        self.now = datetime.now()
+        self.dt_str = self.now.strftime("%Y%m%d_%H%M%S")
+        self.filedir = filedir + '_' + self.dt_str
+
+        self.shards = []
+        for shard in range(shards):
+            shard_ledger = ledger.Ledger(
+                self.shard_dir(shard), storage_backend,
+                tid_base=shard * ShardedLedger.TID_RANGE, **kwargs)
+            shard_ledger.set_filedir(self.shard_dir(shard))
+            self.shards.append(shard_ledger)
+        self.storage.put(self.filedir + '/' + ShardedLedger.SHARDS_FILE,
+                         json.dumps(self.describe()).encode('utf-8'))
+
+    @classmethod
+    def open(cls, filedir, storage_backend=None, **kwargs):
+        """
+        Reopens an existing sharded ledger, reopening each shard with
+        Ledger.open
+
+        Parameters:
+            cls : the ShardedLedger class
+            filedir : the directory of the existing sharded ledger, including
+                      its timestamp suffix
+            storage_backend : the storage.Storage object holding the shards
+            kwargs : other Ledger.open arguments used by every shard
+
+        Returns:
+            The reopened ShardedLedger object
+        """
+        if storage_backend is None:
+            storage_backend = storage.S3Storage()
+        description = json.loads(storage_backend.get(
+            filedir + '/' + cls.SHARDS_FILE).decode('utf-8'))
+
+        sharded = cls.__new__(cls)
+        sharded.storage = storage_backend
+        sharded.now = datetime.now()
+        sharded.dt_str = sharded.now.strftime("%Y%m%d_%H%M%S")
+        sharded.filedir = filedir
+        sharded.shards = [
+            ledger.Ledger.open(sharded.shard_dir(shard), storage_backend,
+                               tid_base=tid_base, **kwargs)
+            for shard, tid_base in enumerate(description['tid_bases'])]
+        logger.info('Reopened %s with %d shard(s)', filedir,
+                    len(sharded.shards))
+        return sharded
+
+    def describe(self):
+        """
+        Returns the description of the shards stored with the ledger
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            A dictionary with the number of shards and their first tids
+        """
+        return {'shards': len(self.shards),
+                'tid_bases': [s.tid_base for s in self.shards]}
+
+    def shard_dir(self, shard):
+        """
+        Returns the directory of a shard
+
+        Parameters:
+            self : the instance of the class
+            shard : the shard number
+
+        Returns:
+            The directory holding the shard's blocks
+        """
+        return self.filedir + '/shard_' + str(shard)
+
+    def shard_of_tid(self, tid):
+        """
+        Finds the shard that assigned a tid from its reserved range
+
+        Parameters:
+            self : the instance of the class
+            tid : the transaction id
+
+        Returns:
+            The shard's Ledger object, or None if no shard owns the tid
+        """
+        shard = tid // ShardedLedger.TID_RANGE
+        if 0 <= shard < len(self.shards):
+            return self.shards[shard]
+        return None
+
+    def check_range(self, shard_ledger):
+        """
+        Makes sure a shard has tids left in its reserved range
+
+        Parameters:
+            self : the instance of the class
+            shard_ledger : the shard's Ledger object
+
+        Returns:
+            N/A
+        """
+        if (shard_ledger.current_tid
+                >= shard_ledger.tid_base + ShardedLedger.TID_RANGE):
+            raise OverflowError('Shard ' + shard_ledger.filedir
+                                + ' has used up its tid range')
+
+    def add_new_block_callback(self, callback):
+        """
+        Registers a function called every time any shard starts a new
+        block, as Ledger.add_new_block_callback. The callback receives the
+        shard's Ledger object, so each shard gets its own chain of block
+        headers, for example mined by trangen.TranGEN.
+
+        Parameters:
+            self : the instance of the class
+            callback : the function, called with the shard's Ledger object
+                       as its argument
+
+        Returns:
+            N/A
+        """
+        for shard_ledger in self.shards:
+            shard_ledger.add_new_block_callback(callback)
+
+    def remove_new_block_callback(self, callback):
+        """
+        Unregisters a function registered with add_new_block_callback
+
+        Parameters:
+            self : the instance of the class
+            callback : the function to unregister
+
+        Returns:
+            N/A
+        """
+        for shard_ledger in self.shards:
+            shard_ledger.remove_new_block_callback(callback)
+
+    def add_transaction(self, sender, recipient, amount):
+        """
+        Adds a transaction to the shard of its sender
+
+        Parameters:
+            self : the instance of the class
+            sender : the sender of the transaction
+            recipient : the receiver of the transaction
+            amount : the amount of the transaction
+
+        Returns:
+            The tid assigned to the transaction
+        """
+        shard_ledger = self.shards[shard_for(sender, len(self.shards))]
+        self.check_range(shard_ledger)
+        return shard_ledger.add_transaction(sender, recipient, amount)
+
+    def cancel_transaction(self, tid):
+        """
+        Cancels a transaction in the shard that holds it
+
+        Parameters:
+            self : the instance of the class
+            tid : the transaction id to be cancelled
+
+        Returns:
+            The tid of the cancellation record, or -1 if the transaction does
+            not exist
+        """
+        shard_ledger = self.shard_of_tid(tid)
+        if shard_ledger is None:
+            return -1
+        self.check_range(shard_ledger)
+        return shard_ledger.cancel_transaction(tid)
+
+    def add_transactions(self, records):
+        """
+        Adds a batch of transactions and cancellations. The batch is split
+        by shard, and the shards ingest their parts in parallel threads.
+
+        Parameters:
+            self : the instance of the class
+            records : an iterable of (sender, recipient, amount) tuples and
+                      {'cancelled_tid': tid} dictionaries, as for
+                      Ledger.add_transactions
+
+        Returns:
+            tids : the list of assigned tids in the order of the records, -1
+                   for a cancellation of a tid that does not exist
+        """
+        records = list(records)
+        tids = [-1] * len(records)
+        # Positions and records of the batch going to each shard
+        parts = [([], []) for s in self.shards]
+        for position, record in enumerate(records):
+            if isinstance(record, dict):
+                shard = record['cancelled_tid'] // ShardedLedger.TID_RANGE
+                if not 0 <= shard < len(self.shards):
+                    continue
+            else:
+                shard = shard_for(record[0], len(self.shards))
+            parts[shard][0].append(position)
+            parts[shard][1].append(record)
+
+        def ingest(shard):
+            positions, shard_records = parts[shard]
+            if not shard_records:
+                return
+            shard_ledger = self.shards[shard]
+            if (shard_ledger.current_tid + len(shard_records)
+                    > shard_ledger.tid_base + ShardedLedger.TID_RANGE):
+                raise OverflowError('Shard ' + shard_ledger.filedir
+                                    + ' has used up its tid range')
+            for position, tid in zip(
+                    positions, shard_ledger.add_transactions(shard_records)):
+                tids[position] = tid
+
+        with ThreadPoolExecutor(max_workers=len(self.shards)) as executor:
+            # Consume the results so errors in any shard are raised
+            list(executor.map(ingest, range(len(self.shards))))
+        logger.debug('Added batch of %d record(s) to %d shard(s)',
+                     len(records), len(self.shards))
+        return tids
+
+    def flush(self):
+        """
+        Writes the buffered open block of every shard
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            N/A
+        """
+        for shard_ledger in self.shards:
+            shard_ledger.flush()
+
+    def checkpoint(self):
+        """
+        Writes the buffered open block and the indexes of every shard
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            N/A
+        """
+        for shard_ledger in self.shards:
+            shard_ledger.checkpoint()
+
+    def transaction_exists(self, tid):
+        shard_ledger = self.shard_of_tid(tid)
+        return (shard_ledger is not None
+                and shard_ledger.transaction_exists(tid))
+
+    def is_cancelled(self, tid):
+        shard_ledger = self.shard_of_tid(tid)
+        return shard_ledger is not None and shard_ledger.is_cancelled(tid)
+
+    def get_transaction(self, tid):
+        """
+        Returns the transaction with the specified tid from the shard that
+        holds it
+
+        Parameters:
+            self : the instance of the class
+            tid : the transaction id
+
+        Returns:
+            The transaction dictionary, or None if it does not exist
+        """
+        shard_ledger = self.shard_of_tid(tid)
+        if shard_ledger is None:
+            return None
+        return shard_ledger.get_transaction(tid)
+
+    def map_shards(self, func):
+        """
+        Runs a function on every shard in parallel threads
+
+        Parameters:
+            self : the instance of the class
+            func : the function, called with a shard's Ledger object
+
+        Returns:
+            The list of results in shard order
+        """
+        with ThreadPoolExecutor(max_workers=len(self.shards)) as executor:
+            return list(executor.map(func, self.shards))
+
+    def verify(self, workers=None, min_bits=miner.DEFAULT_BITS):
+        """
+        Verifies the chain of every shard with Ledger.verify
+
+        Parameters:
+            self : the instance of the class
+            workers : the number of worker processes used for each shard, or
+                      None for one per CPU core
+            min_bits : the lowest difficulty in bits accepted for a block
+                       header
+
+        Returns:
+            A dictionary with 'valid' (True if no shard has problems),
+            'blocks' (the number of blocks checked in all shards) and
+            'errors' (a list of problem descriptions naming the shard)
+        """
+        result = {'valid': True, 'blocks': 0, 'errors': []}
+        for shard, shard_ledger in enumerate(self.shards):
+            shard_result = shard_ledger.verify(workers, min_bits)
+            result['valid'] = result['valid'] and shard_result['valid']
+            result['blocks'] += shard_result['blocks']
+            result['errors'].extend('Shard %d: %s' % (shard, error)
+                                    for error in shard_result['errors'])
+        return result
+
+    def statistics(self):
+        """
+        Merges the statistics of all shards
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            stats : the merged LedgerStats object
+        """
+        stats = LedgerStats()
+        for shard_ledger in self.shards:
+            stats.merge(shard_ledger.statistics())
+        return stats
+
+    def scan(self):
+        """
+        Scans all shards in parallel and merges their statistics
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            stats : the merged LedgerStats object
+        """
+        stats = LedgerStats()
+        for shard_stats in self.map_shards(lambda s: s.scan()):
+            stats.merge(shard_stats)
+        return stats
+
+    def transaction_count(self):
+        return self.statistics().transaction_count
+
+    def cancelled_transaction_count(self):
+        return self.statistics().cancelled_count
+
+    def net_value(self):
+        return self.statistics().amount_total
+
+    def average_value(self):
+        return self.statistics().average_value()
+
+    def get_transaction_count_by_user(self):
+        return dict(self.statistics().user_counts)
+
+    def get_debits(self):
+        return dict(self.statistics().debits)
+
+    def get_credits(self):
+        return dict(self.statistics().credits)
+
+    def history(self, user, include_cancelled=False):
+        """
+        Returns the transactions a user sent or received in any shard
+
+        Parameters:
+            self : the instance of the class
+            user : the name of the user
+            include_cancelled : True to also return transactions that have
+                                been cancelled
+
+        Returns:
+            A list of transaction dictionaries, grouped by shard and in tid
+            order within each shard
+        """
+        transactions = []
+        for shard_history in self.map_shards(
+                lambda s: s.history(user, include_cancelled)):
+            transactions.extend(shard_history)
+        return transactions
+
+    def balance(self, user):
+        return sum(s.balance(user) for s in self.shards)
+
+    def top_users(self, n=10, by=TOP_TRANSACTIONS):
+        """
+        Returns the n users with the most transactions, the highest balance
+        or the highest volume across all shards
+
+        Parameters:
+            self : the instance of the class
+            n : the number of users to return
+            by : user_index.TOP_TRANSACTIONS, TOP_BALANCE or TOP_VOLUME
+
+        Returns:
+            A list of (user, value) tuples, highest value first
+        """
+        values = {}
+        for shard_ledger in self.shards:
+            # Every user's value is needed, since a user's total may be
+            # spread over several shards
+            index = shard_ledger.user_index
+            for user, value in index.top_users(len(index.postings), by):
+                values[user] = values.get(user, 0) + value
+        return heapq.nlargest(n, values.items(), key=lambda item: item[1])
+
+    def generate_report(self):
+        """
+        Generates a report of the merged transaction data of all shards
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            N/A
+        """
+        report = ledger.format_report(self.statistics(), self.filedir,
+                                      self.now)
+        # The shards share the metrics object passed to the constructor
+        report += self.shards[0].metrics.format_report()
+        self.storage.put('report_' + self.dt_str + '.txt',
+                         report.encode('utf-8'))
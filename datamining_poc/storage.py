@@ -0,0 +1,290 @@
+import os
+import json
+import hashlib
+import logging
+import logging.config
+
+# Define logger
+logging.config.fileConfig('logging.conf')
+logger = logging.getLogger('storage')
+
+# Default S3 bucket holding the blockchain files
+DEFAULT_BUCKET = "cory-walker-blockchain"
+
+
+class Storage(object):
+    """
+    Storage - the interface used by the ledger to read, write and list
+              block objects. Keys are '/' separated paths such as
+              '<filedir>/block_0.json'.
+
+    """
+    def get(self, key):
+        """
+        Reads the object stored under the specified key
+
+        Parameters:
+            self : the instance of the class
+            key : the key of the object
+
+        Returns:
+            The object contents as bytes. Raises FileNotFoundError if no
+            object exists under the key.
+        """
+        raise NotImplementedError
+
+    def get_if_changed(self, key, etag=None):
+        """
+        Reads the object stored under the specified key, together with its
+        metadata, unless its ETag still matches the one supplied by the
+        caller
+
+        Parameters:
+            self : the instance of the class
+            key : the key of the object
+            etag : the ETag of the copy held by the caller, or None
+
+        Returns:
+            A (data, etag, metadata) tuple. data and metadata are None if the
+            object is unchanged. Raises FileNotFoundError if no object exists
+            under the key.
+        """
+        data = self.get(key)
+        new_etag = hashlib.md5(data).hexdigest()
+        if new_etag == etag:
+            return None, etag, None
+        return data, new_etag, None
+
+    def put(self, key, data, metadata=None):
+        """
+        Writes an object under the specified key, replacing any existing
+        object
+
+        Parameters:
+            self : the instance of the class
+            key : the key of the object
+            data : the object contents as bytes
+            metadata : an optional dictionary of string metadata stored with
+                       the object
+
+        Returns:
+            N/A
+        """
+        raise NotImplementedError
+
+    def list_keys(self, prefix):
+        """
+        Generator method that yields the keys of all objects whose key starts
+        with the specified prefix, in lexicographic order
+
+        Parameters:
+            self : the instance of the class
+            prefix : the key prefix to match
+
+        Returns:
+            The next matching key
+        """
+        raise NotImplementedError
+
+
+class S3Storage(Storage):
+    """
+    S3Storage - stores objects in an Amazon S3 bucket
+
+    """
+    def __init__(self, bucket_name=DEFAULT_BUCKET, client=None):
+        """
+        Initializes an instance of the S3Storage class. boto3 is only
+        imported when no client is supplied, so the other backends do not
+        depend on it.
+
+        Parameters:
+            self : the instance of the class
+            bucket_name : the name of the S3 bucket
+            client : an existing boto3 S3 client, or None to create one
+
+        Returns:
+            N/A
+        """
+        if client is None:
+            import boto3
+            client = boto3.client('s3')
+        self.client = client
+        self.bucket = bucket_name
+
+    def get(self, key):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=key)
+        except self.client.exceptions.NoSuchKey:
+            raise FileNotFoundError(key)
+        return response['Body'].read()
+
+    def get_if_changed(self, key, etag=None):
+        # Let S3 compare the ETag so an unchanged object is not transferred
+        kwargs = {'Bucket': self.bucket, 'Key': key}
+        if etag is not None:
+            kwargs['IfNoneMatch'] = etag
+        try:
+            response = self.client.get_object(**kwargs)
+        except self.client.exceptions.NoSuchKey:
+            raise FileNotFoundError(key)
+        except self.client.exceptions.ClientError as e:
+            if e.response.get('Error', {}).get('Code') == '304':
+                return None, etag, None
+            raise
+        return (response['Body'].read(), response['ETag'],
+                response.get('Metadata', {}))
+
+    def put(self, key, data, metadata=None):
+        self.client.put_object(Bucket=self.bucket, Body=data, Key=key,
+                               Metadata=metadata or {})
+
+    def list_keys(self, prefix):
+        # A single list call returns at most 1,000 keys, so follow the
+        # continuation tokens through every page
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for f in page.get('Contents', []):
+                yield f['Key']
+
+
+class LocalStorage(Storage):
+    """
+    LocalStorage - stores objects as files below a local root directory.
+                   Object metadata is kept in a '.meta' file next to the
+                   object.
+
+    """
+    def __init__(self, root):
+        """
+        Initializes an instance of the LocalStorage class
+
+        Parameters:
+            self : the instance of the class
+            root : the directory below which the objects are stored
+
+        Returns:
+            N/A
+        """
+        self.root = root
+
+    def path(self, key):
+        """
+        Maps a key to its path on the local filesystem
+
+        Parameters:
+            self : the instance of the class
+            key : the key of the object
+
+        Returns:
+            The path of the file holding the object
+        """
+        return os.path.join(self.root, *key.strip('/').split('/'))
+
+    def get(self, key):
+        with open(self.path(key), 'rb') as infile:
+            return infile.read()
+
+    def get_if_changed(self, key, etag=None):
+        # Use the file's modification time and size as its ETag so an
+        # unchanged file does not have to be read
+        filename = self.path(key)
+        stat = os.stat(filename)
+        new_etag = str(stat.st_mtime_ns) + '-' + str(stat.st_size)
+        if new_etag == etag:
+            return None, etag, None
+        with open(filename, 'rb') as infile:
+            data = infile.read()
+        metadata = {}
+        if os.path.exists(filename + '.meta'):
+            with open(filename + '.meta', encoding='utf-8') as infile:
+                metadata = json.load(infile)
+        return data, new_etag, metadata
+
+    def put(self, key, data, metadata=None):
+        filename = self.path(key)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        # The metadata is written before the object it describes
+        if metadata:
+            self.write_file(filename + '.meta',
+                            json.dumps(metadata).encode('utf-8'))
+        elif os.path.exists(filename + '.meta'):
+            os.remove(filename + '.meta')
+        self.write_file(filename, data)
+
+    def write_file(self, filename, data):
+        """
+        Writes a file through a temporary file, so readers never see a
+        partial file
+
+        Parameters:
+            self : the instance of the class
+            filename : the path of the file
+            data : the file contents as bytes
+
+        Returns:
+            N/A
+        """
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'wb') as outfile:
+            outfile.write(data)
+        os.replace(tmp_filename, filename)
+
+    def list_keys(self, prefix):
+        # Keys keep the leading '/' of the prefix, if it had one
+        lead = '/' if prefix.startswith('/') else ''
+        search_dir = os.path.dirname(self.path(prefix + 'x'))
+        keys = []
+        for dirpath, dirnames, filenames in os.walk(search_dir):
+            for f in filenames:
+                if f.endswith('.tmp') or f.endswith('.meta'):
+                    continue
+                rel = os.path.relpath(os.path.join(dirpath, f), self.root)
+                key = lead + rel.replace(os.sep, '/')
+                if key.startswith(prefix):
+                    keys.append(key)
+        for key in sorted(keys):
+            yield key
+
+
+class MemoryStorage(Storage):
+    """
+    MemoryStorage - keeps objects in a dictionary. Intended for tests and
+                    benchmarks that must not touch the network or disk.
+
+    """
+    def __init__(self):
+        """
+        Initializes an instance of the MemoryStorage class
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            N/A
+        """
+        self.objects = {}
+        self.etags = {}
+        self.metadata = {}
+
+    def get(self, key):
+        try:
+            return self.objects[key]
+        except KeyError:
+            raise FileNotFoundError(key)
+
+    def get_if_changed(self, key, etag=None):
+        data = self.get(key)
+        if self.etags[key] == etag:
+            return None, etag, None
+        return data, self.etags[key], dict(self.metadata[key])
+
+    def put(self, key, data, metadata=None):
+        self.objects[key] = bytes(data)
+        self.etags[key] = hashlib.md5(self.objects[key]).hexdigest()
+        self.metadata[key] = dict(metadata or {})
+
+    def list_keys(self, prefix):
+        for key in sorted(self.objects):
+            if key.startswith(prefix):
+                yield key
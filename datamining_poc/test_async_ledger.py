@@ -0,0 +1,84 @@
+import unittest
+import asyncio
+import random
+import storage
+import ledger
+from async_ledger import AsyncLedger
+from block_policy import BlockPolicy
+
+
+class TestAsyncLedger(unittest.TestCase):
+    """
+    TestAsyncLedger - unit tests for AsyncLedger class
+
+    """
+    USERS = ['Alice', 'Bob', 'Jon', 'Howard', 'Rocky']
+
+    async def add_records(self, async_ledger, count, seed=0):
+        # Add transactions and cancellations through the async client
+        rng = random.Random(seed)
+        for i in range(count):
+            if i % 7 == 3:
+                await async_ledger.cancel_transaction(
+                    rng.randint(0, async_ledger.ledger.current_tid + 5))
+            else:
+                await async_ledger.add_transaction(
+                    rng.choice(TestAsyncLedger.USERS),
+                    rng.choice(TestAsyncLedger.USERS), rng.randint(1, 100))
+
+    async def check_matches_sync(self, stats_engine):
+        sync_ledger = ledger.Ledger('t',
+                                    storage_backend=storage.MemoryStorage(),
+                                    stats_engine=stats_engine,
+                                    block_policy=BlockPolicy(64))
+        async_ledger = AsyncLedger(sync_ledger, concurrency=4)
+        await self.add_records(async_ledger, 900)
+
+        # Aggregates and scans return exactly what the Ledger returns
+        self.assertEqual((await async_ledger.scan()).to_dict(),
+                         sync_ledger.scan().to_dict())
+        self.assertEqual((await async_ledger.statistics()).to_dict(),
+                         sync_ledger.statistics().to_dict())
+        self.assertEqual(await async_ledger.transaction_count(),
+                         sync_ledger.transaction_count())
+        self.assertEqual(await async_ledger.cancelled_transaction_count(),
+                         sync_ledger.cancelled_transaction_count())
+        self.assertEqual(await async_ledger.net_value(),
+                         sync_ledger.net_value())
+        self.assertEqual(await async_ledger.average_value(),
+                         sync_ledger.average_value())
+        self.assertEqual(await async_ledger.get_transaction_count_by_user(),
+                         sync_ledger.get_transaction_count_by_user())
+        self.assertEqual(await async_ledger.get_debits(),
+                         sync_ledger.get_debits())
+        self.assertEqual(await async_ledger.get_credits(),
+                         sync_ledger.get_credits())
+        self.assertEqual(await async_ledger.top_users(3),
+                         sync_ledger.top_users(3))
+
+        # Lookups return exactly what the Ledger returns
+        for user in TestAsyncLedger.USERS:
+            self.assertEqual(await async_ledger.history(user, True),
+                             sync_ledger.history(user, True))
+            self.assertEqual(await async_ledger.balance(user),
+                             sync_ledger.balance(user))
+        for tid in range(0, sync_ledger.current_tid, 11):
+            self.assertEqual(await async_ledger.get_transaction(tid),
+                             sync_ledger.get_transaction(tid))
+            self.assertEqual(await async_ledger.is_cancelled(tid),
+                             sync_ledger.is_cancelled(tid))
+        self.assertEqual(await async_ledger.transactions_in_range(100, 700),
+                         sync_ledger.transactions_in_range(100, 700))
+
+        # Blocks stream in chain order, including the open block
+        self.assertEqual([f async for f, d in async_ledger.iter_blocks()],
+                         [f for f, d in sync_ledger.iter_blocks()])
+
+    def test_matches_sync(self):
+        print(' TestAsyncLedger.test_matches_sync')
+        for stats_engine in (ledger.STATS_INCREMENTAL, ledger.STATS_COLUMNAR):
+            asyncio.run(self.check_matches_sync(stats_engine))
+
+
+if __name__ == '__main__':
+    unittest.main()
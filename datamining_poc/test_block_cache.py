@@ -0,0 +1,67 @@
+import unittest
+import storage
+import ledger
+from block_cache import BlockCache
+from block_policy import BlockPolicy
+
+
+class TestBlockCache(unittest.TestCase):
+    """
+    TestBlockCache - unit tests for BlockCache class
+
+    """
+    def test_lru_eviction(self):
+        print(' TestBlockCache.test_lru_eviction')
+        cache = BlockCache(max_blocks=2)
+        cache.store('a', {'next_block': 'b'}, 'etag-a')
+        cache.store('b', {}, 'etag-b')
+        # Looking up a marks it as recently used, so b is evicted
+        self.assertEqual(cache.lookup('a'), ({'next_block': 'b'}, 'etag-a',
+                                             True))
+        cache.store('c', {}, 'etag-c')
+        self.assertIsNone(cache.lookup('b'))
+        self.assertEqual(cache.lookup('c'), ({}, 'etag-c', False))
+        self.assertEqual(cache.info()['evictions'], 1)
+
+        # A disabled cache keeps nothing
+        disabled = BlockCache(max_blocks=0)
+        disabled.store('a', {}, 'etag-a')
+        self.assertIsNone(disabled.lookup('a'))
+
+    def test_etag_validation(self):
+        print(' TestBlockCache.test_etag_validation')
+        test_storage = storage.MemoryStorage()
+        test_ledger = ledger.Ledger('t', storage_backend=test_storage,
+                                    block_policy=BlockPolicy(10))
+        for i in range(13):
+            test_ledger.add_transaction('Alice', 'Bob', i)
+        test_ledger.flush()
+        sealed = test_ledger.block_filename(0)
+        open_block = test_ledger.block_filename(1)
+
+        # A sealed block is served from the cache without validation
+        test_ledger.from_file(sealed)
+        test_ledger.from_file(sealed)
+        self.assertEqual(test_ledger.cache_info()['hits'], 1)
+        self.assertEqual(test_ledger.cache_info()['validations'], 0)
+
+        # The open block is validated against its ETag before reuse
+        test_ledger.from_file(open_block)
+        self.assertEqual(len(test_ledger.from_file(open_block)
+                             ['transactions']), 3)
+        info = test_ledger.cache_info()
+        self.assertEqual((info['hits'], info['validations']), (2, 1))
+
+        # A block rewritten by another writer is read again
+        writer = ledger.Ledger.open(test_ledger.filedir,
+                                    storage_backend=test_storage)
+        writer.add_transaction('Bob', 'Jon', 99)
+        writer.flush()
+        self.assertEqual(len(test_ledger.from_file(open_block)
+                             ['transactions']), 4)
+        info = test_ledger.cache_info()
+        self.assertEqual((info['misses'], info['validations']), (3, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
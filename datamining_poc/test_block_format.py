@@ -0,0 +1,110 @@
+import unittest
+import storage
+import ledger
+import block_codec
+import migrate_ledger
+from block_format import (encode_block, decode_block, FORMAT_JSON,
+                          FORMAT_COLUMNAR, MAGIC)
+from block_policy import BlockPolicy
+
+
+class TestBlockFormat(unittest.TestCase):
+    """
+    TestBlockFormat - unit tests for the JSON and columnar block formats
+
+    """
+    BLOCK = {'hdr': {'miner': 'Alice', 'nonce': 7},
+             'transactions': [
+                 {'tid': 0, 'sender': 'Alice', 'receiver': 'Bob',
+                  'amount': 10},
+                 {'tid': 1, 'sender': 'Bob', 'receiver': 'Jon',
+                  'amount': 2 ** 40},
+                 {'tid': 2, 'cancelled_tid': 0}],
+             'next_block': 'block_1.json',
+             'footer': {'first_tid': 0, 'last_tid': 2}}
+
+    def test_round_trip(self):
+        print(' TestBlockFormat.test_round_trip')
+        for block_format in (FORMAT_JSON, FORMAT_COLUMNAR):
+            data = encode_block(TestBlockFormat.BLOCK, block_format)
+            self.assertEqual(data[:len(MAGIC)] == MAGIC,
+                             block_format == FORMAT_COLUMNAR)
+            self.assertEqual(decode_block(data), TestBlockFormat.BLOCK)
+
+        # Float amounts are kept as floats
+        block = {'hdr': {}, 'transactions': [
+            {'tid': 0, 'sender': 'Alice', 'receiver': 'Bob', 'amount': 1.5}]}
+        data = encode_block(block, FORMAT_COLUMNAR)
+        self.assertEqual(data[:len(MAGIC)], MAGIC)
+        self.assertEqual(decode_block(data), block)
+
+        # Blocks that do not fit the columns are written as JSON
+        block = {'hdr': {}, 'transactions': [
+            {'tid': 0, 'sender': 'Alice', 'receiver': 'Bob', 'amount': '5'}]}
+        data = encode_block(block, FORMAT_COLUMNAR)
+        self.assertNotEqual(data[:len(MAGIC)], MAGIC)
+        self.assertEqual(decode_block(data), block)
+
+        with self.assertRaises(ValueError):
+            encode_block(block, 'xml')
+
+    def test_codecs(self):
+        print(' TestBlockFormat.test_codecs')
+        data = encode_block(TestBlockFormat.BLOCK, FORMAT_JSON)
+        for codec in block_codec.CODECS:
+            compressed, metadata = block_codec.compress(data, codec)
+            self.assertEqual(block_codec.decompress(compressed, metadata),
+                             data)
+            if codec != block_codec.CODEC_NONE:
+                self.assertLess(len(compressed), len(data))
+        with self.assertRaises(ValueError):
+            block_codec.compress(data, 'zip')
+        with self.assertRaises(ValueError):
+            block_codec.decompress(data, {block_codec.METADATA_KEY: 'zip'})
+
+    def test_migrate(self):
+        print(' TestBlockFormat.test_migrate')
+        test_storage = storage.MemoryStorage()
+        test_ledger = ledger.Ledger('t', storage_backend=test_storage,
+                                    block_policy=BlockPolicy(16))
+        for i in range(40):
+            test_ledger.add_transaction('Alice', 'Bob', i)
+        test_ledger.cancel_transaction(5)
+        test_ledger.flush()
+        stats = test_ledger.statistics().to_dict()
+
+        # Every block is converted, and converting again changes nothing
+        self.assertEqual(migrate_ledger.migrate(
+            test_storage, test_ledger.filedir, FORMAT_COLUMNAR, 'zlib'),
+            (3, 3))
+        self.assertEqual(migrate_ledger.migrate(
+            test_storage, test_ledger.filedir, FORMAT_COLUMNAR, 'zlib'),
+            (0, 3))
+
+        # The reopened ledger reads the converted blocks and writes new
+        # blocks in the new format and codec
+        reopened = ledger.Ledger.open(test_ledger.filedir,
+                                      storage_backend=test_storage)
+        self.assertEqual((reopened.block_format, reopened.codec),
+                         (FORMAT_COLUMNAR, 'zlib'))
+        self.assertEqual(reopened.scan().to_dict(), stats)
+        for i in range(20):
+            reopened.add_transaction('Bob', 'Jon', i)
+        reopened.flush()
+        data, etag, metadata = test_storage.get_if_changed(
+            reopened.block_filename(reopened.filenum))
+        self.assertEqual(metadata, {block_codec.METADATA_KEY: 'zlib'})
+        self.assertEqual(block_codec.decompress(data, metadata)[:len(MAGIC)],
+                         MAGIC)
+
+        # Migrating back to JSON gives the same transactions
+        migrate_ledger.migrate(test_storage, test_ledger.filedir,
+                               FORMAT_JSON)
+        reopened_json = ledger.Ledger.open(test_ledger.filedir,
+                                           storage_backend=test_storage)
+        self.assertEqual(reopened_json.scan().to_dict(),
+                         reopened.scan().to_dict())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+import time
+import storage
+import ledger
+from block_policy import BlockPolicy
+
+
+class TestBlockPolicy(unittest.TestCase):
+    """
+    TestBlockPolicy - unit tests for BlockPolicy class
+
+    """
+    def test_limits(self):
+        print(' TestBlockPolicy.test_limits')
+        policy = BlockPolicy(max_transactions=None, max_bytes=100,
+                             max_age=10)
+        # An empty block is never full
+        self.assertFalse(policy.is_full(0, 0, None))
+        self.assertFalse(policy.is_full(3, 99, 1000.0, now=1009.0))
+        self.assertTrue(policy.is_full(3, 100, 1000.0, now=1009.0))
+        self.assertTrue(policy.is_full(3, 99, 1000.0, now=1010.0))
+        self.assertEqual(BlockPolicy.from_dict(policy.to_dict()).to_dict(),
+                         policy.to_dict())
+
+        with self.assertRaises(ValueError):
+            BlockPolicy(max_transactions=None)
+        with self.assertRaises(ValueError):
+            BlockPolicy(max_bytes=0)
+
+    def test_seal_by_bytes(self):
+        print(' TestBlockPolicy.test_seal_by_bytes')
+        policy = BlockPolicy(max_transactions=None, max_bytes=500)
+        test_ledger = ledger.Ledger('t',
+                                    storage_backend=storage.MemoryStorage(),
+                                    block_policy=policy)
+        for i in range(100):
+            test_ledger.add_transaction('Alice', 'Bob', i)
+        test_ledger.flush()
+
+        # Every sealed block reached the size limit with its last record
+        blocks = [ledger_data for f, ledger_data in test_ledger.iter_blocks()]
+        self.assertGreater(len(blocks), 1)
+        for ledger_data in blocks[:-1]:
+            sizes = [policy.record_size(t)
+                     for t in ledger_data['transactions']]
+            self.assertGreaterEqual(sum(sizes), 500)
+            self.assertLess(sum(sizes[:-1]), 500)
+        self.assertEqual(test_ledger.transaction_count(), 100)
+
+    def test_seal_by_age(self):
+        print(' TestBlockPolicy.test_seal_by_age')
+        test_ledger = ledger.Ledger('t',
+                                    storage_backend=storage.MemoryStorage(),
+                                    block_policy=BlockPolicy(max_age=0.05))
+        # An empty block is not sealed however old it is
+        time.sleep(0.06)
+        self.assertFalse(test_ledger.seal_if_due())
+
+        test_ledger.add_transaction('Alice', 'Bob', 1)
+        self.assertFalse(test_ledger.seal_if_due())
+        time.sleep(0.06)
+        # An idle block is sealed once it is old enough
+        self.assertTrue(test_ledger.seal_if_due())
+        self.assertEqual(test_ledger.filenum, 1)
+        test_ledger.add_transaction('Alice', 'Bob', 2)
+        self.assertEqual(test_ledger.filenum, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+import storage
+import ledger
+from instrumentation import Metrics, NullMetrics, InstrumentedStorage, timed
+from block_policy import BlockPolicy
+
+
+class Counter(object):
+    """
+    Counter - an object with a metrics attribute and a timed method
+
+    """
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    @timed('counter.count')
+    def count(self, n):
+        return sum(range(n))
+
+
+class TestInstrumentation(unittest.TestCase):
+    """
+    TestInstrumentation - unit tests for Metrics, InstrumentedStorage and
+                          the timed decorator
+
+    """
+    def test_timed(self):
+        print(' TestInstrumentation.test_timed')
+        metrics = Metrics()
+        counter = Counter(metrics)
+        for n in range(5):
+            self.assertEqual(counter.count(n), sum(range(n)))
+        entry = metrics.to_dict()['counter.count']
+        self.assertEqual(entry['count'], 5)
+        self.assertLessEqual(entry['p50_seconds'], entry['max_seconds'])
+
+        # Disabled instrumentation records nothing
+        counter = Counter(NullMetrics())
+        self.assertEqual(counter.count(3), 3)
+        self.assertEqual(counter.metrics.to_dict(), {})
+
+    def test_instrumented_storage(self):
+        print(' TestInstrumentation.test_instrumented_storage')
+        metrics = Metrics()
+        backend = InstrumentedStorage(storage.MemoryStorage(), metrics)
+        backend.put('/t/a', b'12345')
+        backend.put('/t/b', b'123')
+        self.assertEqual(backend.get('/t/a'), b'12345')
+        data, etag, metadata = backend.get_if_changed('/t/b')
+        # An unchanged object moves no bytes
+        backend.get_if_changed('/t/b', etag)
+        self.assertEqual(list(backend.list_keys('/t/')), ['/t/a', '/t/b'])
+
+        operations = metrics.to_dict()
+        self.assertEqual((operations['storage.put']['count'],
+                          operations['storage.put']['bytes']), (2, 8))
+        self.assertEqual((operations['storage.get']['count'],
+                          operations['storage.get']['bytes']), (3, 8))
+        self.assertEqual(operations['storage.list']['count'], 1)
+        # The wrapped backend's attributes are exposed
+        self.assertIn('/t/a', backend.objects)
+
+        metrics.reset()
+        self.assertEqual(metrics.to_dict(), {})
+
+    def test_ledger_metrics(self):
+        print(' TestInstrumentation.test_ledger_metrics')
+        metrics = Metrics()
+        test_ledger = ledger.Ledger('t',
+                                    storage_backend=storage.MemoryStorage(),
+                                    block_policy=BlockPolicy(10),
+                                    metrics=metrics)
+        for i in range(25):
+            test_ledger.add_transaction('Alice', 'Bob', i)
+        test_ledger.scan()
+        test_ledger.statistics()
+
+        operations = test_ledger.metrics_info()
+        # Two sealed blocks were encoded and written with their manifests
+        self.assertEqual(operations['block.encode']['count'], 2)
+        self.assertGreaterEqual(operations['storage.put']['count'], 2)
+        self.assertEqual(operations['aggregate.scan']['count'], 1)
+        self.assertEqual(operations['aggregate.statistics']['count'], 1)
+        self.assertIn('I/O and Latency Statistics', metrics.format_report())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,358 @@
+import unittest
+import copy
+import random
+import storage
+import ledger
+import merkle
+import trangen
+from block_policy import BlockPolicy
+from instrumentation import Metrics, InstrumentedStorage
+from user_index import TOP_BALANCE
+
+
+class FailingStorage(storage.MemoryStorage):
+    """
+    FailingStorage - in-memory storage whose next writes of one object fail,
+                     to test how the ledger handles a failed write
+
+    """
+    def __init__(self, fail_key, failures=1):
+        super().__init__()
+        self.fail_key = fail_key
+        self.failures = failures
+
+    def put(self, key, data, metadata=None):
+        if key.endswith(self.fail_key) and self.failures > 0:
+            self.failures -= 1
+            raise IOError('Write of ' + key + ' failed')
+        super().put(key, data, metadata)
+
+
+class TestLedger(unittest.TestCase):
+    """
+    TestLedger - unit tests for Ledger class
+
+    """
+    USERS = ['Alice', 'Bob', 'Jon', 'Howard', 'Rocky']
+
+    def add_records(self, test_ledger, count, seed=0):
+        # Add transactions and cancellations of earlier transactions,
+        # including repeated cancellations and cancellations of unknown tids
+        rng = random.Random(seed)
+        for i in range(count):
+            if i % 7 == 3:
+                test_ledger.cancel_transaction(
+                    rng.randint(test_ledger.tid_base,
+                                test_ledger.current_tid + 5))
+            else:
+                test_ledger.add_transaction(rng.choice(TestLedger.USERS),
+                                            rng.choice(TestLedger.USERS),
+                                            rng.randint(1, 100))
+
+    def block_keys(self, test_ledger):
+        return [key for key in test_ledger.storage.list_keys(
+                    test_ledger.filedir + '/')
+                if key.rsplit('/', 1)[-1].startswith('block_')]
+
+    def test_buffer_and_seal(self):
+        print(' TestLedger.test_buffer_and_seal')
+        test_storage = storage.MemoryStorage()
+        test_ledger = ledger.Ledger('t', storage_backend=test_storage,
+                                    block_policy=BlockPolicy(10))
+
+        # Transactions of the open block are only buffered
+        for i in range(5):
+            test_ledger.add_transaction('Alice', 'Bob', i)
+        self.assertEqual(self.block_keys(test_ledger), [])
+        self.assertTrue(test_ledger.dirty)
+
+        # Reading the ledger sees the buffered block without writing it
+        self.assertEqual(test_ledger.scan().transaction_count, 5)
+        self.assertEqual(test_ledger.get_transaction(4)['amount'], 4)
+        self.assertEqual(self.block_keys(test_ledger), [])
+
+        # Each full block is sealed and written once, with its footer
+        for i in range(20):
+            test_ledger.add_transaction('Bob', 'Jon', i)
+        self.assertEqual(test_ledger.filenum, 2)
+        self.assertEqual(len(self.block_keys(test_ledger)), 2)
+        first_block = test_ledger.from_file(test_ledger.block_filename(0))
+        self.assertEqual(len(first_block['transactions']), 10)
+        self.assertEqual(first_block['next_block'], 'block_1.json')
+        self.assertEqual(first_block['footer']['merkle_root'],
+                         merkle.merkle_root(first_block['transactions']))
+
+        # Flushing writes the open block
+        test_ledger.flush()
+        self.assertFalse(test_ledger.dirty)
+        self.assertEqual(len(self.block_keys(test_ledger)), 3)
+        self.assertEqual(test_ledger.transaction_count(), 25)
+
+    def test_failed_write(self):
+        print(' TestLedger.test_failed_write')
+        test_storage = FailingStorage('block_0.json')
+        test_ledger = ledger.Ledger('t', storage_backend=test_storage,
+                                    block_policy=BlockPolicy(10))
+
+        # The failed seal is reported and the block stays open
+        for i in range(9):
+            test_ledger.add_transaction('Alice', 'Bob', i)
+        with self.assertRaises(IOError):
+            test_ledger.add_transaction('Alice', 'Bob', 9)
+        self.assertEqual(test_ledger.filenum, 0)
+        self.assertEqual(test_ledger.footers, [])
+        self.assertTrue(test_ledger.dirty)
+
+        # No transaction is lost once the storage recovers
+        for i in range(10, 25):
+            test_ledger.add_transaction('Alice', 'Bob', i)
+        test_ledger.flush()
+        self.assertEqual(test_ledger.scan().transaction_count, 25)
+        reopened = ledger.Ledger.open(test_ledger.filedir,
+                                      storage_backend=test_storage)
+        self.assertEqual(reopened.transaction_count(), 25)
+        self.assertEqual([t['amount'] for t in reopened.history('Alice')],
+                         list(range(25)))
+
+    def test_statistics(self):
+        print(' TestLedger.test_statistics')
+        test_ledger = ledger.Ledger('t',
+                                    storage_backend=storage.MemoryStorage(),
+                                    block_policy=BlockPolicy(64))
+        self.add_records(test_ledger, 700)
+
+        # The running statistics match a full scan of the blocks
+        scanned = test_ledger.scan().to_dict()
+        self.assertEqual(test_ledger.statistics().to_dict(), scanned)
+        self.assertEqual(test_ledger.transaction_count(),
+                         scanned['transaction_count'])
+        self.assertEqual(test_ledger.net_value(), scanned['amount_total'])
+        self.assertEqual(test_ledger.cancelled_transaction_count(),
+                         scanned['cancelled_count'])
+
+    def test_cancelled_amounts(self):
+        print(' TestLedger.test_cancelled_amounts')
+        test_ledger = ledger.Ledger('t',
+                                    storage_backend=storage.MemoryStorage(),
+                                    block_policy=BlockPolicy(4))
+        for amount in (10, 20, 30, 40, 50):
+            test_ledger.add_transaction('Alice', 'Bob', amount)
+
+        # A cancelled amount is backed out once, even if cancelled again
+        test_ledger.cancel_transaction(1)
+        test_ledger.cancel_transaction(1)
+        self.assertEqual(test_ledger.cancel_transaction(99), -1)
+        self.assertTrue(test_ledger.is_cancelled(1))
+        self.assertFalse(test_ledger.is_cancelled(2))
+        self.assertEqual(test_ledger.net_value(), 130)
+        self.assertEqual(test_ledger.cancelled_transaction_count(), 2)
+        self.assertEqual(test_ledger.get_debits(), {'Alice': 130})
+        self.assertEqual(test_ledger.get_credits(), {'Bob': 130})
+        self.assertEqual(test_ledger.scan().to_dict(),
+                         test_ledger.statistics().to_dict())
+
+    def test_stored_statistics(self):
+        print(' TestLedger.test_stored_statistics')
+        test_storage = storage.MemoryStorage()
+        test_ledger = ledger.Ledger('t', storage_backend=test_storage,
+                                    block_policy=BlockPolicy(16))
+        self.add_records(test_ledger, 200, seed=6)
+        test_ledger.flush()
+
+        # Each flush stores only the totals, not the set of cancelled tids
+        stored = test_ledger.read_object(test_ledger.stats_filename)
+        self.assertNotIn('cancelled', stored)
+
+        # The reopened statistics take the cancelled tids from the tid
+        # index, so cancelling a tid again does not back it out twice
+        reopened = ledger.Ledger.open(test_ledger.filedir,
+                                      storage_backend=test_storage)
+        self.assertEqual(len(reopened.statistics().cancelled),
+                         len(test_ledger.tid_index.cancelled))
+        cancelled_tid = next(tid for tid in range(test_ledger.current_tid)
+                             if test_ledger.is_cancelled(tid))
+        reopened.cancel_transaction(cancelled_tid)
+        test_ledger.cancel_transaction(cancelled_tid)
+        self.assertEqual(reopened.statistics().to_dict(),
+                         test_ledger.statistics().to_dict())
+        self.assertEqual(reopened.statistics().to_dict(),
+                         reopened.scan().to_dict())
+
+    def test_columnar_statistics(self):
+        print(' TestLedger.test_columnar_statistics')
+        test_storage = storage.MemoryStorage()
+        test_ledger = ledger.Ledger('t', storage_backend=test_storage,
+                                    block_policy=BlockPolicy(64))
+        self.add_records(test_ledger, 700, seed=3)
+        test_ledger.flush()
+
+        # The columnar engine computes the same statistics as the running
+        # totals
+        columnar_ledger = ledger.Ledger.open(
+            test_ledger.filedir, storage_backend=test_storage,
+            stats_engine=ledger.STATS_COLUMNAR)
+        self.assertEqual(columnar_ledger.statistics().to_dict(),
+                         test_ledger.statistics().to_dict())
+        arrays = test_ledger.to_arrays()
+        self.assertEqual(len(arrays['tid']), test_ledger.current_tid)
+
+    def test_user_index(self):
+        print(' TestLedger.test_user_index')
+        test_ledger = ledger.Ledger('t',
+                                    storage_backend=storage.MemoryStorage(),
+                                    block_policy=BlockPolicy(64))
+        self.add_records(test_ledger, 700, seed=4)
+        stats = test_ledger.statistics()
+        transactions = [t for f, ledger_data in test_ledger.iter_blocks()
+                        for t in ledger_data['transactions']
+                        if 'amount' in t]
+
+        for user in TestLedger.USERS:
+            # The history holds every transaction of the user, in tid order
+            self.assertEqual(
+                test_ledger.history(user, include_cancelled=True),
+                [t for t in transactions
+                 if user in (t['sender'], t['receiver'])])
+            self.assertTrue(all(not test_ledger.is_cancelled(t['tid'])
+                                for t in test_ledger.history(user)))
+            # The balance matches the debits and credits of the statistics
+            self.assertEqual(test_ledger.balance(user),
+                             stats.credits.get(user, 0)
+                             - stats.debits.get(user, 0))
+
+        # The users ranked by balance have the balances computed above
+        balances = {user: test_ledger.balance(user)
+                    for user in TestLedger.USERS}
+        self.assertEqual(
+            dict(test_ledger.top_users(len(balances), by=TOP_BALANCE)),
+            balances)
+
+    def test_reopen(self):
+        print(' TestLedger.test_reopen')
+        test_storage = storage.MemoryStorage()
+        test_ledger = ledger.Ledger('t', storage_backend=test_storage,
+                                    block_policy=BlockPolicy(32))
+        self.add_records(test_ledger, 300, seed=1)
+        test_ledger.checkpoint()
+        # Records after the checkpoint are replayed from the blocks
+        self.add_records(test_ledger, 150, seed=2)
+        test_ledger.flush()
+
+        for manifest in (True, False):
+            if not manifest:
+                # Without the manifest the ledger follows its blocks
+                del test_storage.objects[test_ledger.filedir + '/'
+                                         + ledger.Ledger.MANIFEST_FILE]
+            reopened = ledger.Ledger.open(test_ledger.filedir,
+                                          storage_backend=test_storage)
+            self.assertEqual(reopened.current_tid, test_ledger.current_tid)
+            self.assertEqual(reopened.filenum, test_ledger.filenum)
+            self.assertEqual(reopened.statistics().to_dict(),
+                             test_ledger.statistics().to_dict())
+            self.assertEqual(reopened.footers, test_ledger.footers)
+            for user in TestLedger.USERS:
+                self.assertEqual(reopened.history(user, True),
+                                 test_ledger.history(user, True))
+                self.assertEqual(reopened.balance(user),
+                                 test_ledger.balance(user))
+            for tid in range(0, test_ledger.current_tid, 7):
+                self.assertEqual(reopened.is_cancelled(tid),
+                                 test_ledger.is_cancelled(tid))
+                self.assertEqual(reopened.get_transaction(tid),
+                                 test_ledger.get_transaction(tid))
+
+        # The reopened ledger continues where the original stopped
+        reopened.add_transaction('Alice', 'Bob', 5)
+        test_ledger.add_transaction('Alice', 'Bob', 5)
+        self.assertEqual(reopened.statistics().to_dict(),
+                         test_ledger.statistics().to_dict())
+
+    def test_reopen_reads(self):
+        print(' TestLedger.test_reopen_reads')
+        test_storage = storage.MemoryStorage()
+        test_ledger = ledger.Ledger('t', storage_backend=test_storage,
+                                    block_policy=BlockPolicy(4))
+        for i in range(4 * 70 + 2):
+            test_ledger.add_transaction('Alice', 'Bob', i)
+        test_ledger.flush()
+        # The indexes are checkpointed every CHECKPOINT_BLOCKS blocks
+        self.assertEqual(test_ledger.last_checkpoint['filenum'], 64)
+
+        # Reopening reads the manifest, the open block, the statistics, the
+        # indexes and the blocks sealed after the checkpoint, by number,
+        # without listing the ledger
+        metrics = Metrics()
+        reopened = ledger.Ledger.open(
+            test_ledger.filedir,
+            storage_backend=InstrumentedStorage(test_storage, metrics))
+        operations = metrics.to_dict()
+        self.assertNotIn('storage.list', operations)
+        self.assertEqual(operations['storage.get']['count'], 6 + 6)
+        self.assertEqual(reopened.transaction_count(), 4 * 70 + 2)
+        self.assertEqual(reopened.footers, test_ledger.footers)
+
+    def mined_ledger(self, bits):
+        test_ledger = ledger.Ledger('t',
+                                    storage_backend=storage.MemoryStorage(),
+                                    block_policy=BlockPolicy(20))
+        trangen.TranGEN(difficulty_bits=bits).generate_transactions(
+            test_ledger, 100)
+        test_ledger.flush()
+        return test_ledger
+
+    def test_verify_merkle_roots(self):
+        print(' TestLedger.test_verify_merkle_roots')
+        test_ledger = self.mined_ledger(4)
+        self.assertTrue(test_ledger.verify(workers=1, min_bits=4)['valid'])
+
+        # Rewriting a sealed block with a matching footer breaks the Merkle
+        # root committed in a later header
+        filename = test_ledger.block_filename(1)
+        ledger_data = copy.deepcopy(test_ledger.from_file(filename))
+        ledger_data['transactions'].reverse()
+        ledger_data['footer']['merkle_root'] = merkle.merkle_root(
+            ledger_data['transactions'])
+        test_ledger.to_file(ledger_data, filename)
+        result = test_ledger.verify(workers=1, min_bits=4)
+        self.assertFalse(result['valid'])
+        self.assertIn('Block 2: header commits to a wrong Merkle root for '
+                      'block 1', result['errors'])
+
+    def test_verify_repeated_transactions(self):
+        print(' TestLedger.test_verify_repeated_transactions')
+        test_ledger = self.mined_ledger(4)
+
+        # Repeating the last 4 of 20 transactions keeps the Merkle root,
+        # since the odd fifth node of the second level is paired with itself
+        filename = test_ledger.block_filename(1)
+        ledger_data = copy.deepcopy(test_ledger.from_file(filename))
+        transactions = ledger_data['transactions']
+        self.assertEqual(len(transactions), 20)
+        self.assertFalse(merkle.checked_merkle_root(transactions)[1])
+        ledger_data['transactions'] = transactions + transactions[16:]
+        self.assertEqual(
+            merkle.checked_merkle_root(ledger_data['transactions']),
+            (ledger_data['footer']['merkle_root'], True))
+        test_ledger.to_file(ledger_data, filename)
+        result = test_ledger.verify(workers=1, min_bits=4)
+        self.assertFalse(result['valid'])
+        self.assertEqual(result['errors'],
+                         ['Block 1: Merkle tree has repeated transactions'])
+
+    def test_verify_min_bits(self):
+        print(' TestLedger.test_verify_min_bits')
+        test_ledger = ledger.Ledger('t',
+                                    storage_backend=storage.MemoryStorage(),
+                                    block_policy=BlockPolicy(20))
+        trangen.TranGEN(difficulty_bits=4).generate_transactions(test_ledger,
+                                                                  60)
+        self.assertTrue(test_ledger.verify(workers=1, min_bits=4)['valid'])
+        # Headers mined below the minimum difficulty are rejected
+        result = test_ledger.verify(workers=1, min_bits=5)
+        self.assertFalse(result['valid'])
+        self.assertIn('Block 0: header difficulty of 4 bits is below the '
+                      'minimum of 5', result['errors'])
+
+
+if __name__ == '__main__':
+    unittest.main()
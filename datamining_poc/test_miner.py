@@ -0,0 +1,82 @@
+import unittest
+import threading
+import miner
+
+
+class TestRetargetPolicy(unittest.TestCase):
+    """
+    TestRetargetPolicy - unit tests for RetargetPolicy class
+
+    """
+    def test_adjust(self):
+        print(' TestRetargetPolicy.test_adjust')
+        policy = miner.RetargetPolicy(1.0, window=2, max_step=2, min_bits=4,
+                                      max_bits=20)
+        # Blocks on target keep the difficulty
+        self.assertEqual(policy.adjust(10, 1.0), 10)
+        # Faster blocks raise the difficulty, and the times measured at the
+        # old difficulty are dropped
+        self.assertEqual(policy.adjust(10, 0.25), 11)
+        self.assertEqual(policy.block_times, [])
+        # Blocks 4 times too fast add 2 bits
+        self.assertEqual(policy.adjust(11, 0.25), 13)
+        # The step is bounded by max_step
+        self.assertEqual(policy.adjust(13, 1000.0), 11)
+        # The difficulty stays between min_bits and max_bits
+        self.assertEqual(policy.adjust(5, 1000.0), 4)
+        self.assertEqual(policy.adjust(20, 0.001), 20)
+
+        with self.assertRaises(ValueError):
+            miner.RetargetPolicy(0)
+
+    def test_targets(self):
+        print(' TestRetargetPolicy.test_targets')
+        self.assertTrue(miner.meets_target('0' * 4 + 'f' * 60, 16))
+        self.assertFalse(miner.meets_target('0' * 3 + '1' + 'f' * 60, 16))
+        self.assertTrue(miner.meets_target('f' * 64, 0))
+        self.assertEqual(miner.header_bits({}), miner.DEFAULT_BITS)
+        with self.assertRaises(ValueError):
+            miner.target_for_bits(257)
+
+
+class TestMiner(unittest.TestCase):
+    """
+    TestMiner - unit tests for Miner class
+
+    """
+    PREV_HASH = '0' * 64
+
+    def test_do_work(self):
+        print(' TestMiner.test_do_work')
+        test_miner = miner.Miner('Alice', bits=8)
+        hash_hex = test_miner.do_work(TestMiner.PREV_HASH)
+        self.assertTrue(miner.meets_target(hash_hex, 8))
+        self.assertEqual(miner.header_hash(test_miner.block_hdr), hash_hex)
+        self.assertIsNone(test_miner.executor)
+
+    def test_do_work_parallel(self):
+        print(' TestMiner.test_do_work_parallel')
+        with miner.Miner('Alice', workers=2, bits=12) as test_miner:
+            hash_hex = test_miner.do_work(TestMiner.PREV_HASH)
+            self.assertTrue(miner.meets_target(hash_hex, 12))
+            self.assertEqual(miner.header_hash(test_miner.block_hdr),
+                             hash_hex)
+
+            # The next search reuses the worker processes
+            executor = test_miner.executor
+            next_hash = test_miner.do_work(hash_hex)
+            self.assertIs(test_miner.executor, executor)
+            self.assertEqual(test_miner.block_hdr['previous_hash'], hash_hex)
+            self.assertEqual(miner.header_hash(test_miner.block_hdr),
+                             next_hash)
+
+            # A set stop event abandons the search
+            stop_event = threading.Event()
+            stop_event.set()
+            self.assertIsNone(test_miner.do_work(next_hash, stop_event))
+        # The worker processes are shut down with the miner
+        self.assertIsNone(test_miner.executor)
+
+
+if __name__ == '__main__':
+    unittest.main()
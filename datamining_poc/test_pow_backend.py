@@ -0,0 +1,60 @@
+import unittest
+import hashlib
+import threading
+import miner
+import pow_backend
+
+
+class TestPowBackend(unittest.TestCase):
+    """
+    TestPowBackend - unit tests for the proof of work backends
+
+    """
+    def test_self_test(self):
+        print(' TestPowBackend.test_self_test')
+        target = 2 ** 244
+        results = pow_backend.self_test(seed=1, target=target, headers=6)
+        # Every backend found the same valid nonces
+        self.assertEqual(set(results), set(pow_backend.BACKENDS))
+        for name, found in results.items():
+            self.assertEqual(found,
+                             results[pow_backend.ReferenceBackend.name])
+            for nonce, hash_hex in found:
+                self.assertLess(int(hash_hex, 16), target)
+
+    def test_search(self):
+        print(' TestPowBackend.test_search')
+        prefix_hash = hashlib.sha256(b'{"miner": "test"}')
+        for backend in pow_backend.BACKENDS.values():
+            # An unreachable target finds nothing in the range
+            self.assertIsNone(backend.search(prefix_hash, 0, 5000, 0))
+            # A search stops once its stop event is set
+            stop_event = threading.Event()
+            stop_event.set()
+            self.assertIsNone(backend.search(prefix_hash, 0, 2 ** 32 - 1, 0,
+                                             stop_event))
+            # The prefix hash is not modified by the search
+            self.assertEqual(prefix_hash.hexdigest(),
+                             hashlib.sha256(b'{"miner": "test"}').hexdigest())
+
+    def test_get_backend(self):
+        print(' TestPowBackend.test_get_backend')
+        self.assertIs(pow_backend.get_backend('batched'),
+                      pow_backend.BACKENDS['batched'])
+        with self.assertRaises(ValueError):
+            pow_backend.get_backend('wrong_backend')
+
+    def test_mined_header(self):
+        print(' TestPowBackend.test_mined_header')
+        for name in pow_backend.BACKENDS:
+            test_miner = miner.Miner('Alice', backend=name, bits=8,
+                                     merkle_roots=['00' * 32])
+            hash_hex = test_miner.do_work('0' * 64)
+            # The hash can be recomputed from the stored header
+            self.assertEqual(hash_hex,
+                             miner.header_hash(test_miner.block_hdr))
+            self.assertTrue(miner.meets_target(hash_hex, 8))
+
+
+if __name__ == '__main__':
+    unittest.main()
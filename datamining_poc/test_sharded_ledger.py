@@ -0,0 +1,151 @@
+import unittest
+import random
+import storage
+import ledger
+import trangen
+import sharded_ledger
+from block_policy import BlockPolicy
+
+
+class CountingTranGEN(trangen.TranGEN):
+    """
+    CountingTranGEN - transaction generator that counts the block headers
+                      mined in the background and used for new blocks
+
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.premined_used = 0
+
+    def take_premined(self, state):
+        result = super().take_premined(state)
+        if result is not None:
+            self.premined_used += 1
+        return result
+
+
+class TestShardedLedger(unittest.TestCase):
+    """
+    TestShardedLedger - unit tests for ShardedLedger class
+
+    """
+    USERS = ['Alice', 'Bob', 'Jon', 'Howard', 'Rocky', 'Zed']
+
+    def add_records(self, ledgers, count, seed=0):
+        # Add the same transactions and cancellations to every ledger. The
+        # ledgers assign different tids, so cancellations name the position
+        # of the cancelled record.
+        rng = random.Random(seed)
+        tids = [[] for test_ledger in ledgers]
+        for i in range(count):
+            if i % 7 == 3:
+                position = rng.randrange(len(tids[0]))
+                for test_ledger, ledger_tids in zip(ledgers, tids):
+                    ledger_tids.append(test_ledger.cancel_transaction(
+                        ledger_tids[position]))
+            else:
+                record = (rng.choice(TestShardedLedger.USERS),
+                          rng.choice(TestShardedLedger.USERS),
+                          rng.randint(1, 100))
+                for test_ledger, ledger_tids in zip(ledgers, tids):
+                    ledger_tids.append(test_ledger.add_transaction(*record))
+        return tids
+
+    def check_same_results(self, sharded, single):
+        self.assertEqual(sharded.statistics().to_dict(),
+                         single.statistics().to_dict())
+        self.assertEqual(sharded.scan().to_dict()['transaction_count'],
+                         single.scan().to_dict()['transaction_count'])
+        self.assertEqual(sharded.average_value(), single.average_value())
+        for user in TestShardedLedger.USERS:
+            self.assertEqual(sharded.balance(user), single.balance(user))
+            self.assertEqual(
+                sorted(t['amount'] for t in sharded.history(user)),
+                sorted(t['amount'] for t in single.history(user)))
+        users = len(TestShardedLedger.USERS)
+        self.assertEqual(sorted(sharded.top_users(users)),
+                         sorted(single.top_users(users)))
+
+    def test_matches_single_ledger(self):
+        print(' TestShardedLedger.test_matches_single_ledger')
+        test_storage = storage.MemoryStorage()
+        sharded = sharded_ledger.ShardedLedger(
+            's', 3, storage_backend=test_storage,
+            block_policy=BlockPolicy(32))
+        single = ledger.Ledger('t', storage_backend=test_storage,
+                               block_policy=BlockPolicy(32))
+        tids = self.add_records([sharded, single], 800)
+        self.check_same_results(sharded, single)
+        for sharded_tid, single_tid in zip(*tids):
+            self.assertEqual(sharded.is_cancelled(sharded_tid),
+                             single.is_cancelled(single_tid))
+
+        # A batch gives the same results as single records
+        records = [('Zed', 'Alice', 7), ('Bob', 'Zed', 3),
+                   {'cancelled_tid': tids[0][0]}]
+        sharded.add_transactions(records)
+        single.add_transactions(records[:2] + [
+            {'cancelled_tid': tids[1][0]}])
+        self.check_same_results(sharded, single)
+
+        # The reopened sharded ledger gives the same results
+        sharded.checkpoint()
+        reopened = sharded_ledger.ShardedLedger.open(
+            sharded.filedir, storage_backend=test_storage)
+        self.check_same_results(reopened, single)
+
+    def test_mined_headers(self):
+        print(' TestShardedLedger.test_mined_headers')
+        test_storage = storage.MemoryStorage()
+        sharded = sharded_ledger.ShardedLedger(
+            's', 2, storage_backend=test_storage,
+            block_policy=BlockPolicy(20))
+        trangen.TranGEN(difficulty_bits=4).generate_transactions(sharded, 150)
+        sharded.flush()
+        # Every shard has its own verified chain of block headers
+        result = sharded.verify(workers=1, min_bits=4)
+        self.assertTrue(result['valid'], result['errors'])
+        # A shard whose last block is full has no open block yet
+        self.assertEqual(result['blocks'],
+                         sum(s.filenum + (1 if s.block_data['transactions']
+                                          else 0)
+                             for s in sharded.shards))
+
+        # Generation continues the chains of a reopened ledger
+        reopened = sharded_ledger.ShardedLedger.open(
+            sharded.filedir, storage_backend=test_storage)
+        trangen.TranGEN(difficulty_bits=4).generate_transactions(reopened, 50)
+        result = reopened.verify(workers=1, min_bits=4)
+        self.assertTrue(result['valid'], result['errors'])
+
+    def test_pipelined_headers(self):
+        print(' TestShardedLedger.test_pipelined_headers')
+        sharded = sharded_ledger.ShardedLedger(
+            's', 2, storage_backend=storage.MemoryStorage(),
+            block_policy=BlockPolicy(10))
+        generator = CountingTranGEN(difficulty_bits=4, pipelined=True)
+
+        # The shards ingest a batch in parallel threads, each continuing
+        # its own chain of headers mined in the background
+        rng = random.Random(5)
+        sharded.add_new_block_callback(generator.on_new_block)
+        try:
+            for i in range(4):
+                sharded.add_transactions(
+                    [(rng.choice(TestShardedLedger.USERS),
+                      rng.choice(TestShardedLedger.USERS),
+                      rng.randint(1, 100)) for j in range(49)])
+        finally:
+            sharded.remove_new_block_callback(generator.on_new_block)
+            generator.stop_premining()
+        sharded.flush()
+        result = sharded.verify(workers=1, min_bits=4)
+        self.assertTrue(result['valid'], result['errors'])
+
+        # Only the first block of each shard waits for its header
+        self.assertEqual(generator.premined_used,
+                         sum(s.filenum for s in sharded.shards))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+import shutil
+import tempfile
+import storage
+import ledger
+from block_policy import BlockPolicy
+
+
+class TestStorage(unittest.TestCase):
+    """
+    TestStorage - unit tests for the LocalStorage and MemoryStorage classes
+
+    """
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def backends(self):
+        return [storage.LocalStorage(self.root), storage.MemoryStorage()]
+
+    def test_put_and_get(self):
+        print(' TestStorage.test_put_and_get')
+        for backend in self.backends():
+            backend.put('/led/block_0.json', b'abc', {'codec': 'zlib'})
+            backend.put('/led/stats.json', b'{}')
+            self.assertEqual(backend.get('/led/block_0.json'), b'abc')
+
+            # The metadata is returned with the object
+            data, etag, metadata = backend.get_if_changed('/led/block_0.json')
+            self.assertEqual(data, b'abc')
+            self.assertEqual(metadata, {'codec': 'zlib'})
+            data, etag, metadata = backend.get_if_changed('/led/stats.json')
+            self.assertEqual(metadata or {}, {})
+
+            # A missing object raises FileNotFoundError
+            with self.assertRaises(FileNotFoundError):
+                backend.get('/led/block_9.json')
+            with self.assertRaises(FileNotFoundError):
+                backend.get_if_changed('/led/block_9.json')
+
+    def test_get_if_changed(self):
+        print(' TestStorage.test_get_if_changed')
+        for backend in self.backends():
+            backend.put('/led/block_0.json', b'abc')
+            data, etag, metadata = backend.get_if_changed('/led/block_0.json')
+
+            # An unchanged object is not returned again
+            self.assertEqual(
+                backend.get_if_changed('/led/block_0.json', etag)[0], None)
+
+            # A rewritten object gets a new ETag
+            backend.put('/led/block_0.json', b'abcdef')
+            data, new_etag, metadata = backend.get_if_changed(
+                '/led/block_0.json', etag)
+            self.assertEqual(data, b'abcdef')
+            self.assertNotEqual(new_etag, etag)
+
+    def test_list_keys(self):
+        print(' TestStorage.test_list_keys')
+        for backend in self.backends():
+            for key in ('/led/block_1.json', '/led/block_0.json',
+                        '/other/block_0.json'):
+                backend.put(key, b'x', {'codec': 'gzip'})
+            # Keys are listed in order, without metadata or temporary files
+            self.assertEqual(list(backend.list_keys('/led/')),
+                             ['/led/block_0.json', '/led/block_1.json'])
+
+    def test_ledger_on_local_storage(self):
+        print(' TestStorage.test_ledger_on_local_storage')
+        local_storage = storage.LocalStorage(self.root)
+        test_ledger = ledger.Ledger('/led', storage_backend=local_storage,
+                                    block_policy=BlockPolicy(8))
+        for i in range(30):
+            test_ledger.add_transaction('Alice', 'Bob', i)
+        test_ledger.cancel_transaction(3)
+        test_ledger.flush()
+
+        # The ledger is reopened from the files on disk
+        reopened = ledger.Ledger.open(test_ledger.filedir,
+                                      storage_backend=local_storage)
+        self.assertEqual(reopened.statistics().to_dict(),
+                         test_ledger.statistics().to_dict())
+        self.assertEqual(reopened.scan().to_dict(),
+                         test_ledger.scan().to_dict())
+        self.assertEqual(reopened.get_transaction(29)['amount'], 29)
+
+
+if __name__ == '__main__':
+    unittest.main()
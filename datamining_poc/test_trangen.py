@@ -0,0 +1,82 @@
+import unittest
+import storage
+import ledger
+import trangen
+from block_policy import BlockPolicy
+
+
+class CountingTranGEN(trangen.TranGEN):
+    """
+    CountingTranGEN - transaction generator that counts the block headers
+                      mined in the background and used for new blocks
+
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.premined_used = 0
+
+    def take_premined(self, state):
+        result = super().take_premined(state)
+        if result is not None:
+            self.premined_used += 1
+        return result
+
+
+class TestTranGEN(unittest.TestCase):
+    """
+    TestTranGEN - unit tests for TranGEN class
+
+    """
+    def generate(self, generator_class=trangen.TranGEN, count=100,
+                 **kwargs):
+        test_ledger = ledger.Ledger('t',
+                                    storage_backend=storage.MemoryStorage(),
+                                    block_policy=BlockPolicy(20))
+        generator = generator_class(difficulty_bits=4, **kwargs)
+        generator.generate_transactions(test_ledger, count)
+        test_ledger.flush()
+        return generator, test_ledger
+
+    def test_serial(self):
+        print(' TestTranGEN.test_serial')
+        generator, test_ledger = self.generate()
+
+        # No miner processes are started by default
+        self.assertIsNone(generator.mining_executor)
+        self.assertIsNone(generator.mining_manager)
+        self.assertEqual(test_ledger.transaction_count()
+                         + test_ledger.cancelled_transaction_count(), 100)
+        self.assertTrue(test_ledger.verify(workers=1, min_bits=4)['valid'])
+
+    def test_concurrent(self):
+        print(' TestTranGEN.test_concurrent')
+        generator, test_ledger = self.generate(concurrent=True)
+
+        # The miner processes are shut down after generating
+        self.assertIsNone(generator.mining_executor)
+        self.assertTrue(test_ledger.verify(workers=1, min_bits=4)['valid'])
+
+    def test_pipelined(self):
+        print(' TestTranGEN.test_pipelined')
+        generator, test_ledger = self.generate(CountingTranGEN, count=95,
+                                               pipelined=True)
+
+        # Every block after the first uses the header mined in the
+        # background
+        self.assertEqual(test_ledger.filenum, 4)
+        self.assertEqual(generator.premined_used, test_ledger.filenum)
+        result = test_ledger.verify(workers=1, min_bits=4)
+        self.assertTrue(result['valid'], result['errors'])
+        # A premined header is mined before the previous block is sealed,
+        # so the Merkle root of the last sealed block is not committed yet
+        self.assertEqual(test_ledger.committed_roots,
+                         test_ledger.filenum - 1)
+
+        # The background contest is stopped after generating
+        state = generator.mining_state(test_ledger)
+        self.assertIsNone(state.premine_future)
+        self.assertIsNone(state.premine_executor)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import base64
+
+
+class TidBitmap(object):
+    """
+    TidBitmap - a compact set of transaction ids stored as one bit per tid.
+                Ten million tids take about 1.2 MB.
+
+    """
+    def __init__(self, base=0):
+        """
+        Initializes an empty instance of the TidBitmap class
+
+        Parameters:
+            self : the instance of the class
+            base : the lowest tid the bitmap can hold
+
+        Returns:
+            N/A
+        """
+        self.base = base
+        self.bits = bytearray()
+        self.count = 0
+
+    def add(self, tid):
+        """
+        Adds a tid to the set
+
+        Parameters:
+            self : the instance of the class
+            tid : the transaction id to add
+
+        Returns:
+            N/A
+        """
+        offset = tid - self.base
+        if offset < 0:
+            raise ValueError('Tid %d is below the bitmap base %d' %
+                             (tid, self.base))
+        byte, bit = divmod(offset, 8)
+        if byte >= len(self.bits):
+            # Grow in chunks so adding ascending tids stays cheap
+            self.bits.extend(bytes(max(byte + 1 - len(self.bits),
+                                       len(self.bits) // 2, 64)))
+        if not self.bits[byte] & (1 << bit):
+            self.bits[byte] |= 1 << bit
+            self.count += 1
+
+    def __contains__(self, tid):
+        """
+        Checks if a tid is in the set
+
+        Parameters:
+            self : the instance of the class
+            tid : the transaction id to check
+
+        Returns:
+            True if the tid is in the set, False otherwise
+        """
+        offset = tid - self.base
+        if offset < 0:
+            return False
+        byte, bit = divmod(offset, 8)
+        return byte < len(self.bits) and bool(self.bits[byte] & (1 << bit))
+
+    def __len__(self):
+        return self.count
+
+    def copy(self):
+        """
+        Creates an independent copy of the bitmap
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            bitmap : the new TidBitmap object
+        """
+        bitmap = TidBitmap(self.base)
+        bitmap.bits = bytearray(self.bits)
+        bitmap.count = self.count
+        return bitmap
+
+    def to_dict(self):
+        """
+        Converts the bitmap into a dictionary that can be stored as JSON
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            A dictionary holding the base and the base64 encoded bits
+        """
+        return {'base': self.base,
+                'bits': base64.b64encode(bytes(self.bits.rstrip(b'\x00')))
+                .decode('ascii')}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Creates a TidBitmap object from a dictionary produced by to_dict
+
+        Parameters:
+            cls : the TidBitmap class
+            data : the dictionary holding the bitmap
+
+        Returns:
+            bitmap : the restored TidBitmap object
+        """
+        bitmap = cls(data['base'])
+        bitmap.bits = bytearray(base64.b64decode(data['bits']))
+        bitmap.count = sum(bin(b).count('1') for b in bitmap.bits)
+        return bitmap
@@ -0,0 +1,135 @@
+import bisect
+from tid_bitmap import TidBitmap
+
+
+class TidIndex(object):
+    """
+    TidIndex - maps transaction ids to the blocks holding them and records
+               which transactions have been cancelled. Transaction ids are
+               assigned densely, so the index only needs the first tid of
+               each block to locate any tid.
+
+    """
+    def __init__(self, tid_base=0):
+        """
+        Initializes an empty instance of the TidIndex class
+
+        Parameters:
+            self : the instance of the class
+            tid_base : the lowest tid the ledger can assign
+
+        Returns:
+            N/A
+        """
+        # First tid of each block, indexed by block number
+        self.block_starts = []
+        # One past the highest tid added so far
+        self.next_tid = 0
+        # Maps each cancellation record's tid to the tid it cancelled
+        self.cancellations = {}
+        # Set of cancelled tids
+        self.tid_base = tid_base
+        self.cancelled = TidBitmap(tid_base)
+
+    def add(self, transaction, filenum):
+        """
+        Adds a transaction or cancellation record to the index
+
+        Parameters:
+            self : the instance of the class
+            transaction : the transaction dictionary being added
+            filenum : the number of the block holding the transaction
+
+        Returns:
+            N/A
+        """
+        tid = transaction['tid']
+        # The first transaction of a block marks where the block starts
+        if filenum == len(self.block_starts):
+            self.block_starts.append(tid)
+        self.next_tid = max(self.next_tid, tid + 1)
+
+        if 'cancelled_tid' in transaction:
+            cancelled_tid = transaction['cancelled_tid']
+            self.cancellations[tid] = cancelled_tid
+            self.cancelled.add(cancelled_tid)
+
+    def locate(self, tid):
+        """
+        Finds the block holding a tid and the tid's position in that block
+
+        Parameters:
+            self : the instance of the class
+            tid : the transaction id to locate
+
+        Returns:
+            A (block number, position) tuple, or None if the tid is unknown
+        """
+        if not self.block_starts or not (
+                self.block_starts[0] <= tid < self.next_tid):
+            return None
+        filenum = bisect.bisect_right(self.block_starts, tid) - 1
+        return filenum, tid - self.block_starts[filenum]
+
+    def exists(self, tid):
+        """
+        Checks if a transaction (not a cancellation record) with the
+        specified tid exists
+
+        Parameters:
+            self : the instance of the class
+            tid : the transaction id to check
+
+        Returns:
+            True if the transaction exists, False otherwise
+        """
+        return self.locate(tid) is not None and tid not in self.cancellations
+
+    def is_cancelled(self, tid):
+        """
+        Checks if the transaction with the specified tid has been cancelled
+
+        Parameters:
+            self : the instance of the class
+            tid : the transaction id to check
+
+        Returns:
+            True if a cancellation record exists for the tid, False otherwise
+        """
+        return tid in self.cancelled
+
+    def to_dict(self):
+        """
+        Converts the index into a dictionary that can be stored as JSON
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            A dictionary containing the index
+        """
+        return {'tid_base': self.tid_base,
+                'block_starts': self.block_starts,
+                'next_tid': self.next_tid,
+                'cancellations': [[tid, cancelled_tid] for tid, cancelled_tid
+                                  in self.cancellations.items()]}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Creates a TidIndex object from a dictionary produced by to_dict
+
+        Parameters:
+            cls : the TidIndex class
+            data : the dictionary holding the index
+
+        Returns:
+            index : the restored TidIndex object
+        """
+        index = cls(data.get('tid_base', 0))
+        index.block_starts = list(data['block_starts'])
+        index.next_tid = data['next_tid']
+        for tid, cancelled_tid in data['cancellations']:
+            index.cancellations[tid] = cancelled_tid
+            index.cancelled.add(cancelled_tid)
+        return index
@@ -1,29 +1,131 @@
 import miner
 import random
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
+                                FIRST_COMPLETED, wait)
 import logging
 import logging.config
+import threading
 import time
 
 logging.config.fileConfig('logging.conf')
 logger = logging.getLogger('trangen')
 
 
+def mine_header(miner_name, prev_hash, bits, merkle_roots, stop_event):
+    """
+    Mines a block header for one miner of a mining contest. Runs in a worker
+    process when the miners race concurrently, or in the calling process
+    otherwise, and gives up once the contest's stop event is set.
+
+    Parameters:
+        miner_name : the name of the miner
+        prev_hash : the hash of the previous block header
+        bits : the difficulty in bits
+        merkle_roots : the Merkle roots of the sealed blocks the header
+                       commits to
+        stop_event : the contest's stop event, shared through a manager
+                     when the miners race concurrently
+
+    Returns:
+        A (miner name, block header, hash hex, elapsed time) tuple, or None
+        if another miner won first
+    """
+    current_miner = miner.Miner(miner_name, bits=bits,
+                                merkle_roots=merkle_roots)
+    logger.info('%s: Miner %s is going to work...', __name__, miner_name)
+    start = time.time()
+    hash_hex = current_miner.do_work(prev_hash, stop_event)
+    if hash_hex is None:
+        return None
+    elapsed = time.time() - start
+    logger.info('%s: %s finished mining with elapsed time: %s', __name__,
+                miner_name, elapsed)
+    return miner_name, current_miner.block_hdr, hash_hex, elapsed
+
+
+class MiningState(object):
+    """
+    MiningState - the state of mining the chain of block headers of one
+                  ledger, or of one shard of a sharded ledger
+    """
+    def __init__(self, prev_hash, difficulty_bits):
+        """
+        Initializes an instance of the MiningState class.
+
+        Parameters:
+            self : the instance of the class
+            prev_hash : the hash of the last block header of the chain
+            difficulty_bits : the mining difficulty of the next block
+
+        Returns:
+            N/A
+        """
+        self.prev_hash = prev_hash
+        self.difficulty_bits = difficulty_bits
+
+        # Background mining of the next block header in pipelined mode
+        self.premine_executor = None
+        self.premine_future = None
+        self.premine_stop = None
+        self.premine_prev_hash = None
+
+
 class TranGEN(object):
     """
     TranGEN - transaction generator class, which randomly generates a
               specified number of blockchain ledger transactions and
               adds them to the ledger.
     """
-    def __init__(self):
+    # Previous hash of the first block header of a new ledger, since it has
+    # no previous block
+    GENESIS_HASH = ('00005894794791a54be8441cd53d763e2368187d09216a8640'
+                    '3982a647326591')
+    # The names of all miners taking part in each mining contest
+    MINER_NAMES = ['Alice', 'Bob', 'Charlie']
+
+    def __init__(self, difficulty_bits=miner.DEFAULT_BITS, retarget=None,
+                 pipelined=False, concurrent=False):
         """
         Initializes an instance of the TranGEN class.
 
         Parameters:
             self : the instance of the class
+            difficulty_bits : the mining difficulty of the first block of
+                              each ledger or shard, in leading zero bits
+                              of the header hash
+            retarget : a miner.RetargetPolicy that adjusts the difficulty
+                       after each block from the measured mining time, or
+                       None to keep the difficulty fixed
+            pipelined : True to mine the next block header in the
+                        background while transactions are added, so
+                        ingest does not wait for mining at block boundaries
+            concurrent : True to race the miners at the same time in worker
+                         processes started by miner.MP_CONTEXT, False to
+                         let them mine one after another in the calling
+                         process, which also works where processes cannot
+                         be started, e.g. on AWS Lambda
 
         Returns:
             N/A
         """
+        # Mining difficulty of the first block and its retargeting policy
+        self.difficulty_bits = difficulty_bits
+        self.retarget = retarget
+
+        # Mining state of each ledger, or of each shard of a sharded
+        # ledger, whose callbacks may run in parallel threads
+        self.mining_states = {}
+        self.mining_states_lock = threading.Lock()
+
+        # Worker processes of the miners, and the manager of the contests'
+        # stop events, kept for all contests of generate_transactions when
+        # the miners race concurrently
+        self.concurrent = concurrent
+        self.mining_executor = None
+        self.mining_manager = None
+
+        # Mine the next block header in the background
+        self.pipelined = pipelined
         # List attribute containing dictionaries of all users and their
         # initial balances
         self.users = [{'name': 'Alice', 'balance': 1000},
@@ -34,13 +136,14 @@ class TranGEN(object):
         self.last_transaction = {}
         self.transactionCnt = 0
         self.cancelledCnt = 0
-        # Start with arbitrary hash since we have no previous hash
-        self.prev_hash = ('00005894794791a54be8441cd53d763e2368187d09216a8640'
-                          '3982a647326591')
 
     def generate_transactions(self, dest_ledger, count):
         """
-        Generates a specified number of blockchain ledger transactions
+        Generates a specified number of blockchain ledger transactions. When
+        the miners race concurrently, they run in processes started by
+        miner.MP_CONTEXT, which imports the calling script again, so a
+        script must then only call this from its
+        "if __name__ == '__main__'" block.
 
         Parameters:
             self : the instance of the class
@@ -54,58 +157,114 @@ class TranGEN(object):
         last_tid = -1
         success = True
 
-        # Mine for new block
-        logger.info('%s: Starting initial block...', __name__)
-        self.start_new_block(dest_ledger)
-
         logger.info('%s: Attempt to generate %d transactions...', __name__,
                     count)
 
-        # Add initial transaction
+        # Mine a header for each new block the ledger starts, as decided by
+        # its block policy, when the block's first transaction arrives. This
+        # includes the initial block, unless the open block of a reopened
+        # ledger already has a header.
+        self.start_miners()
+        dest_ledger.add_new_block_callback(self.on_new_block)
+
         try:
-            last_tid = self.gen_transaction(dest_ledger)
-        except Exception as e:
-            success = False
-
-        # Loop through the specified range (starting at 1 since the initial
-        # transaction was added above
-        for x in range(1, count):
-            # Once we hit 256 transactions, start a new block
-            if x % 256 == 0:
-                logger.info('%s: Block is full. Starting new block...',
-                            __name__)
-                self.start_new_block(dest_ledger)
-
-            do_trans = True
-            # Get the current percentage of cancelled transactions
-            pct_cancelled = self.cancelledCnt / x * 100
-
-            # If the last transaction was not a cancellation and the current
-            # percentage of cancellations is less than 20, consider whether
-            # a cancellation should be added
-            if last_tid > -1 and pct_cancelled < 20:
-                # Generate random value between 1 and 100
-                randval = random.randint(1, 100)
-                # If the current percentage of cancellations is less than 10
-                # or the random value is less than 15, cancel the previous
-                # transaction
-                if pct_cancelled < 10 or randval < 15:
-                    do_trans = False
+            # Add initial transaction
+            try:
+                last_tid = self.gen_transaction(dest_ledger)
+            except Exception as e:
+                success = False
+
+            # Loop through the specified range (starting at 1 since the
+            # initial transaction was added above
+            for x in range(1, count):
+                do_trans = True
+                # Get the current percentage of cancelled transactions
+                pct_cancelled = self.cancelledCnt / x * 100
+
+                # If the last transaction was not a cancellation and the
+                # current percentage of cancellations is less than 20,
+                # consider whether a cancellation should be added
+                if last_tid > -1 and pct_cancelled < 20:
+                    # Generate random value between 1 and 100
+                    randval = random.randint(1, 100)
+                    # If the current percentage of cancellations is less than
+                    # 10 or the random value is less than 15, cancel the
+                    # previous transaction
+                    if pct_cancelled < 10 or randval < 15:
+                        do_trans = False
+                        try:
+                            last_tid = self.gen_cancellation(dest_ledger)
+                        except Exception as e:
+                            success = False
+                # If a cancellation wasn't added, then add a transaction
+                if do_trans:
                     try:
-                        last_tid = self.gen_cancellation(dest_ledger)
+                        last_tid = self.gen_transaction(dest_ledger)
                     except Exception as e:
                         success = False
-            # If a cancellation wasn't added, then add a transaction
-            if do_trans:
-                try:
-                    last_tid = self.gen_transaction(dest_ledger)
-                except Exception as e:
-                    success = False
+        finally:
+            # Leave the ledger without callbacks to this generator and
+            # stop any background mining, even if adding failed
+            dest_ledger.remove_new_block_callback(self.on_new_block)
+            self.stop_premining()
+            self.stop_miners()
 
         if success:
             logger.info('Generated and added %d transactions to ledger.',
                         count)
 
+    def on_new_block(self, dest_ledger):
+        """
+        Called by the ledger when the first transaction of a new block
+        arrives, to add the header of the new block. In pipelined mode the
+        header mined in the background is used, and mining of the following
+        header starts. Each shard of a sharded ledger calls this with its
+        own ledger object, possibly from parallel threads, and has its own
+        chain of headers.
+
+        Parameters:
+            self : the instance of the class
+            dest_ledger : the ledger object that started the new block
+
+        Returns:
+            N/A
+        """
+        logger.info('%s: Starting new block...', __name__)
+        state = self.mining_state(dest_ledger)
+        # Continue the ledger's chain of hashes, which a reopened ledger
+        # already has
+        state.prev_hash = dest_ledger.last_hash or TranGEN.GENESIS_HASH
+        result = None
+        if self.pipelined:
+            result = self.take_premined(state)
+        if result is None:
+            self.start_new_block(dest_ledger, state)
+        else:
+            logger.info('%s: Using the header mined in the background',
+                        __name__)
+            self.add_mined_header(dest_ledger, state, result)
+        if self.pipelined:
+            self.start_premining(dest_ledger, state)
+
+    def mining_state(self, dest_ledger):
+        """
+        Gets the mining state of a ledger, creating it for a new ledger
+
+        Parameters:
+            self : the instance of the class
+            dest_ledger : the ledger object, or shard ledger object
+
+        Returns:
+            The MiningState object of the ledger
+        """
+        with self.mining_states_lock:
+            state = self.mining_states.get(dest_ledger)
+            if state is None:
+                state = MiningState(TranGEN.GENESIS_HASH,
+                                    self.difficulty_bits)
+                self.mining_states[dest_ledger] = state
+            return state
+
     def gen_transaction(self, dest_ledger):
         """
         Generates a single transaction (non-cancellation) and adds it to the
@@ -215,80 +374,295 @@ class TranGEN(object):
         # Return the sender index and the sender dictionary
         return sender_idx, sender
 
-    def start_new_block(self, dest_ledger):
+    def start_new_block(self, dest_ledger, state):
         """
-        Performs a crypto-mining contest to create a new block
+        Performs a crypto-mining contest to create a new block. When the
+        miners race concurrently, the first one to find a valid hash wins
+        and the others are stopped; otherwise each miner mines in turn and
+        the fastest one wins.
 
         Parameters:
             self : the instance of the class
             dest_ledger : the ledger object to which the new block will be
                           added
+            state : the MiningState object of the ledger
 
         Returns:
             N/A
         """
-        # The names of all miners
-        miner_names = ['Alice', 'Bob', 'Charlie']
-        # Stores all miner objects
-        miners = {}
-        # Stores the elapsed time for each miner
-        elapsed = {}
+        result = self.run_contest(state.prev_hash, state.difficulty_bits,
+                                  dest_ledger.uncommitted_merkle_roots(),
+                                  self.new_stop_event())
+        self.add_mined_header(dest_ledger, state, result)
 
-        logger.info('%s: Initiating mining to start new block...', __name__)
+    def run_contest(self, prev_hash, bits, merkle_roots, stop_event):
+        """
+        Runs a mining contest for the header following prev_hash
 
-        # Loop through the list of miner names and direct each to mine
-        for miner_name in miner_names:
-            elapsed[miner_name] = self.do_mining(miner_name, miners)
+        Parameters:
+            self : the instance of the class
+            prev_hash : the hash of the previous block header
+            bits : the difficulty in bits
+            merkle_roots : the Merkle roots of the sealed blocks the header
+                           commits to
+            stop_event : the event returned by new_stop_event that stops
+                         the miners, set when a miner wins or to abandon
+                         the contest
+
+        Returns:
+            A (winner, block header, hash hex, contest time) tuple, or None
+            if the contest was abandoned
+        """
+        logger.info('%s: Initiating mining to start new block...', __name__)
 
-        # See who finished first
-        winner = min(elapsed, key=elapsed.get)
+        start = time.time()
+        if self.mining_executor is None:
+            result = self.run_serial_contest(prev_hash, bits, merkle_roots,
+                                             stop_event)
+        else:
+            result = self.run_concurrent_contest(prev_hash, bits,
+                                                 merkle_roots, stop_event)
+        # Stop the losing miners, which then finish their tasks
+        abandoned = stop_event.is_set()
+        stop_event.set()
+
+        if result is None:
+            if abandoned:
+                return None
+            raise RuntimeError('No miner produced a block header')
+        winner, block_hdr, hash_hex, elapsed = result
         logger.info('%s: The winning miner is %s', __name__, winner)
+        return winner, block_hdr, hash_hex, time.time() - start
 
-        # Get the block header from winning miner object and add the block
-        # header to the new block
-        logger.info('%s: Adding header to new block. Header: %s', __name__,
-                    miners[winner].block_hdr)
-        dest_ledger.add_block_header(miners[winner].block_hdr)
+    def run_serial_contest(self, prev_hash, bits, merkle_roots, stop_event):
+        """
+        Lets each miner mine the header in turn in the calling process. The
+        miner with the shortest mining time wins.
 
-        # Get the resulting hash from winning miner object and save the hash
-        # so it can be included in the header when the next block is created
-        logger.info('%s: Setting previous hash to: %s', __name__,
-                    miners[winner].hash_hex)
-        self.prev_hash = miners[winner].hash_hex
+        Parameters:
+            self : the instance of the class
+            prev_hash : the hash of the previous block header
+            bits : the difficulty in bits
+            merkle_roots : the Merkle roots of the sealed blocks the header
+                           commits to
+            stop_event : the event that abandons the contest
 
-    def do_mining(self, miner_name, miners):
+        Returns:
+            The tuple returned by mine_header for the winner, or None if no
+            miner produced a header
         """
-        Performs crypto-mining by an individual miner
+        results = []
+        for miner_name in TranGEN.MINER_NAMES:
+            try:
+                found = mine_header(miner_name, prev_hash, bits,
+                                    merkle_roots, stop_event)
+            except Exception as e:
+                logger.error('Error for a miner when mining. Msg: %s', e)
+                continue
+            if found is None:
+                # The contest was abandoned
+                return None
+            results.append(found)
+        if not results:
+            return None
+        return min(results, key=lambda found: found[3])
+
+    def run_concurrent_contest(self, prev_hash, bits, merkle_roots,
+                               stop_event):
+        """
+        Races the miners at the same time in the worker processes. The
+        first miner to find a valid hash wins.
 
         Parameters:
             self : the instance of the class
-            miner_name : the name of the miner who will be mining
-            miners : a dictionary that this method populates with individual
-                     miners
+            prev_hash : the hash of the previous block header
+            bits : the difficulty in bits
+            merkle_roots : the Merkle roots of the sealed blocks the header
+                           commits to
+            stop_event : the manager event that stops the miners
 
         Returns:
-            elapsed : the elapsed time for the miner
+            The tuple returned by mine_header for the winner, or None if no
+            miner produced a header
         """
-        # Create the miner object with the specified name
-        current_miner = miner.Miner(miner_name)
+        # Start every miner, then wait for the first valid result
+        result = None
+        pending = {self.mining_executor.submit(mine_header, miner_name,
+                                               prev_hash, bits, merkle_roots,
+                                               stop_event)
+                   for miner_name in TranGEN.MINER_NAMES}
+        while result is None and pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    if future.result() is not None and result is None:
+                        result = future.result()
+                except Exception as e:
+                    logger.error('Error for a miner when mining. Msg: %s', e)
+        return result
 
-        # Add the miner to the miners dictionary
-        miners[miner_name] = current_miner
+    def add_mined_header(self, dest_ledger, state, result):
+        """
+        Adds the header won in a mining contest to the ledger's new block
 
-        # Initiate mining
-        logger.info('%s: Miner %s is going to work...', __name__, miner_name)
+        Parameters:
+            self : the instance of the class
+            dest_ledger : the ledger object to which the new block will be
+                          added
+            state : the MiningState object of the ledger
+            result : the tuple returned by run_contest
+
+        Returns:
+            N/A
+        """
+        winner, block_hdr, hash_hex, contest_time = result
+
+        # Get the block header from winning miner and add the block header
+        # to the new block
+        logger.info('%s: Adding header to new block. Header: %s', __name__,
+                    block_hdr)
+        dest_ledger.add_block_header(block_hdr)
+
+        # Get the resulting hash from winning miner and save the hash so it
+        # can be included in the header when the next block is created
+        logger.info('%s: Setting previous hash to: %s', __name__, hash_hex)
+        state.prev_hash = hash_hex
+
+        # Retarget the difficulty from the time taken to mine the block
+        if self.retarget is not None:
+            bits = self.retarget.adjust(state.difficulty_bits, contest_time)
+            if bits != state.difficulty_bits:
+                logger.info('%s: Retargeting difficulty from %d to %d bits',
+                            __name__, state.difficulty_bits, bits)
+            state.difficulty_bits = bits
+
+    def start_premining(self, dest_ledger, state):
+        """
+        Starts mining the header of the next block in a background thread,
+        as soon as the hash of the current block header is known, so it
+        overlaps with adding the current block's transactions. The current
+        block is not sealed yet, so its Merkle root is committed to by the
+        header after the next one.
+
+        Parameters:
+            self : the instance of the class
+            dest_ledger : the ledger object to which the next block will be
+                          added
+            state : the MiningState object of the ledger
+
+        Returns:
+            N/A
+        """
+        if state.premine_executor is None:
+            state.premine_executor = ThreadPoolExecutor(max_workers=1)
+        state.premine_stop = self.new_stop_event()
+        state.premine_prev_hash = state.prev_hash
+        state.premine_future = state.premine_executor.submit(
+            self.run_contest, state.prev_hash, state.difficulty_bits,
+            dest_ledger.uncommitted_merkle_roots(), state.premine_stop)
+
+    def start_miners(self):
+        """
+        Starts the worker processes of the miners and the manager of the
+        contests' stop events when the miners race concurrently. They are
+        started once from the calling thread, with the start method of
+        miner.MP_CONTEXT, and reused by every contest, including those run
+        from the background mining thread. If they cannot be started, e.g.
+        without shared memory for their locks, the miners mine one after
+        another instead.
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            N/A
+        """
+        if not self.concurrent:
+            return
         try:
-            start = time.time()
-            current_miner.do_work(self.prev_hash)
-            end = time.time()
-
-            # Upon completion of mining, calculate elapsed time
-            elapsed = end - start
-            logger.info('%s: %s finished mining with elapsed time: %s',
-                        __name__, miner_name, elapsed)
-        except Exception as e:
-            logger.error('Error for miner %s when mining. Msg: %s',
-                         miner_name, e)
+            self.mining_manager = miner.MP_CONTEXT.Manager()
+            self.mining_executor = ProcessPoolExecutor(
+                max_workers=len(TranGEN.MINER_NAMES),
+                mp_context=miner.MP_CONTEXT)
+        except (OSError, ImportError, NotImplementedError) as e:
+            logger.warning('Cannot start the miner processes, mining '
+                           'serially. Msg: %s', e)
+            self.stop_miners()
+
+    def new_stop_event(self):
+        """
+        Creates the stop event of a new mining contest
 
-        # Return the elapsed time
-        return elapsed
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            An event shared with the worker processes through the manager
+            when the miners race concurrently, or a threading.Event
+        """
+        if self.mining_executor is None:
+            return threading.Event()
+        return self.mining_manager.Event()
+
+    def stop_miners(self):
+        """
+        Shuts down the worker processes of the miners and the manager of
+        the contests' stop events
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            N/A
+        """
+        if self.mining_executor is not None:
+            self.mining_executor.shutdown()
+            self.mining_executor = None
+        if self.mining_manager is not None:
+            self.mining_manager.shutdown()
+            self.mining_manager = None
+
+    def stop_premining(self):
+        """
+        Abandons the background mining of the next block headers of every
+        ledger, if any, and waits for their miners to stop
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            N/A
+        """
+        with self.mining_states_lock:
+            states = list(self.mining_states.values())
+        for state in states:
+            if state.premine_future is not None:
+                state.premine_stop.set()
+                state.premine_future.result()
+                state.premine_future = None
+            if state.premine_executor is not None:
+                state.premine_executor.shutdown()
+                state.premine_executor = None
+
+    def take_premined(self, state):
+        """
+        Collects the header mined in the background, waiting for the
+        contest to finish if necessary
+
+        Parameters:
+            self : the instance of the class
+            state : the MiningState object of the ledger
+
+        Returns:
+            The tuple returned by run_contest, or None if no usable header
+            was mined in the background
+        """
+        future, state.premine_future = state.premine_future, None
+        if future is None:
+            return None
+        # The header must follow the current last block header; abandon a
+        # contest for another chain without waiting for it
+        if state.premine_prev_hash != state.prev_hash:
+            state.premine_stop.set()
+            return None
+        return future.result()
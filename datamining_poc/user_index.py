@@ -0,0 +1,191 @@
+import heapq
+
+# Orderings supported by UserIndex.top_users
+TOP_TRANSACTIONS = 'transactions'
+TOP_BALANCE = 'balance'
+TOP_VOLUME = 'volume'
+
+
+class UserIndex(object):
+    """
+    UserIndex - a secondary index mapping each user to the transactions they
+                sent or received (their postings), together with their
+                running balance and volume. It is maintained on every write,
+                so one user's history and balance can be found without
+                scanning the ledger. Amounts of cancelled transactions are
+                excluded from the balances and volumes.
+
+    """
+    def __init__(self):
+        """
+        Initializes an empty instance of the UserIndex class
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            N/A
+        """
+        # Maps each user to a list of [tid, block number] postings
+        self.postings = {}
+        # Maps each user to the amount received minus the amount sent
+        self.balances = {}
+        # Maps each user to the amount sent plus the amount received
+        self.volumes = {}
+
+    def add(self, transaction, filenum, original=None):
+        """
+        Adds a transaction or cancellation record to the index
+
+        Parameters:
+            self : the instance of the class
+            transaction : the transaction dictionary being added
+            filenum : the number of the block holding the transaction
+            original : for a cancellation record, the transaction it
+                       cancels, whose amount is backed out of the balances
+
+        Returns:
+            N/A
+        """
+        if 'cancelled_tid' in transaction:
+            if original is not None:
+                self.apply_amount(original, -1)
+            return
+
+        sender = transaction.get('sender')
+        receiver = transaction.get('receiver')
+        posting = [transaction['tid'], filenum]
+        for user in (sender, receiver):
+            if user is None:
+                continue
+            postings = self.postings.setdefault(user, [])
+            # A user sending to themselves gets a single posting
+            if not postings or postings[-1] != posting:
+                postings.append(posting)
+            self.balances.setdefault(user, 0)
+            self.volumes.setdefault(user, 0)
+
+        self.apply_amount(transaction, 1)
+
+    def apply_amount(self, transaction, sign):
+        """
+        Adds a transaction's amount to, or removes it from, the balances and
+        volumes of its sender and receiver
+
+        Parameters:
+            self : the instance of the class
+            transaction : the transaction dictionary
+            sign : 1 to add the amount, -1 to remove it
+
+        Returns:
+            N/A
+        """
+        amount = transaction.get('amount')
+        if amount is None:
+            return
+        sender = transaction.get('sender')
+        receiver = transaction.get('receiver')
+        if sender is not None:
+            self.balances[sender] = (self.balances.get(sender, 0)
+                                     - sign * amount)
+            self.volumes[sender] = self.volumes.get(sender, 0) + sign * amount
+        if receiver is not None:
+            self.balances[receiver] = (self.balances.get(receiver, 0)
+                                       + sign * amount)
+            self.volumes[receiver] = (self.volumes.get(receiver, 0)
+                                      + sign * amount)
+
+    def history(self, user):
+        """
+        Returns the postings of a user
+
+        Parameters:
+            self : the instance of the class
+            user : the name of the user
+
+        Returns:
+            A list of (tid, block number) tuples in tid order
+        """
+        return [tuple(posting) for posting in self.postings.get(user, [])]
+
+    def balance(self, user):
+        """
+        Returns the balance of a user
+
+        Parameters:
+            self : the instance of the class
+            user : the name of the user
+
+        Returns:
+            The amount the user received minus the amount they sent
+        """
+        return self.balances.get(user, 0)
+
+    def top_users(self, n, by=TOP_TRANSACTIONS):
+        """
+        Returns the n users with the most transactions, the highest balance
+        or the highest volume
+
+        Parameters:
+            self : the instance of the class
+            n : the number of users to return
+            by : TOP_TRANSACTIONS, TOP_BALANCE or TOP_VOLUME
+
+        Returns:
+            A list of (user, value) tuples, highest value first
+        """
+        if by == TOP_TRANSACTIONS:
+            values = {user: len(postings)
+                      for user, postings in self.postings.items()}
+        elif by == TOP_BALANCE:
+            values = self.balances
+        elif by == TOP_VOLUME:
+            values = self.volumes
+        else:
+            raise ValueError('Unknown top users ordering: ' + str(by))
+        return heapq.nlargest(n, values.items(), key=lambda item: item[1])
+
+    def users(self):
+        """
+        Returns the names of all users in the index
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            A list of user names in the order they first appeared
+        """
+        return list(self.postings)
+
+    def to_dict(self):
+        """
+        Converts the index into a dictionary that can be stored as JSON
+
+        Parameters:
+            self : the instance of the class
+
+        Returns:
+            A dictionary containing the index
+        """
+        return {'postings': self.postings,
+                'balances': self.balances,
+                'volumes': self.volumes}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Creates a UserIndex object from a dictionary produced by to_dict
+
+        Parameters:
+            cls : the UserIndex class
+            data : the dictionary holding the index
+
+        Returns:
+            index : the restored UserIndex object
+        """
+        index = cls()
+        index.postings = {user: [list(p) for p in postings]
+                          for user, postings in data['postings'].items()}
+        index.balances = dict(data['balances'])
+        index.volumes = dict(data['volumes'])
+        return index